@@ -81,7 +81,25 @@ namespace Celeste.Mod.RL
         private int ts;
 
 
-        private SKData obsBitmap;
+        /// <summary>
+        /// Latest rendered observation, published by RenderObs and read by SendObs.
+        /// A frame is never written to once published, each render builds a new one.
+        /// </summary>
+        private sealed class ObsFrame
+        {
+            // raw rgb pixels in binary mode, png in json mode
+            public byte[] Pixels;
+            public SKData Png;
+            public int Width;
+            public int Height;
+        }
+        private ObsFrame obsFrame;
+
+        // Wire protocol negotiated on reset, see RLCode/celeste_rl/protocol.py
+        private const int JSON_PROTOCOL = 1;
+        private const int BINARY_PROTOCOL = 2;
+        private int protocol;
+        private uint step;
 
         private Vector2 playerSpawn;
         private Vector2 playerSpawnC;
@@ -130,7 +148,9 @@ namespace Celeste.Mod.RL
 
             bestX = 0;
             bestY = 0;
-            obsBitmap = null;
+            obsFrame = null;
+            protocol = JSON_PROTOCOL;
+            step = 0;
 
             reward = 0;
             ts = 0;
@@ -230,7 +250,30 @@ namespace Celeste.Mod.RL
             var worked = bitmap.ExtractSubset(subset, rectI);
 
 
-            obsBitmap = subset.Resize(new SKImageInfo(42, 42), (SKFilterQuality)Settings.Downsampling).Encode(SKEncodedImageFormat.Png, 0);
+            using var resized = subset.Resize(new SKImageInfo(42, 42, SKColorType.Rgba8888), (SKFilterQuality)Settings.Downsampling);
+
+            var frame = new ObsFrame { Width = resized.Width, Height = resized.Height };
+            if (protocol == BINARY_PROTOCOL)
+            {
+                // Raw rgb pixels, client reads them with np.frombuffer. The rgba pixels are read in place
+                // and written straight into the reply buffer, a fresh one per frame since SendObs may still be sending the last one
+                ReadOnlySpan<byte> rgba = resized.GetPixelSpan();
+                byte[] pixels = new byte[frame.Width * frame.Height * 3];
+                for (int src = 0, dst = 0; dst < pixels.Length; src += 4, dst += 3)
+                {
+                    pixels[dst] = rgba[src];
+                    pixels[dst + 1] = rgba[src + 1];
+                    pixels[dst + 2] = rgba[src + 2];
+                }
+                frame.Pixels = pixels;
+            }
+            else
+            {
+                // Json replies carry a png, only encoded in json mode
+                frame.Png = resized.Encode(SKEncodedImageFormat.Png, 0);
+            }
+            // published once complete, SendObs only ever sees whole frames
+            Interlocked.Exchange(ref obsFrame, frame);
 
         }
 
@@ -362,7 +405,7 @@ namespace Celeste.Mod.RL
         {
             while (runThread)
             {
-                if (obsBitmap is not null)
+                if (Volatile.Read(ref obsFrame) is not null)
                 {
 
                     string clpay = server.ReceiveFrameString();
@@ -374,12 +417,32 @@ namespace Celeste.Mod.RL
                     prevPlayerPos = playerPos;
                     fullReward = reward + dist;
 
-                    string payload = JsonConvert.SerializeObject(
-                        new List<object>() { obsBitmap.ToArray(), fullReward, terminated }
-                    );
-                    server.SendFrame(payload);
+                    bool resetRequested = inputFrame != null && (inputFrame.Count == 1 || inputFrame.Count == 2) && inputFrame[0] == 1;
+                    if (resetRequested)
+                    {
+                        // [1] is the legacy handshake, [1, version] asks for a given protocol
+                        protocol = inputFrame.Count == 2 ? Math.Min((int)inputFrame[1], BINARY_PROTOCOL) : JSON_PROTOCOL;
+                        step = 0;
+                    }
 
-                    if (terminated || (inputFrame != null && inputFrame.Count == 1 && inputFrame[0] == 1))
+                    // read once, RenderObs may publish the next frame while this one is sent
+                    ObsFrame frame = Volatile.Read(ref obsFrame);
+                    if (protocol == BINARY_PROTOCOL && frame.Pixels is not null)
+                    {
+                        server.SendMoreFrame(EncodeHeader(fullReward, terminated, step, frame.Height, frame.Width)).SendFrame(frame.Pixels);
+                    }
+                    else
+                    {
+                        // a json reset right after binary frames, the last frame has no png yet
+                        SKData png = frame.Png ?? EncodePng(frame.Pixels, frame.Width, frame.Height);
+                        string payload = JsonConvert.SerializeObject(
+                            new List<object>() { png.ToArray(), fullReward, terminated }
+                        );
+                        server.SendFrame(payload);
+                    }
+                    step++;
+
+                    if (terminated || resetRequested)
                     {
                         terminated = false;
                         inputFrame = null;
@@ -403,6 +466,41 @@ namespace Celeste.Mod.RL
             }
         }
 
+        /// <summary>
+        /// Fixed layout header of binary replies, must match HEADER_DTYPE in celeste_rl/protocol.py
+        /// </summary>
+        private static byte[] EncodeHeader(double reward, bool terminated, uint step, int height, int width)
+        {
+            byte[] header = new byte[20];
+            BitConverter.GetBytes(reward).CopyTo(header, 0);
+            BitConverter.GetBytes(step).CopyTo(header, 8);
+            BitConverter.GetBytes((ushort)height).CopyTo(header, 12);
+            BitConverter.GetBytes((ushort)width).CopyTo(header, 14);
+            header[16] = BINARY_PROTOCOL;
+            header[17] = 3;
+            header[18] = (byte)(terminated ? 1 : 0);
+            header[19] = 0;
+            return header;
+        }
+
+        /// <summary>
+        /// Png of a frame captured as raw rgb pixels, for a json reply after the protocol changed
+        /// </summary>
+        private static SKData EncodePng(byte[] rgb, int width, int height)
+        {
+            using var bitmap = new SKBitmap(new SKImageInfo(width, height, SKColorType.Rgba8888));
+            byte[] rgba = new byte[width * height * 4];
+            for (int src = 0, dst = 0; src < rgb.Length; src += 3, dst += 4)
+            {
+                rgba[dst] = rgb[src];
+                rgba[dst + 1] = rgb[src + 1];
+                rgba[dst + 2] = rgb[src + 2];
+                rgba[dst + 3] = 255;
+            }
+            Marshal.Copy(rgba, 0, bitmap.GetPixels(), rgba.Length);
+            return bitmap.Encode(SKEncodedImageFormat.Png, 0);
+        }
+
         private void updatePayload()
         {
 
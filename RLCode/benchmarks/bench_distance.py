@@ -0,0 +1,49 @@
+"""
+DistanceIndex: cost of building a room's field (computed, then loaded from the disk cache) and of the
+per-step lookups, single and batched. Parity with a plain queue BFS is checked in tests/test_distance.py.
+
+Run from RLCode/ with: python -m benchmarks.bench_distance [--rooms 16] [--batch-size 32]
+"""
+import argparse
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.suite import measure
+from celeste_rl.distance import DistanceIndex
+from celeste_rl.server import synthetic_payload
+
+
+def build_all(index, rooms):
+    start = time.perf_counter()
+    for payload in rooms:
+        index.room(payload)
+    return (time.perf_counter() - start) / len(rooms) * 1e3
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rooms', type=int, default=16)
+    parser.add_argument('--room-size', type=int, nargs=2, default=[40, 23], help='width height in tiles')
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--n', type=int, default=2000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    rooms = [synthetic_payload(rng, room_size=tuple(args.room_size), origin=(i * 8 * args.room_size[0], 0))
+             for i in range(args.rooms)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        built = build_all(DistanceIndex(tmp), rooms)
+        loaded = build_all(DistanceIndex(tmp), rooms)
+        index = DistanceIndex(tmp)
+        single = measure(lambda: index.distance(rooms[0]), args.n)
+        batch = [rooms[i % len(rooms)] for i in range(args.batch_size)]
+        out = np.empty(args.batch_size, dtype=np.float32)
+        batched = measure(lambda: index.distances(batch, out=out), max(args.n // args.batch_size, 5),
+                          items=args.batch_size)
+
+    print(f'field per room: computed {built:.2f} ms, loaded from disk {loaded:.2f} ms')
+    print(f'lookup: single p50 {single["p50_us"]:.1f} us, batch of {args.batch_size} '
+          f'{batched["steps_per_s"]:.0f} lookups/s (p50 {batched["p50_us"]:.1f} us per batch)')
@@ -0,0 +1,50 @@
+"""
+Import time of the core package (env, protocol, numpy rendering), measured with python -X importtime
+in a fresh interpreter, and the slowest modules it pulls in. The budget and the absence of the optional
+extras are checked by tests/test_imports.py.
+
+Run from RLCode/ with: python -m benchmarks.bench_import
+"""
+import argparse
+import subprocess
+import sys
+
+CORE = ['celeste_rl.env', 'celeste_rl.vec_env', 'celeste_rl.protocol', 'celeste_rl.level', 'celeste_rl.server',
+        'celeste_rl.wrappers', 'celeste_rl.recorder', 'celeste_rl.metrics']
+
+
+def import_times(modules):
+    """
+    {module: (self us, cumulative us)} of every module imported by a fresh interpreter importing modules,
+    and the total time spent importing
+    """
+    code = 'import ' + ', '.join(modules)
+    stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                            capture_output=True, text=True, check=True).stderr
+    times = {}
+    total = 0
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = (int(own), int(cumulative))
+        # nested imports are indented, top level ones add up to the whole import
+        if not name[1:].startswith(' '):
+            total += int(cumulative)
+    return times, total
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--modules', nargs='+', default=CORE)
+    parser.add_argument('--top', type=int, default=10, help='number of slowest modules to show')
+    parser.add_argument('--repeat', type=int, default=3, help='best of n runs, first runs pay for cold caches')
+    args = parser.parse_args()
+
+    times, total = min((import_times(args.modules) for _ in range(args.repeat)), key=lambda run: run[1])
+    total /= 1e3
+
+    print(f'{"module":45s} {"self ms":>10s} {"cumul ms":>10s}')
+    for name, (own, cumulative) in sorted(times.items(), key=lambda item: -item[1][0])[:args.top]:
+        print(f'{name:45s} {own / 1e3:10.1f} {cumulative / 1e3:10.1f}')
+    print(f'\ntotal {total:.1f} ms')
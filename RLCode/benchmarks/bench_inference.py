@@ -0,0 +1,106 @@
+"""
+Central InferenceServer against every rollout worker running its own copy of the policy: K workers each
+with B envs, the local policy runs K forwards of B rows, the server batches them into fewer larger ones.
+
+The server runs in its own process, the workers are threads of this one.
+
+Run from RLCode/ with: python -m benchmarks.bench_inference [--workers 8] [--envs 1 8]
+"""
+import argparse
+import multiprocessing
+import threading
+import time
+
+import numpy as np
+import torch as th
+
+from celeste_rl.inference import InferenceClient, InferenceServer, PolicyNetwork
+from celeste_rl.level import LevelRenderer
+
+ENDPOINT = 'ipc:///tmp/celeste-bench-policy'
+
+
+def observations(space, batch_size, rng):
+    return {key: rng.random((batch_size, *subspace.shape)).astype(subspace.dtype)
+            for key, subspace in space.spaces.items()}
+
+
+def serve(args, stop, ready):
+    th.manual_seed(0)
+    th.set_num_threads(args.threads)
+    policy = PolicyNetwork(LevelRenderer.observation_space(args.vision_size), args.n_actions)
+    server = InferenceServer(policy, ENDPOINT, max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms)
+    with server:
+        ready.set()
+        stop.wait()
+
+
+def local(args, envs):
+    """Rows per second of K workers each running their policy on B rows, one after the other"""
+    space = LevelRenderer.observation_space(args.vision_size)
+    policy = PolicyNetwork(space, args.n_actions).eval()
+    obs = observations(space, envs, np.random.default_rng(0))
+    state = None
+    with th.no_grad():
+        policy(obs)
+        start = time.perf_counter()
+        for _ in range(args.steps):
+            for _ in range(args.workers):
+                logits, _, state = policy(obs, state)
+                th.distributions.Categorical(logits=logits).sample()
+    return args.steps * args.workers * envs / (time.perf_counter() - start)
+
+
+def remote(args, envs):
+    """Rows per second and p50 request latency in ms of K worker threads sharing the server"""
+    space = LevelRenderer.observation_space(args.vision_size)
+    latencies = []
+
+    def worker(seed):
+        client = InferenceClient(ENDPOINT, space)
+        obs = observations(space, envs, np.random.default_rng(seed))
+        first = np.ones(envs, dtype=bool)
+        client.act(obs, first)
+        for _ in range(args.steps):
+            start = time.perf_counter()
+            client.act(obs, ~first)
+            latencies.append(time.perf_counter() - start)
+        client.close()
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(args.workers)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    rate = (args.steps + 1) * args.workers * envs / (time.perf_counter() - start)
+    return rate, np.median(latencies) * 1e3
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--envs', type=int, nargs='+', default=[1, 8], help='envs per worker, rows per request')
+    parser.add_argument('--steps', type=int, default=100)
+    parser.add_argument('--vision-size', type=int, default=42)
+    parser.add_argument('--n-actions', type=int, default=9)
+    parser.add_argument('--max-batch-size', type=int, default=64)
+    parser.add_argument('--max-wait-ms', type=float, default=2.0)
+    parser.add_argument('--threads', type=int, default=1, help='torch threads of the policy')
+    args = parser.parse_args()
+
+    th.set_num_threads(args.threads)
+    context = multiprocessing.get_context('spawn')
+    stop, ready = context.Event(), context.Event()
+    server = context.Process(target=serve, args=(args, stop, ready))
+    server.start()
+    ready.wait()
+    try:
+        for envs in args.envs:
+            local_rate = local(args, envs)
+            remote_rate, latency = remote(args, envs)
+            print(f'{args.workers} workers x {envs:3d} envs: local {local_rate:9.1f} rows/s, '
+                  f'server {remote_rate:9.1f} rows/s (p50 request {latency:6.2f} ms)')
+    finally:
+        stop.set()
+        server.join()
@@ -0,0 +1,75 @@
+"""
+MetricsAggregator against per-step python dict metrics: cost of recording one vec env step of
+rewards, actions and finished episodes, and memory after many steps.
+
+Run from RLCode/ with: python -m benchmarks.bench_metrics [--num-envs 32] [--steps 20000]
+"""
+import argparse
+import tracemalloc
+from collections import defaultdict
+
+import numpy as np
+
+from benchmarks.suite import measure
+from celeste_rl.metrics import MetricsAggregator
+
+
+def dict_metrics(store, rewards, actions, returns):
+    """Per-step python logging, what going through result dicts looks like"""
+    for reward, action in zip(rewards.tolist(), actions.tolist()):
+        store['reward'].append(reward)
+        store[f'action_{action}'].append(1)
+    store['episode_return'].extend(returns.tolist())
+
+
+def aggregator_metrics(metrics, rewards, actions, returns):
+    metrics.add('steps', len(rewards))
+    metrics.observe('reward', rewards)
+    metrics.count('actions', actions)
+    metrics.observe('episode_return', returns)
+
+
+def memory(record, steps):
+    tracemalloc.start()
+    for i in range(steps):
+        record(i)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size / 1e6
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num-envs', type=int, default=32)
+    parser.add_argument('--steps', type=int, default=20000, help='steps recorded for the memory comparison')
+    parser.add_argument('--n', type=int, default=5000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    batches = [(rng.normal(0, 1, args.num_envs), rng.integers(0, 9, args.num_envs),
+                rng.normal(20, 10, rng.integers(0, 2))) for _ in range(64)]
+
+    metrics = (MetricsAggregator().counter('steps').histogram('reward', -2, 12, n_bins=56)
+               .histogram('episode_return', -50, 200, n_bins=100).categorical('actions', 9))
+    store = defaultdict(list)
+
+    record_dict = lambda i: dict_metrics(store, *batches[i % len(batches)])
+    record_aggregator = lambda i: aggregator_metrics(metrics, *batches[i % len(batches)])
+    for name, record in [('python dicts', record_dict), ('MetricsAggregator', record_aggregator)]:
+        steps = iter(range(10 ** 9))
+        stats = measure(lambda: record(next(steps)), args.n, items=args.num_envs)
+        print(f'{name:18s} p50 {stats["p50_us"]:6.1f} us per vec env step of {args.num_envs} envs')
+
+    store.clear()
+    dict_mb = memory(record_dict, args.steps)
+    aggregator_mb = memory(record_aggregator, args.steps)
+    print(f'memory after {args.steps} steps: python dicts {dict_mb:.2f} MB, MetricsAggregator {aggregator_mb:.4f} MB')
+
+    # what a flush costs: quantiles of the stored values against reading the bins
+    summarize = lambda: {key: np.quantile(values, (0.5, 0.9, 0.99)) for key, values in store.items()
+                         if key in ('reward', 'episode_return')}
+    dict_flush = measure(summarize, 5)
+    aggregator_flush = measure(lambda: metrics.snapshot(reset=False), 50)
+    summary = metrics.snapshot()
+    assert summary['steps_total'] > 0 and summary['reward/count'] > 0
+    print(f'flush: python dicts {dict_flush["p50_us"] / 1e3:.2f} ms, MetricsAggregator {aggregator_flush["p50_us"] / 1e3:.2f} ms')
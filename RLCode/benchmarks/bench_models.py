@@ -0,0 +1,84 @@
+"""
+Policy forward passes on CPU: ImprovisedCNN eager and through each compile mode at several batch sizes,
+then a float PolicyNetwork against its exported artifacts (traced + frozen torchscript, and int8) at the
+small batch sizes of a rollout worker. Parity of all of them is checked in tests/test_models.py and
+tests/test_export.py, the export parity measured on rendered observations is printed here.
+
+Run from RLCode/ with: python -m benchmarks.bench_models [--batch-sizes 1 64 4096] [--export-batch-sizes 1 2 4 8]
+"""
+import argparse
+import tempfile
+import warnings
+
+import numpy as np
+import torch as th
+from gymnasium import spaces
+
+from benchmarks.suite import measure
+from celeste_rl.export import ExportedPolicy, export_policy
+from celeste_rl.inference import PolicyNetwork
+from celeste_rl.level import LevelRenderer
+from celeste_rl.models import ImprovisedCNN
+from celeste_rl.server import synthetic_payload
+
+
+def bench_cnn(args):
+    size = args.vision_size // 2 * 2
+    space = spaces.Box(low=0, high=1, shape=(LevelRenderer.max_idx + 1, size, size), dtype=np.float32)
+    models = {}
+    for mode in args.compile_modes:
+        th.manual_seed(0)
+        models[mode] = ImprovisedCNN(space, compile_mode=None if mode == 'eager' else mode)
+
+    with th.no_grad():
+        for batch_size in args.batch_sizes:
+            obs = (th.rand((batch_size, *space.shape)) > 0.8).float()
+            n = max(5, args.n // batch_size)
+            results = {mode: measure(lambda: model(obs), n, items=batch_size) for mode, model in models.items()}
+            print(f'ImprovisedCNN batch {batch_size:5d}: ' +
+                  ', '.join(f'{mode} {stats["p50_us"] / 1e3:8.3f} ms' for mode, stats in results.items()))
+
+
+def bench_export(args):
+    th.manual_seed(0)
+    policy = PolicyNetwork(LevelRenderer.observation_space(args.vision_size), n_actions=9).eval()
+    rng = np.random.default_rng(0)
+    payloads = [synthetic_payload(rng) for _ in range(args.observations)]
+    observations = LevelRenderer.create_obs_batch(payloads, 1, args.vision_size)
+
+    models = {'float': policy}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, int8 in [('torchscript', False), ('int8', True)]:
+            parity = export_policy(policy, observations, f'{tmp}/{name}', int8=int8)['parity']
+            models[name] = ExportedPolicy(f'{tmp}/{name}')
+            print(f'{name:12s} max logit error {parity["max_logit_error"]:.4f}, max value error '
+                  f'{parity["max_value_error"]:.4f}, max state error {parity["max_state_error"]:.4f}, '
+                  f'greedy action agreement {parity["action_agreement"]:.3f}')
+
+    for batch_size in args.export_batch_sizes:
+        batch = {key: value[:batch_size] for key, value in observations.items()}
+        with th.no_grad():
+            results = {name: measure(lambda: model(batch), max(5, args.n // 4), items=batch_size)
+                       for name, model in models.items()}
+        print(f'policy batch {batch_size:2d}: ' + ', '.join(f'{name} {stats["p50_us"]:8.1f} us'
+                                                           for name, stats in results.items()))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--vision-size', type=int, default=42)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 64, 4096])
+    parser.add_argument('--compile-modes', nargs='+', default=['eager', 'script'],
+                        choices=['eager', 'script', 'compile'])
+    parser.add_argument('--export-batch-sizes', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--observations', type=int, default=256, help='rendered observations to export with')
+    parser.add_argument('--threads', type=int, default=1)
+    parser.add_argument('--n', type=int, default=1200)
+    args = parser.parse_args()
+
+    # torch.ao.quantization and torch.jit deprecation warnings
+    warnings.filterwarnings('ignore', category=DeprecationWarning)
+    warnings.filterwarnings('ignore', category=FutureWarning)
+    th.set_num_threads(args.threads)
+    bench_cnn(args)
+    bench_export(args)
@@ -0,0 +1,98 @@
+"""
+Rendering of payloads into observations: LevelRenderer.create_obs against the per-room LevelCache,
+render_around_player on growing rooms, and create_obs_batch into preallocated (N, ...) buffers,
+sequential and on a thread pool, for the batch sizes of a vector env. Parity is checked in tests/test_level.py.
+
+Run from RLCode/ with: python -m benchmarks.bench_render [--payloads payloads.jsonl] [--batch-sizes 8 16 32]
+"""
+import argparse
+import itertools
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from benchmarks.suite import measure
+from celeste_rl.level import LevelCache, LevelRenderer
+from celeste_rl.server import synthetic_payload
+
+
+def load_payloads(path, n_steps, n_rooms, n_entities, seed=0):
+    if path is not None:
+        with open(path) as f:
+            return [json.loads(line) for line in f]
+
+    # a few rooms, in which only the player moves around
+    rng = np.random.default_rng(seed)
+    payloads = []
+    for room in range(n_rooms):
+        base = synthetic_payload(rng, n_entities=n_entities, origin=(room * 320, 0))
+        for _ in range(n_steps // n_rooms):
+            step = synthetic_payload(rng, n_entities=1, origin=(room * 320, 0))
+            payloads.append(dict(base, entities=step['entities'] + base['entities'][1:]))
+    return payloads
+
+
+def cycle(fn, items):
+    """fn over items in a loop, one item per call"""
+    items = itertools.cycle(items)
+    return lambda: fn(next(items))
+
+
+def bench_cache(args, payloads):
+    cache = LevelCache(args.scale, args.vision_size)
+    create_obs = measure(cycle(lambda p: LevelRenderer.create_obs(p, args.scale, args.vision_size), payloads), args.n)
+    cached = measure(cycle(cache.create_obs, payloads), args.n)
+    print(f'create_obs: {create_obs["steps_per_s"]:10.1f} obs/s')
+    print(f'LevelCache: {cached["steps_per_s"]:10.1f} obs/s ({cache.hits} hits, {cache.misses} misses)')
+
+
+def bench_crop(args, rng):
+    for room_size in [(40, 23), (80, 46), (160, 92)]:
+        renderer = LevelRenderer.from_payload(synthetic_payload(rng, room_size=room_size), args.scale, args.vision_size)
+        out = np.empty_like(renderer.render_around_player())
+        stats = measure(lambda: renderer.render_around_player(out=out), args.n)
+        print(f'render_around_player, room {room_size}: {stats["steps_per_s"]:10.1f}/s  p50 {stats["p50_us"]:6.1f} us')
+
+
+def bench_batch(args, rng):
+    executor = ThreadPoolExecutor(args.threads)
+    for batch_size in args.batch_sizes:
+        payloads = [synthetic_payload(rng, n_entities=args.entities) for _ in range(batch_size)]
+        out = LevelRenderer.batch_buffers(batch_size, args.vision_size, args.scale, compact=args.compact)
+        cache = LevelCache(args.scale, args.vision_size, maxsize=batch_size, compact=args.compact)
+        batch = lambda **kw: LevelRenderer.create_obs_batch(payloads, args.scale, args.vision_size,
+                                                            compact=args.compact, out=out, **kw)
+        loop = lambda: [LevelRenderer.create_obs(p, args.scale, args.vision_size, compact=args.compact)
+                        for p in payloads]
+
+        results = {'create_obs loop': loop,
+                   'create_obs_batch': batch,
+                   f'batch, {args.threads} threads': lambda: batch(executor=executor),
+                   'LevelCache batch': lambda: cache.create_obs_batch(payloads, out=out)}
+        n = max(args.n // batch_size, 5)
+        for name, fn in results.items():
+            stats = measure(fn, n, items=batch_size)
+            print(f'batch {batch_size:3d}  {name:20s} {stats["steps_per_s"]:10.1f} obs/s  '
+                  f'p50 {stats["p50_us"] / 1e3:7.2f} ms')
+    executor.shutdown()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--payloads', default=None, help='json lines file of recorded payloads')
+    parser.add_argument('--steps', type=int, default=2000, help='synthetic payloads of the LevelCache comparison')
+    parser.add_argument('--rooms', type=int, default=4)
+    parser.add_argument('--entities', type=int, default=30, help='entities per synthetic room')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[8, 16, 32])
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--scale', type=int, default=1)
+    parser.add_argument('--vision-size', type=int, default=32)
+    parser.add_argument('--compact', action='store_true', help='uint8 observations in the batched comparison')
+    parser.add_argument('--n', type=int, default=1000, help='observations per measurement')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    bench_cache(args, load_payloads(args.payloads, args.steps, args.rooms, args.entities))
+    bench_crop(args, rng)
+    bench_batch(args, rng)
@@ -0,0 +1,105 @@
+"""
+Observation transports: json and binary over tcp and ipc, and the shared memory frame ring, against a
+stand-in producer running in its own process. Then action repeat, one round trip per k frames instead of
+one per frame. Parity of the protocols and of action repeat is checked in tests/test_env.py.
+
+Copies of the frame between the producer's pixels and the observation handed to the policy:
+    json    png encode + base64, kernel send + receive, base64 + png decode
+    binary  2, kernel send + receive (zmq frames are sent and received without copy)
+    shm     1, the producer writes the slot, the observation is a view of it
+
+Run from RLCode/ with: python -m benchmarks.bench_transport [--shapes 42,42,3 256,256,3] [--latency 0.0002]
+"""
+import argparse
+import json
+import multiprocessing
+import time
+
+import zmq
+
+from benchmarks.suite import measure
+from celeste_rl.env import CelesteImgGym
+from celeste_rl.protocol import BINARY_PROTOCOL, JSON_PROTOCOL, SHM_PROTOCOL, action_message, reset_message
+from celeste_rl.server import StandInServer
+
+COPIES = {JSON_PROTOCOL: 'png+b64, 2, b64+png', BINARY_PROTOCOL: '2', SHM_PROTOCOL: '1'}
+NAMES = {JSON_PROTOCOL: 'json', BINARY_PROTOCOL: 'binary', SHM_PROTOCOL: 'shm'}
+
+
+def produce(endpoint, frame_shape, stop):
+    with StandInServer(0, frame_shape=frame_shape, episode_length=10 ** 9, endpoint=endpoint):
+        stop.wait()
+
+
+def wire_bytes(endpoint, protocol):
+    """Bytes of a step reply going through the socket"""
+    with zmq.Context.instance().socket(zmq.REQ) as sock:
+        sock.connect(endpoint)
+        sock.send_string(reset_message(protocol))
+        sock.recv_multipart()
+        sock.send_string(action_message([0] * 7))
+        return sum(len(frame) for frame in sock.recv_multipart())
+
+
+def run(transport, protocol, frame_shape, port, n):
+    endpoint = f'tcp://localhost:{port}' if transport == 'tcp' else f'ipc:///tmp/celeste-bench-{port}'
+    stop = multiprocessing.Event()
+    producer = multiprocessing.Process(target=produce, args=(endpoint.replace('localhost', '*'), frame_shape, stop))
+    producer.start()
+    try:
+        env = CelesteImgGym(port, endpoint=endpoint, protocol=protocol)
+        env.reset()
+        result = measure(lambda: env.step(0), n)
+        env.close()
+        result['wire_bytes'] = wire_bytes(endpoint, protocol)
+    finally:
+        stop.set()
+        producer.join()
+    return result
+
+
+def run_action_repeat(port, repeat, frames, latency):
+    with StandInServer(port, episode_length=10 ** 9, latency=latency):
+        env = CelesteImgGym(port, action_repeat=repeat)
+        env.reset()
+        start = time.perf_counter()
+        for i in range(frames // repeat):
+            env.step(i % env.action_space.n)
+        elapsed = time.perf_counter() - start
+        env.close()
+    return frames / elapsed, frames / repeat / elapsed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=7777)
+    parser.add_argument('--n', type=int, default=3000)
+    parser.add_argument('--shapes', nargs='+', default=['42,42,3', '256,256,3'])
+    parser.add_argument('--out', default=None, help='json file to write the results to')
+    parser.add_argument('--frames', type=int, default=4000, help='frames played per action repeat')
+    parser.add_argument('--repeats', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--latency', type=float, default=0.0, help='simulated game time per frame, in seconds')
+    args = parser.parse_args()
+    multiprocessing.set_start_method('spawn')
+
+    results = {}
+    port = args.port
+    for shape in args.shapes:
+        frame_shape = tuple(int(x) for x in shape.split(','))
+        for transport in ('tcp', 'ipc'):
+            for protocol in (JSON_PROTOCOL, BINARY_PROTOCOL, SHM_PROTOCOL):
+                name = f'{shape}/{transport}/{NAMES[protocol]}'
+                results[name] = r = run(transport, protocol, frame_shape, port, args.n)
+                port += 1
+                print(f"{name:25s} {r['steps_per_s']:10.1f} steps/s  p50 {r['p50_us']:8.1f} us  "
+                      f"p99 {r['p99_us']:8.1f} us  {r['wire_bytes']:8d} B/reply  copies {COPIES[protocol]}")
+
+    for repeat in args.repeats:
+        frames, decisions = run_action_repeat(port, repeat, args.frames, args.latency)
+        results[f'action_repeat/{repeat}'] = {'frames_per_s': frames, 'decisions_per_s': decisions}
+        port += 1
+        print(f'action repeat {repeat}: {frames:10.1f} frames/s, {decisions:10.1f} decisions/s')
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=1)
@@ -0,0 +1,197 @@
+"""
+End to end benchmark suite: throughput and latency percentiles of every stage between the game and the
+policy, against the stand-in server. Results are written as json, two runs can be compared to flag regressions.
+
+Run from RLCode/ with:
+    python -m benchmarks.suite --out results.json
+    python -m benchmarks.suite --compare baseline.json results.json [--threshold 0.1]
+"""
+import argparse
+import itertools
+import json
+import platform
+import sys
+import time
+
+import numpy as np
+import torch as th
+from gymnasium import spaces
+
+from celeste_rl.env import CelesteImgGym
+from celeste_rl.level import LevelRenderer
+from celeste_rl.models import CustomCombinedExtractor, ImprovisedCNN
+from celeste_rl.protocol import BINARY_PROTOCOL, JSON_PROTOCOL, decode_binary, encode_header, encode_png
+from celeste_rl.server import StandInPool, StandInServer, synthetic_payload
+from celeste_rl.vec_env import CelesteVecEnv
+
+PERCENTILES = (50, 95, 99)
+
+
+def measure(fn, n, items=1, warmup=3):
+    """
+    Times n calls of fn, each handling `items` steps / observations.
+
+    :return: dict of items per second and latency percentiles of a call in microseconds
+    """
+    for _ in range(warmup):
+        fn()
+    durations = np.empty(n, dtype=np.int64)
+    for i in range(n):
+        start = time.perf_counter_ns()
+        fn()
+        durations[i] = time.perf_counter_ns() - start
+
+    result = {'steps_per_s': items * n / (durations.sum() / 1e9), 'calls': n, 'items': items}
+    result.update({f'p{q}_us': float(v) / 1e3 for q, v in zip(PERCENTILES, np.percentile(durations, PERCENTILES))})
+    return result
+
+
+def bench_decode(args, results):
+    """CelesteImgGym._get_obs on both protocols, without the socket"""
+    frame = np.random.default_rng(0).integers(0, 256, size=(42, 42, 3), dtype=np.uint8)
+    env = CelesteImgGym(args.port)
+
+    png = encode_png(frame)
+    env.protocol = JSON_PROTOCOL
+    results['decode/json'] = measure(lambda: env._get_obs(png), args.n)
+
+    frames = [encode_header(0.0, False, 0, *frame.shape), frame.tobytes()]
+    env.protocol = BINARY_PROTOCOL
+    results['decode/binary'] = measure(lambda: env._get_obs(decode_binary(frames)[0]), args.n)
+
+
+def bench_round_trip(args, results):
+    """CelesteImgGym.step against one stand-in instance: send, wait, receive and decode"""
+    for name, protocol in [('json', JSON_PROTOCOL), ('binary', BINARY_PROTOCOL)]:
+        with StandInServer(args.port, episode_length=10 ** 9):
+            env = CelesteImgGym(args.port, protocol=protocol)
+            env.reset()
+            results[f'round_trip/{name}'] = measure(lambda: env.step(0), args.n)
+            env.close()
+
+
+def bench_renderer(args, results):
+    rng = np.random.default_rng(0)
+    payloads = [synthetic_payload(rng, n_entities=args.entities) for _ in range(args.payloads)]
+    renderers = [LevelRenderer.from_payload(p, 1, args.vision_size) for p in payloads]
+
+    def cycle(fn, items):
+        items = itertools.cycle(items)
+        return lambda: fn(next(items))
+
+    results['renderer/from_payload'] = measure(cycle(lambda p: LevelRenderer.from_payload(p, 1, args.vision_size), payloads), args.n)
+    results['renderer/create_obs'] = measure(cycle(lambda p: LevelRenderer.create_obs(p, 1, args.vision_size), payloads), args.n)
+    results['renderer/render_around_player'] = measure(cycle(lambda r: r.render_around_player(), renderers), args.n)
+
+    batch = payloads[:32]
+    out = LevelRenderer.batch_buffers(len(batch), args.vision_size)
+    results[f'renderer/create_obs_batch/{len(batch)}'] = measure(
+        lambda: LevelRenderer.create_obs_batch(batch, 1, args.vision_size, out=out), max(5, args.n // len(batch)),
+        items=len(batch))
+
+
+def bench_models(args, results):
+    th.manual_seed(0)
+    size = args.vision_size // 2 * 2
+    image_space = spaces.Box(low=0, high=1, shape=(LevelRenderer.max_idx + 1, size, size), dtype=np.float32)
+    cnn = ImprovisedCNN(image_space)
+
+    obs_space = LevelRenderer.observation_space(args.vision_size)
+    extractor = CustomCombinedExtractor(obs_space)
+
+    with th.no_grad():
+        for batch_size in args.batch_sizes:
+            n = max(5, args.n // batch_size)
+            image = (th.rand((batch_size, *image_space.shape)) > 0.8).float()
+            results[f'models/ImprovisedCNN/{batch_size}'] = measure(lambda: cnn(image), n, items=batch_size)
+
+            obs = {key: np.stack([space.sample() for _ in range(batch_size)]) for key, space in obs_space.spaces.items()}
+            results[f'models/CustomCombinedExtractor/{batch_size}'] = measure(lambda: extractor(obs), n, items=batch_size)
+
+
+def bench_full_loop(args, results):
+    """CelesteVecEnv stepping every instance of a stand-in pool, one call steps all instances"""
+    for n_instances in args.instances:
+        with StandInPool(args.port, n_instances, episode_length=args.episode_length):
+            env = CelesteVecEnv([args.port + i for i in range(n_instances)])
+            env.reset()
+            actions = np.zeros(n_instances, dtype=np.int64)
+            n = max(10, args.n // n_instances)
+            results[f'full_loop/{n_instances}'] = measure(lambda: env.step(actions), n, items=n_instances)
+            env.close()
+
+
+BENCHMARKS = {'decode': bench_decode,
+              'round_trip': bench_round_trip,
+              'renderer': bench_renderer,
+              'models': bench_models,
+              'full_loop': bench_full_loop}
+
+
+def compare(old, new, threshold):
+    """
+    Prints the relative change of every benchmark in both runs.
+
+    :return: names of the regressions: throughput down or median latency up by more than threshold,
+        p99 is only reported as it is too noisy to gate on
+    """
+    regressions = []
+    for name in sorted(set(old['results']) & set(new['results'])):
+        a, b = old['results'][name], new['results'][name]
+        speed = b['steps_per_s'] / a['steps_per_s'] - 1
+        median = b['p50_us'] / a['p50_us'] - 1
+        tail = b['p99_us'] / a['p99_us'] - 1
+        regressed = speed < -threshold or median > threshold
+        if regressed:
+            regressions.append(name)
+        print(f"{name:45s} {a['steps_per_s']:12.1f} -> {b['steps_per_s']:12.1f} steps/s ({speed:+7.1%}), "
+              f"p50 {median:+7.1%}, p99 {tail:+7.1%}{'  REGRESSION' if regressed else ''}")
+
+    for name in sorted(set(old['results']) ^ set(new['results'])):
+        print(f'{name:45s} only in {"old" if name in old["results"] else "new"} run')
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--out', default=None, help='json file to write the results to')
+    parser.add_argument('--compare', nargs=2, default=None, metavar=('OLD', 'NEW'))
+    parser.add_argument('--threshold', type=float, default=0.1, help='relative change counted as a regression')
+    parser.add_argument('--only', nargs='+', default=list(BENCHMARKS), choices=list(BENCHMARKS))
+    parser.add_argument('--n', type=int, default=2000, help='calls per benchmark (divided by the batch size)')
+    parser.add_argument('--port', type=int, default=7777)
+    parser.add_argument('--payloads', type=int, default=64)
+    parser.add_argument('--entities', type=int, default=30)
+    parser.add_argument('--vision-size', type=int, default=42)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 8, 64, 512])
+    parser.add_argument('--instances', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument('--episode-length', type=int, default=200)
+    args = parser.parse_args()
+
+    if args.compare:
+        runs = []
+        for path in args.compare:
+            with open(path) as f:
+                runs.append(json.load(f))
+        regressions = compare(*runs, args.threshold)
+        print(f'{len(regressions)} regression(s)')
+        sys.exit(1 if regressions else 0)
+
+    results = {}
+    for name in args.only:
+        BENCHMARKS[name](args, results)
+        for key in [key for key in results if key.startswith(name)]:
+            r = results[key]
+            print(f"{key:45s} {r['steps_per_s']:12.1f} steps/s  "
+                  + '  '.join(f"p{q} {r[f'p{q}_us']:9.1f} us" for q in PERCENTILES))
+
+    run = {'meta': {'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                    'python': platform.python_version(),
+                    'torch': th.__version__,
+                    'numpy': np.__version__,
+                    'machine': platform.machine(),
+                    'args': vars(args)},
+           'results': results}
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(run, f, indent=1)
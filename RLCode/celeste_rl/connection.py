@@ -0,0 +1,113 @@
+import time
+
+import zmq
+
+
+class InstanceUnhealthy(ConnectionError):
+    """A game instance did not answer after every retry"""
+
+
+class Connection:
+    """
+    REQ socket to one game instance, kept open across episodes.
+
+    Every connection of the process shares zmq.Context.instance(). Replies are awaited through a
+    poller so a frozen or crashed game raises TimeoutError instead of blocking forever. The socket
+    is REQ_RELAXED / REQ_CORRELATE, a new request can be sent after a timeout and the late reply
+    to the old one is dropped; `reset` closes and reopens it if the instance stays silent.
+
+    Consecutive failures make the instance unhealthy and push back the next reconnect attempt
+    with an exponential backoff, `ready` tells whether it is time to try again.
+
+    There are no heartbeats: the game's REP socket only answers actions and resets, both of which advance
+    it, so a request timing out is the only liveness signal. A dead instance is noticed on the first request
+    it does not answer, and the reset sent once its backoff is over is what probes it again.
+
+    :param endpoint: zmq endpoint of the game, e.g. tcp://localhost:7777
+    :param timeout: milliseconds to wait for a reply, None to wait forever
+    :param backoff: seconds before the first reconnect attempt, doubled on each consecutive failure
+    :param max_backoff: cap on the reconnect delay in seconds
+    """
+
+    def __init__(self, endpoint, timeout=10_000, backoff=0.5, max_backoff=30.0, context=None):
+        self.endpoint = endpoint
+        self.timeout = timeout
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.context = context or zmq.Context.instance()
+
+        self.socket = None
+        self.poller = zmq.Poller()
+        self.failures = 0
+        self.retry_at = 0.0
+
+    @property
+    def healthy(self):
+        return self.failures == 0
+
+    @property
+    def ready(self):
+        """Healthy, or unhealthy and its backoff is over"""
+        return self.failures == 0 or time.monotonic() >= self.retry_at
+
+    def connect(self):
+        """Opens the socket if needed, an open one is reused as is"""
+        if self.socket is None:
+            self.socket = self.context.socket(zmq.REQ)
+            self.socket.setsockopt(zmq.LINGER, 0)
+            self.socket.setsockopt(zmq.REQ_RELAXED, 1)
+            self.socket.setsockopt(zmq.REQ_CORRELATE, 1)
+            self.socket.connect(self.endpoint)
+            self.poller.register(self.socket, zmq.POLLIN)
+        return self.socket
+
+    def close(self):
+        if self.socket is not None:
+            self.poller.unregister(self.socket)
+            self.socket.close()
+            self.socket = None
+
+    def reset(self):
+        """Drops the socket and whatever it had queued, the next connect starts from scratch"""
+        self.close()
+        return self.connect()
+
+    def send(self, msg):
+        self.connect().send_string(msg)
+
+    def recv_multipart(self, timeout=-1):
+        """
+        Next reply, TimeoutError if none came within timeout ms (self.timeout by default).
+        """
+        timeout = self.timeout if timeout == -1 else timeout
+        if not self.poller.poll(timeout):
+            self.failed()
+            raise TimeoutError(f'{self.endpoint} did not answer within {timeout} ms')
+        frames = self.socket.recv_multipart(copy=False)
+        self.succeeded()
+        return frames
+
+    def failed(self):
+        self.failures += 1
+        self.retry_at = time.monotonic() + min(self.backoff * 2 ** (self.failures - 1), self.max_backoff)
+
+    def succeeded(self):
+        self.failures = 0
+
+    def request(self, msg, retries=3):
+        """
+        Sends msg and returns the reply, resending it on a fresh socket after each timeout
+        (only safe for idempotent messages such as resets).
+
+        :raises InstanceUnhealthy: if no reply came after `retries` attempts
+        """
+        for attempt in range(retries):
+            if attempt:
+                time.sleep(max(self.retry_at - time.monotonic(), 0))
+                self.reset()
+            self.send(msg)
+            try:
+                return self.recv_multipart()
+            except TimeoutError:
+                pass
+        raise InstanceUnhealthy(f'{self.endpoint} did not answer {retries} attempts')
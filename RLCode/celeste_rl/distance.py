@@ -0,0 +1,216 @@
+import argparse
+import hashlib
+import json
+import math
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+from .level import LevelRenderer
+
+# grid edges a room can be left through, the mod's (dx - dy) progress reward goes right and up
+SIDES = ('top', 'right', 'bottom', 'left')
+
+
+def exit_mask(shape, sides=('top', 'right')):
+    """(H, W) bool mask of the border tiles on `sides` of a room grid"""
+    mask = np.zeros(shape, dtype=bool)
+    for side in sides:
+        if side not in SIDES:
+            raise ValueError(f'Unknown side {side}, expected one of {SIDES}')
+        mask[{'top': (0, slice(None)), 'bottom': (-1, slice(None)),
+              'left': (slice(None), 0), 'right': (slice(None), -1)}[side]] = True
+    return mask
+
+
+def distance_field(solids, exits):
+    """
+    Geodesic distance in tiles from every free tile to the nearest free exit tile, moving between
+    4-neighbours without going through solids. Breadth-first, one whole frontier per numpy step.
+
+    :param solids: (H, W) grid, non-zero for solid tiles
+    :param exits: (H, W) bool mask of the exit tiles
+    :return: (H, W) float32 distances, inf for solids and tiles that cannot reach an exit
+    """
+    free = solids == 0
+    distances = np.full(solids.shape, np.inf, dtype=np.float32)
+    frontier = exits & free
+    visited = frontier.copy()
+    grown = np.empty_like(frontier)
+
+    step = 0
+    while frontier.any():
+        distances[frontier] = step
+        grown[:] = False
+        grown[1:] |= frontier[:-1]
+        grown[:-1] |= frontier[1:]
+        grown[:, 1:] |= frontier[:, :-1]
+        grown[:, :-1] |= frontier[:, 1:]
+        frontier = grown & free & ~visited
+        visited |= frontier
+        step += 1
+    return distances
+
+
+def player_rect(obs_dic):
+    """(left, right, top, bottom) world coordinates of the payload's player, None while it is spawning"""
+    for entity in obs_dic['entities']:
+        if entity['Name'].split('Celeste.')[-1] == 'Player':
+            return tuple(float(entity[key]) for key in ('Left', 'Right', 'Top', 'Bottom'))
+    return None
+
+
+class RoomDistances:
+    """Distance field of one room and its bounds, with lookups in world coordinates"""
+
+    def __init__(self, field, bounds):
+        self.field = field
+        self.bounds = bounds
+
+    def tiles(self, rect):
+        """(row start, row end, col start, col end) tiles covered by a world rect, clipped to the room"""
+        left, right, top, bottom = rect
+        height, width = self.field.shape
+        x, y = self.bounds['X'], self.bounds['Y']
+        # plain python on 4 scalars, numpy would cost more than the lookup itself
+        c0 = min(max(math.floor((left - x) / LevelRenderer.TILE_SIZE), 0), width - 1)
+        r0 = min(max(math.floor((top - y) / LevelRenderer.TILE_SIZE), 0), height - 1)
+        # a rect outside of the room still maps to the border tiles next to it
+        c1 = max(min(math.ceil((right - x) / LevelRenderer.TILE_SIZE), width), c0 + 1)
+        r1 = max(min(math.ceil((bottom - y) / LevelRenderer.TILE_SIZE), height), r0 + 1)
+        return r0, r1, c0, c1
+
+    def distance(self, rect):
+        """Tiles left to the nearest exit from the closest tile covered by rect, inf if none can reach one"""
+        r0, r1, c0, c1 = self.tiles(rect)
+        return float(self.field[r0:r1, c0:c1].min())
+
+    def sample_start(self, rng, low=0, high=np.inf):
+        """
+        World (x, y) of the top left corner of a random free tile whose distance is in [low, high),
+        None if there is none. For curriculum start states.
+        """
+        rows, cols = np.nonzero((self.field >= low) & (self.field < high))
+        if len(rows) == 0:
+            return None
+        i = rng.integers(len(rows))
+        return (self.bounds['X'] + int(cols[i]) * LevelRenderer.TILE_SIZE,
+                self.bounds['Y'] + int(rows[i]) * LevelRenderer.TILE_SIZE)
+
+
+class DistanceIndex:
+    """
+    Per-room geodesic distance fields to the room exits, computed once per room from the payload's
+    solids and looked up for the player rect at every step.
+
+    Rooms are keyed like LevelCache, by their bounds and solids: an in-memory LRU in front of a directory
+    of <sha1 of the key>.npz files holding the field and the bounds, shared across runs and processes.
+
+    Finding the room is not O(1): it compares the payload's solids string with the last room's, a memcmp
+    linear in the room size (free when it is the same string object). The key is only hashed when the room
+    changes, and sha1'd on misses. The lookup of the player's tiles in the field is O(1).
+
+    :param path: cache directory, None to keep the fields in memory only
+    :param sides: edges of the room whose free tiles are exits, see SIDES
+    :param maxsize: rooms kept in memory
+    """
+
+    def __init__(self, path='distances', sides=('top', 'right'), maxsize=128):
+        self.path = path
+        self.sides = tuple(sides)
+        self.maxsize = maxsize
+        self.rooms = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        # (bounds, solids, room) of the last lookup
+        self._last = (None, None, None)
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+
+    def _file(self, key):
+        digest = hashlib.sha1('\n'.join((*key, *self.sides)).encode()).hexdigest()
+        return os.path.join(self.path, f'{digest}.npz')
+
+    def _load(self, key):
+        if self.path is None or not os.path.exists(self._file(key)):
+            return None
+        with np.load(self._file(key)) as data:
+            return RoomDistances(data['field'], json.loads(str(data['bounds'])))
+
+    def _save(self, key, room):
+        # written to a temporary file first, concurrent builders of the same room never see half a file
+        tmp = f'{self._file(key)}.{os.getpid()}.tmp.npz'
+        np.savez(tmp, field=room.field, bounds=json.dumps(room.bounds))
+        os.replace(tmp, self._file(key))
+
+    def room(self, obs_dic):
+        """RoomDistances of the payload's room, built and cached on the first visit"""
+        key = (obs_dic['bounds'], obs_dic['solids'])
+        last_bounds, last_solids, room = self._last
+        # consecutive steps are mostly in the same room, comparing with it avoids hashing the solids of every payload
+        if key[0] == last_bounds and key[1] == last_solids:
+            self.hits += 1
+            return room
+
+        room = self.rooms.get(key)
+        if room is not None:
+            self.hits += 1
+            self.rooms.move_to_end(key)
+            self._last = (*key, room)
+            return room
+
+        self.misses += 1
+        room = self._load(key)
+        if room is None:
+            bounds = LevelRenderer.parse_bounds(obs_dic)
+            solids = LevelRenderer.parse_solids(obs_dic, bounds, 1)
+            room = RoomDistances(distance_field(solids, exit_mask(solids.shape, self.sides)), bounds)
+            if self.path is not None:
+                self._save(key, room)
+
+        self.rooms[key] = room
+        if len(self.rooms) > self.maxsize:
+            self.rooms.popitem(last=False)
+        self._last = (*key, room)
+        return room
+
+    def distance(self, obs_dic):
+        """Tiles between the payload's player and the nearest exit of its room, nan while it is spawning"""
+        rect = player_rect(obs_dic)
+        if rect is None:
+            return float('nan')
+        return self.room(obs_dic).distance(rect)
+
+    def distances(self, payloads, out=None):
+        """distance of every payload of a batched env, written into out[:len(payloads)] if given"""
+        if out is None:
+            out = np.empty(len(payloads), dtype=np.float32)
+        for i, obs_dic in enumerate(payloads):
+            out[i] = self.distance(obs_dic)
+        return out[:len(payloads)]
+
+    def progress(self, obs_dic, previous):
+        """
+        Dense shaping term: tiles gained towards the exit since the `previous` distance,
+        0 when either distance is unknown.
+
+        :return: (gained tiles, current distance)
+        """
+        distance = self.distance(obs_dic)
+        gained = previous - distance
+        return (0.0 if not np.isfinite(gained) else gained), distance
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Precompute the distance fields of recorded payloads')
+    parser.add_argument('payloads', help='json lines file of payloads')
+    parser.add_argument('--path', default='distances', help='cache directory')
+    parser.add_argument('--sides', nargs='+', default=['top', 'right'], choices=SIDES)
+    args = parser.parse_args()
+
+    index = DistanceIndex(args.path, sides=args.sides)
+    with open(args.payloads) as f:
+        for line in f:
+            index.room(json.loads(line))
+    print(f'{index.misses} rooms indexed in {args.path}')
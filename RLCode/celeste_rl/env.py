@@ -1,38 +1,44 @@
-import json
-
-import gymnasium as gym
-import matplotlib.pyplot as plt
-import numpy as np
-import zmq
-from gymnasium import spaces
-#from stable_baselines3.common.callbacks import BaseCallback
-#from stable_baselines3.common.callbacks import BaseCallback
-#from stable_baselines3.common.logger import TensorBoardOutputFormat
-from .level import LevelRenderer
-
 import json
 import logging
+import time
 
 import gymnasium as gym
 import gymnasium.spaces as spaces
 import numpy as np
-import wandb
-import zmq
-from rtgym import RealTimeGymInterface
-from collections import OrderedDict
-import base64
-import PIL.Image as Image
-import io
-import json
 from gymnasium.envs.registration import EnvSpec
 
+from .connection import Connection
+from .protocol import (BINARY_PROTOCOL, EARLY_TERMINATION, JSON_PROTOCOL, MULTI_FRAME, SHM_PROTOCOL, action_message,
+                       decode_binary, decode_png, decode_shm, reply_version, reset_message)
+from .shm import SharedFrameRing
+from .timing import StepTimer
+
 class CelesteImgGym(gym.Env):
     metadata = {"render_modes": ["human", "rgb_array"], "render_fps": 4}
 
-    def __init__(self, port, render_mode=None):
+    def __init__(self, port, render_mode=None, protocol=BINARY_PROTOCOL, compact=False, timing=False, action_repeat=1,
+                 timeout=10_000, retries=3, host='localhost', endpoint=None):
 
         self.port = port
-        self.context = None
+        self.host = host
+        # socket kept across episodes, replies time out after `timeout` ms, resets are retried `retries` times
+        # endpoint overrides tcp://host:port, e.g. ipc:///tmp/celeste-7777 when the game is on this host
+        self.connection = Connection(endpoint or f"tcp://{host}:{port}", timeout=timeout)
+        # frames of SHM_PROTOCOL replies, attached on reset
+        self.ring = None
+        self.retries = retries
+        # opt-in per step spans, the untimed step only pays for the None check
+        self.timer = StepTimer() if timing else None
+        # frames each action is held for, the game answers once after the last one. Only games that advertise
+        # MULTI_FRAME on reset play them (the stand-in server does, the mod does not), checked on reset
+        self.action_repeat = action_repeat
+        self.multi_frame = False
+        self.early_termination = False
+        # header flags of the last reply, see protocol.py
+        self.flags = 0
+        # protocol we ask for on reset, self.protocol is the one the game answered with
+        self.requested_protocol = protocol
+        self.protocol = None
         self.initialized = False
         self.render_mode = render_mode
         
@@ -40,10 +46,12 @@ class CelesteImgGym(gym.Env):
         self.spec = EnvSpec('Celeste', entry_point=CelesteImgGym, max_episode_steps=2000)
         
         
+        # frames are uint8 pixels either way, compact declares them as such so that
+        # rollout buffers keep them as uint8 instead of float32
         self.observation_space = spaces.Dict({'image':spaces.Box(
             low=0, high=255, shape=(42,
                                   42,
-                                 3), dtype=np.float32)
+                                 3), dtype=np.uint8 if compact else np.float32)
                                          })
         #self.action_space = spaces.Tuple((spaces.Discrete(2), spaces.Discrete(2)))
         
@@ -86,42 +94,122 @@ class CelesteImgGym(gym.Env):
         
         
     def _get_obs(self, obs):
-        return {'image':np.array(Image.open(io.BytesIO(base64.b64decode(obs))))[..., :3]}
+        if self.protocol != JSON_PROTOCOL:
+            return {'image': obs}
+        return {'image': decode_png(obs)}
+
+    @property
+    def socket(self):
+        return self.connection.socket
+
+    def _recv(self):
+        return self._parse(self.connection.recv_multipart())
+
+    def _parse(self, frames):
+        # older mods always answer with a single json frame
+        if len(frames) == 1:
+            self.protocol = JSON_PROTOCOL
+            reply = json.loads(frames[0].bytes)
+            # older replies append a bare early termination bool, EARLY_TERMINATION is 1
+            self._flags(int(reply[3]) if len(reply) > 3 else 0)
+            return reply[:3]
+
+        if reply_version(frames) == SHM_PROTOCOL:
+            self.protocol = SHM_PROTOCOL
+            slot, reward, terminated, _, flags, ring = decode_shm(frames)
+            if ring is not None:
+                self.ring = SharedFrameRing.attach(ring)
+            self._flags(flags)
+            # read-only view of the slot, valid for ring.slots - 1 more steps
+            return self.ring.frames[slot], reward, terminated
+
+        self.protocol = BINARY_PROTOCOL
+        pixels, reward, terminated, _, flags = decode_binary(frames)
+        self._flags(flags)
+        return pixels, reward, terminated
+
+    def _flags(self, flags):
+        self.early_termination = bool(flags & EARLY_TERMINATION)
+        self.flags = flags
+
+    def _check_reset(self):
+        """Called on each reset reply, the game tells whether it plays multi-frame requests"""
+        self.multi_frame = bool(self.flags & MULTI_FRAME)
+        if self.action_repeat > 1 and not self.multi_frame:
+            raise ValueError(f'action_repeat={self.action_repeat} needs a game that plays multi-frame requests, '
+                             f'the one on {self.connection.endpoint} only plays one frame per request')
 
     
     def _send_control(self, action):
         action = self.action_values[action].tolist()
-        msg = json.dumps(action)
-        self.socket.send_string(msg)
+        self.socket.send_string(action_message(action, self.action_repeat))
+
+    def _connect(self):
+        self.connection.connect()
+        self.initialized = True
+
+    def _send_reset(self):
+        self.socket.send_string(reset_message(self.requested_protocol))
 
     def reset(self, seed=None, options=None):
         logging.warning(f'RESET WITH PORT {self.port}')
-        
-        if self.initialized:
-            self.socket.close()
-            self.context.destroy()            
-            self.initialized = False
-        if not self.initialized:
-            self.context = zmq.Context()
-            self.socket = self.context.socket(zmq.REQ)
-            self.socket.connect(f"tcp://localhost:{self.port}")
-            self.initialized = True
-            
-            self.socket.send_string(json.dumps([1]))
-            obs_dic, _, _ = json.loads(self.socket.recv())
+        if self.timer is not None and self.timer.episode_steps:
+            # truncated episode, the game never sent terminated
+            self.timer.end_episode()
+        
+        self._connect()
+        # resets are idempotent, a silent game gets the reset again on a fresh socket
+        obs_dic, _, _ = self._parse(self.connection.request(reset_message(self.requested_protocol), self.retries))
+        self._check_reset()
         return self._get_obs(obs_dic), {}
 
     def step(self, action):
+        if self.timer is not None:
+            return self._timed_step(self._send_control, action)
         self._send_control(action)
         return self._get_obs_rew_terminated_info()
+
+    def step_sequence(self, actions):
+        """
+        Plays a sequence of actions, each for action_repeat frames, in a single round trip.
+
+        :return: the usual step tuple, with the observation after the last frame and the summed reward,
+            info['early_termination'] is set if the episode ended before the last action
+        :raises ValueError: for more than one action, if the game does not play multi-frame requests
+        """
+        if len(actions) > 1 and not self.multi_frame:
+            raise ValueError(f'{self.connection.endpoint} only plays one frame per request, step through the actions')
+        actions = [self.action_values[action].tolist() for action in actions]
+        message = action_message(actions, self.action_repeat)
+        if self.timer is not None:
+            # one request, recorded as one step whatever the number of frames
+            return self._timed_step(self.socket.send_string, message)
+        self.socket.send_string(message)
+        return self._get_obs_rew_terminated_info()
+
+    def _timed_step(self, send, request):
+        """Same as step, timing its spans (see timing.SPANS) from send(request) on"""
+        t_send = time.perf_counter_ns()
+        send(request)
+        t_wait = time.perf_counter_ns()
+        frames = self.connection.recv_multipart()
+        t_parse = time.perf_counter_ns()
+        obs_dic, reward, terminated = self._parse(frames)
+        t_decode = time.perf_counter_ns()
+        obs = self._get_obs(obs_dic)
+        self.timer.record_step(t_send, t_wait, t_parse, t_decode, time.perf_counter_ns())
+
+        info = {'early_termination': True} if self.early_termination else {}
+        if terminated:
+            info['timing'] = self.timer.end_episode()
+        return obs, reward, terminated, False, info
     
     def close(self):
-        self.socket.close()
-        self.context.destroy()
+        self.connection.close()
         self.initialized = False
     
     def _get_obs_rew_terminated_info(self):
-        obs_dic, reward, terminated = json.loads(self.socket.recv())
-        info = {}
+        obs_dic, reward, terminated = self._recv()
+        info = {'early_termination': True} if self.early_termination else {}
         return self._get_obs(obs_dic), reward, terminated, False, info
 
@@ -0,0 +1,214 @@
+import argparse
+import copy
+import json
+import os
+
+import numpy as np
+import torch as th
+from torch import nn
+
+from .inference import PolicyNetwork, load_rllib_weights, load_weights
+from .models import expand_image
+
+FORMATS = ('torchscript', 'onnx')
+
+
+class TensorPolicy(nn.Module):
+    """
+    PolicyNetwork on plain tensors, without the dict collation, so it can be traced, quantized and exported:
+    (float image, flat vectors, h, c) -> (logits, values, h, c).
+    """
+
+    def __init__(self, policy):
+        super().__init__()
+        self.image = policy.extractor.extractors['image']
+        self.vectors = policy.extractor.extractors['vectors']
+        self.lstm = policy.lstm
+        self.logits = policy.logits
+        self.value = policy.value
+
+    def forward(self, image, vectors, h, c):
+        features = th.cat([self.image(image), self.vectors(vectors)], dim=1)
+        if self.lstm is not None:
+            features, (h, c) = self.lstm(features.unsqueeze(1), (h, c))
+            features = features.squeeze(1)
+        return self.logits(features), self.value(features).squeeze(1), h, c
+
+
+def tensor_inputs(observations, vector_keys, state_size, state=None):
+    """(image, vectors, h, c) tensors of a batch of dict observations, zero states if state is None"""
+    image = th.as_tensor(observations['image'])
+    image = expand_image(image, observations.get('entities')) if image.dtype == th.uint8 else image.float()
+    vectors = np.concatenate([np.asarray(observations[key], dtype=np.float32).reshape(len(image), -1)
+                              for key in vector_keys], axis=1)
+    if state is None:
+        state = (th.zeros((1, len(image), state_size)), th.zeros((1, len(image), state_size)))
+    return (image, th.from_numpy(vectors), *state)
+
+
+def quantize(model, calibration):
+    """
+    int8 copy of a TensorPolicy: the CNN is statically quantized (FX graph mode, calibrated on the
+    `calibration` input tuples) and the linear layers are dynamically quantized. The LSTM stays float,
+    its state would carry the quantization error from one step to the next.
+    """
+    from torch.ao.quantization import get_default_qconfig_mapping, quantize_dynamic
+    from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+    model = copy.deepcopy(model).eval()
+    mapping = get_default_qconfig_mapping(th.backends.quantized.engine)
+    model.image = prepare_fx(model.image, mapping, (calibration[0][0],))
+    with th.no_grad():
+        for inputs in calibration:
+            model.image(inputs[0])
+    model.image = convert_fx(model.image)
+
+    for name in ('vectors', 'logits', 'value'):
+        module = getattr(model, name)
+        if module is not None:
+            setattr(model, name, quantize_dynamic(module, {nn.Linear}, dtype=th.qint8))
+    return model
+
+
+def parity(reference, candidate, inputs):
+    """
+    Largest logit / value / next hidden state differences and fraction of identical greedy actions
+    of two TensorPolicy callables
+    """
+    with th.no_grad():
+        ref_logits, ref_values, ref_h, _ = reference(*inputs)
+        logits, values, h, _ = candidate(*inputs)
+    logits, values, h = th.as_tensor(logits), th.as_tensor(values), th.as_tensor(h)
+    return {'max_logit_error': float((logits - ref_logits).abs().max()),
+            'max_value_error': float((values - ref_values).abs().max()),
+            'max_state_error': float((h - ref_h).abs().max()) if h.numel() else 0.0,
+            'action_agreement': float((logits.argmax(1) == ref_logits.argmax(1)).float().mean())}
+
+
+class OnnxModel:
+    """onnxruntime session of an exported policy, called like a TensorPolicy"""
+
+    def __init__(self, path, num_threads=None):
+        import onnxruntime
+        options = onnxruntime.SessionOptions()
+        if num_threads is not None:
+            options.intra_op_num_threads = num_threads
+        self.session = onnxruntime.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+
+    def __call__(self, image, vectors, h, c):
+        feeds = {'image': image.numpy(), 'vectors': vectors.numpy(), 'h': h.numpy(), 'c': c.numpy()}
+        return tuple(th.from_numpy(out) for out in self.session.run(None, feeds))
+
+
+def export_policy(policy, observations, path, int8=False, fmt='torchscript', calibration_batch=32):
+    """
+    Frozen inference artifact of a PolicyNetwork, written to the directory `path` with a meta.json
+    that ExportedPolicy needs to load it.
+
+    :param observations: dict of (N, ...) representative observations, to calibrate the int8 CNN and
+        check the parity of the artifact with the float policy (stored in meta.json)
+    :param int8: quantize the policy, torchscript only
+    :param fmt: 'torchscript' (traced and frozen) or 'onnx' (needs the onnx package to export,
+        onnxruntime to load). The parity of an onnx artifact is measured on the outputs of onnxruntime,
+        it is left out of meta.json when onnxruntime is not installed.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f'Unknown export format {fmt}, expected one of {FORMATS}')
+    if int8 and fmt == 'onnx':
+        raise ValueError('int8 export is only available in torchscript')
+
+    policy = policy.cpu().eval()
+    vector_keys = policy.extractor.collator.vector_keys
+    model = TensorPolicy(policy).eval()
+    inputs = tensor_inputs(observations, vector_keys, policy.state_size)
+    n = len(inputs[0])
+    batches = [tuple(x[:, i:i + calibration_batch] if x.dim() == 3 else x[i:i + calibration_batch] for x in inputs)
+               for i in range(0, n, calibration_batch)]
+
+    exported = quantize(model, batches) if int8 else model
+    os.makedirs(path, exist_ok=True)
+    example = batches[0]
+    with th.no_grad():
+        if fmt == 'torchscript':
+            artifact = 'policy.pt'
+            frozen = th.jit.freeze(th.jit.trace(exported, example))
+            th.jit.save(frozen, os.path.join(path, artifact))
+            check = frozen
+        else:
+            artifact = 'policy.onnx'
+            th.onnx.export(exported, example, os.path.join(path, artifact), dynamo=False,
+                           input_names=['image', 'vectors', 'h', 'c'],
+                           output_names=['logits', 'values', 'h_out', 'c_out'],
+                           dynamic_axes={'image': {0: 'batch'}, 'vectors': {0: 'batch'},
+                                         'h': {1: 'batch'}, 'c': {1: 'batch'}})
+            try:
+                check = OnnxModel(os.path.join(path, artifact))
+            except ImportError:
+                check = None
+
+    meta = {'artifact': artifact, 'format': fmt, 'int8': int8, 'vector_keys': vector_keys,
+            'state_size': policy.state_size, 'n_actions': policy.logits.out_features}
+    if check is not None:
+        meta['parity'] = parity(model, check, inputs)
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=1)
+    return meta
+
+
+class ExportedPolicy:
+    """
+    Actor side of an export_policy artifact, same call as PolicyNetwork: dict observations and an
+    optional (h, c) state in, (logits, values, state) tensors out.
+    """
+
+    def __init__(self, path, num_threads=None):
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.vector_keys = self.meta['vector_keys']
+        self.state_size = self.meta['state_size']
+        artifact = os.path.join(path, self.meta['artifact'])
+
+        if self.meta['format'] == 'onnx':
+            self.model = OnnxModel(artifact, num_threads)
+        else:
+            if num_threads is not None:
+                th.set_num_threads(num_threads)
+            self.model = th.jit.load(artifact)
+
+    def __call__(self, observations, state=None):
+        with th.no_grad():
+            logits, values, h, c = self.model(*tensor_inputs(observations, self.vector_keys, self.state_size, state))
+        return logits, values, (h, c)
+
+    def act(self, observations, state=None, explore=True):
+        """(B,) actions sampled from (or argmax of) the logits, and the next state"""
+        logits, _, state = self(observations, state)
+        if explore:
+            return th.distributions.Categorical(logits=logits).sample().numpy(), state
+        return logits.argmax(1).numpy(), state
+
+
+if __name__ == '__main__':
+    from .level import LevelRenderer
+    from .server import synthetic_payload
+
+    parser = argparse.ArgumentParser(description='Export a policy of an RLlib checkpoint for CPU rollouts')
+    parser.add_argument('checkpoint', help='RLlib checkpoint, see load_rllib_weights')
+    parser.add_argument('out', help='directory of the exported artifact')
+    parser.add_argument('--prefix', default='', help='prefix of the policy weights in the RLlib state dict')
+    parser.add_argument('--format', default='torchscript', choices=FORMATS)
+    parser.add_argument('--int8', action='store_true')
+    parser.add_argument('--vision-size', type=int, default=42)
+    parser.add_argument('--n-actions', type=int, default=9)
+    parser.add_argument('--lstm-cell-size', type=int, default=64)
+    parser.add_argument('--calibration', type=int, default=256, help='synthetic observations to calibrate on')
+    args = parser.parse_args()
+
+    policy = PolicyNetwork(LevelRenderer.observation_space(args.vision_size), args.n_actions, args.lstm_cell_size)
+    load_weights(policy, load_rllib_weights(args.checkpoint, prefix=args.prefix))
+
+    rng = np.random.default_rng(0)
+    payloads = [synthetic_payload(rng) for _ in range(args.calibration)]
+    observations = LevelRenderer.create_obs_batch(payloads, 1, args.vision_size)
+    meta = export_policy(policy, observations, args.out, int8=args.int8, fmt=args.format)
+    print(json.dumps(meta.get('parity', 'parity not measured, onnxruntime is not installed'), indent=1))
@@ -0,0 +1,414 @@
+import argparse
+import copy
+import json
+import logging
+import os
+import pickle
+import threading
+import time
+
+import numpy as np
+import torch as th
+import zmq
+from torch import nn
+
+from .connection import Connection
+from .level import LevelRenderer
+from .models import CustomCombinedExtractor
+
+
+class PolicyNetwork(nn.Module):
+    """
+    CustomCombinedExtractor features, an optional LSTM, and the logits and value heads of an actor-critic,
+    the model rllib.py trains (use_lstm=True, lstm_cell_size=64).
+
+    :param observation_space: spaces.Dict of the observations, LevelRenderer.observation_space by default
+    :param n_actions: size of the Discrete action space
+    :param lstm_cell_size: hidden size of the LSTM, None for a feedforward policy
+    """
+
+    def __init__(self, observation_space, n_actions, lstm_cell_size=64):
+        super().__init__()
+        self.extractor = CustomCombinedExtractor(observation_space, device='cpu')
+        features = self.extractor.features_dim
+        self.lstm = nn.LSTM(features, lstm_cell_size, batch_first=True) if lstm_cell_size else None
+        hidden = lstm_cell_size or features
+        self.logits = nn.Linear(hidden, n_actions)
+        self.value = nn.Linear(hidden, 1)
+
+    @property
+    def state_size(self):
+        return self.lstm.hidden_size if self.lstm is not None else 0
+
+    def forward(self, observations, state=None):
+        """
+        :param observations: dict of (B, ...) arrays or tensors
+        :param state: (h, c) pair of (1, B, cell) tensors, zeros if None
+        :return: (B, n_actions) logits, (B,) values and the next state
+        """
+        features, _ = self.extractor(observations)
+        if self.lstm is not None:
+            features, state = self.lstm(features.unsqueeze(1), state)
+            features = features.squeeze(1)
+        return self.logits(features), self.value(features).squeeze(1), state
+
+
+def _policy_state_file(path, policy_id):
+    candidates = [path,
+                  os.path.join(path, 'policy_state.pkl'),
+                  os.path.join(path, 'policies', policy_id, 'policy_state.pkl')]
+    for candidate in candidates:
+        if os.path.isfile(candidate):
+            return candidate
+    raise FileNotFoundError(f'No pickled policy state of {policy_id} in {path}')
+
+
+def load_rllib_weights(path, policy_id='default_policy', prefix=''):
+    """
+    Torch weights of a policy from an RLlib checkpoint, read with pickle so ray is only needed
+    if the policy state pickles some of its classes.
+
+    :param path: algorithm checkpoint directory, policy checkpoint directory or policy_state.pkl file
+    :param prefix: prefix of the PolicyNetwork parameters in the RLlib model's state dict,
+        only the weights under it are kept, without it
+    :return: state dict of tensors
+    """
+    with open(_policy_state_file(path, policy_id), 'rb') as f:
+        state = pickle.load(f)
+    weights = state.get('weights', state)
+    return {key[len(prefix):]: th.as_tensor(np.asarray(value))
+            for key, value in weights.items() if key.startswith(prefix)}
+
+
+def load_weights(policy, weights):
+    """
+    load_state_dict of a PolicyNetwork, with the fix in the error when the weights come from another model.
+
+    rllib.py trains RLlib's default tf2 model, whose weights do not map onto PolicyNetwork: the checkpoint
+    must come from a torch run (framework='torch') with PolicyNetwork registered as its custom model.
+    """
+    try:
+        policy.load_state_dict(weights)
+    except RuntimeError as error:
+        raise ValueError(
+            'Checkpoint weights do not match PolicyNetwork. The default model rllib.py trains (framework tf2) '
+            'cannot be served, train with framework="torch" and PolicyNetwork as custom model, and pass the '
+            f'prefix of its parameters in the RLlib state dict. {error}') from error
+    return policy
+
+
+class InferenceError(RuntimeError):
+    """The InferenceServer failed to answer a request"""
+
+
+class InferenceServer:
+    """
+    Central CPU policy for the rollout workers of a host (SEED RL style): env runners send
+    observations and get actions back instead of each running its own copy of the model on tiny batches.
+
+    Requests are gathered into one forward pass until max_batch_size rows are pending or the oldest one
+    waited max_wait_ms. LSTM states live on the server, one per (client, row), and are zeroed on the
+    rows flagged as episode starts.
+
+    The states of a client that sent nothing for state_timeout seconds are dropped, a ROUTER socket is
+    not told about disconnections.
+
+    Weights are swapped between batches, never during one: `update` can be called from any thread,
+    and with `checkpoint` set the server reloads it whenever the file changes. A checkpoint that fails
+    to load is logged and the current weights are kept.
+
+    Wire format, on a REQ socket (see InferenceClient):
+        request  json {"first": [bool] * B}, then one frame of raw (B, *shape) values per observation key
+        reply    json {"version": weights version}, then actions int64, logp float32 and values float32 frames,
+                 or json {"version", "error": message} alone if the request could not be served
+
+    :param policy: PolicyNetwork to serve, moved to cpu
+    :param endpoint: zmq endpoint to bind, e.g. ipc:///tmp/celeste-policy or tcp://*:7790
+    :param max_batch_size: rows above which a batch is run without waiting any longer
+    :param max_wait_ms: longest time a request waits for others to join its batch
+    :param explore: sample actions from the logits, argmax otherwise
+    :param checkpoint: RLlib checkpoint to load and watch, see load_rllib_weights
+    :param reload_interval: seconds between checks of the checkpoint's modification time
+    :param num_threads: torch intra-op threads of the forward pass
+    :param state_timeout: seconds of silence after which a client's LSTM states are dropped
+    """
+
+    def __init__(self, policy, endpoint, max_batch_size=32, max_wait_ms=2.0, explore=True, checkpoint=None,
+                 policy_id='default_policy', prefix='', reload_interval=10.0, num_threads=None, context=None,
+                 state_timeout=300.0):
+        self.policy = policy.cpu().eval()
+        self.endpoint = endpoint
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.explore = explore
+        self.checkpoint = checkpoint
+        self.policy_id = policy_id
+        self.prefix = prefix
+        self.reload_interval = reload_interval
+        self.num_threads = num_threads
+        self.state_timeout = state_timeout
+        self.context = context or zmq.Context.instance()
+
+        self.spaces = policy.extractor.spaces
+        self.keys = list(self.spaces)
+        # routing id -> {row: (h, c)}, and the last time each client was heard from
+        self.states = {}
+        self.last_seen = {}
+        self.next_eviction = 0.0
+        self.version = 0
+        self.checkpoint_mtime = None
+        self.next_reload = 0.0
+        self._pending_policy = None
+        self._lock = threading.Lock()
+
+        self.batches = 0
+        self.rows = 0
+        self.errors = 0
+        self.running = False
+        self.thread = None
+        if checkpoint is not None:
+            self._reload()
+
+    def update(self, weights):
+        """Hot swap: the next batch runs on a copy of the policy holding `weights` (a state dict)"""
+        policy = load_weights(copy.deepcopy(self.policy), weights)
+        with self._lock:
+            self._pending_policy = policy
+
+    def _reload(self):
+        self.next_reload = time.monotonic() + self.reload_interval
+        try:
+            path = _policy_state_file(self.checkpoint, self.policy_id)
+            mtime = os.path.getmtime(path)
+        except (FileNotFoundError, OSError):
+            return
+        if mtime != self.checkpoint_mtime:
+            # not retried until the file changes again
+            self.checkpoint_mtime = mtime
+            self.update(load_rllib_weights(path, self.policy_id, self.prefix))
+
+    def _swap(self):
+        with self._lock:
+            policy, self._pending_policy = self._pending_policy, None
+        if policy is not None:
+            self.policy = policy.eval()
+            self.version += 1
+
+    def start(self):
+        self.running = True
+        self.socket = self.context.socket(zmq.ROUTER)
+        self.socket.setsockopt(zmq.LINGER, 0)
+        self.socket.bind(self.endpoint)
+        self.thread = threading.Thread(target=self._serve, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _serve(self):
+        if self.num_threads is not None:
+            th.set_num_threads(self.num_threads)
+        poller = zmq.Poller()
+        poller.register(self.socket, zmq.POLLIN)
+        pending = []
+        rows = 0
+        deadline = None
+        try:
+            while self.running:
+                timeout = 50 if deadline is None else max(deadline - time.monotonic(), 0) * 1e3
+                if poller.poll(timeout):
+                    # drain whatever already arrived, it joins the batch for free
+                    while rows < self.max_batch_size:
+                        try:
+                            frames = self.socket.recv_multipart(zmq.NOBLOCK, copy=False)
+                        except zmq.Again:
+                            break
+                        request = self._decode(frames)
+                        if request is None:
+                            continue
+                        pending.append(request)
+                        rows += len(request[1])
+                        if deadline is None:
+                            deadline = time.monotonic() + self.max_wait_ms / 1e3
+
+                if pending and (rows >= self.max_batch_size or time.monotonic() >= deadline):
+                    try:
+                        self._run(pending)
+                    except Exception as error:
+                        for envelope, _, _ in pending:
+                            self._error(envelope, error)
+                    pending, rows, deadline = [], 0, None
+
+                now = time.monotonic()
+                if self.checkpoint is not None and now >= self.next_reload:
+                    try:
+                        self._reload()
+                    except Exception as error:
+                        logging.warning(f'Could not load {self.checkpoint}, keeping the current weights: {error}')
+                if now >= self.next_eviction:
+                    self._evict(now)
+        finally:
+            self.socket.close()
+
+    def _error(self, envelope, error):
+        """Error reply, the client raises InferenceError with its message"""
+        self.errors += 1
+        header = {'version': self.version, 'error': f'{type(error).__name__}: {error}'}
+        self.socket.send_multipart(envelope + [json.dumps(header).encode()])
+
+    def _decode(self, frames):
+        """(envelope, first, observations) of a request, None if it was malformed (and answered with an error)"""
+        # REQ envelope: routing id, request id (REQ_CORRELATE clients), empty delimiter
+        delimiter = next((i for i, frame in enumerate(frames) if not frame.bytes), None)
+        if delimiter is None:
+            # not a REQ client, there is no way to answer it
+            return None
+        envelope = [frame.bytes for frame in frames[:delimiter + 1]]
+        self.last_seen[envelope[0]] = time.monotonic()
+        try:
+            header, arrays = json.loads(frames[delimiter + 1].bytes), frames[delimiter + 2:]
+            first = np.asarray(header['first'], dtype=bool)
+            if len(arrays) != len(self.keys):
+                raise ValueError(f'Expected {len(self.keys)} observation frames ({", ".join(self.keys)}), '
+                                 f'got {len(arrays)}')
+            observations = {key: np.frombuffer(frame.buffer, dtype=self.spaces[key].dtype).reshape(
+                                len(first), *self.spaces[key].shape)
+                            for key, frame in zip(self.keys, arrays)}
+        except Exception as error:
+            self._error(envelope, error)
+            return None
+        return envelope, first, observations
+
+    def _evict(self, now):
+        """Drops the states of the clients silent for state_timeout seconds"""
+        self.next_eviction = now + min(self.state_timeout, 60.0)
+        for client in [client for client, seen in self.last_seen.items() if now - seen >= self.state_timeout]:
+            del self.last_seen[client]
+            self.states.pop(client, None)
+
+    def _state(self, requests):
+        """(h, c) of every row of the batch, zeros for new clients and episode starts"""
+        size = self.policy.state_size
+        if size == 0:
+            return None
+        h = np.zeros((1, sum(len(first) for _, first, _ in requests), size), dtype=np.float32)
+        c = np.zeros_like(h)
+        row = 0
+        for envelope, first, _ in requests:
+            states = self.states.get(envelope[0], {})
+            for i, start in enumerate(first):
+                state = None if start else states.get(i)
+                if state is not None:
+                    h[0, row], c[0, row] = state
+                row += 1
+        return th.from_numpy(h), th.from_numpy(c)
+
+    def _run(self, requests):
+        self._swap()
+        observations = {key: np.concatenate([obs[key] for _, _, obs in requests]) for key in self.keys}
+
+        with th.no_grad():
+            logits, values, state = self.policy(observations, self._state(requests))
+            distribution = th.distributions.Categorical(logits=logits)
+            actions = distribution.sample() if self.explore else logits.argmax(1)
+            logp = distribution.log_prob(actions)
+
+        actions, logp, values = actions.numpy(), logp.numpy().astype(np.float32), values.numpy()
+        header = json.dumps({'version': self.version}).encode()
+        row = 0
+        for envelope, first, _ in requests:
+            end = row + len(first)
+            if state is not None:
+                h, c = state[0][0, row:end].numpy(), state[1][0, row:end].numpy()
+                states = self.states.setdefault(envelope[0], {})
+                for i in range(len(first)):
+                    states[i] = (h[i].copy(), c[i].copy())
+            self.socket.send_multipart(envelope + [header, actions[row:end].astype(np.int64),
+                                                   logp[row:end], values[row:end]])
+            row = end
+
+        self.batches += 1
+        self.rows += row
+
+
+class InferenceClient:
+    """
+    Env runner side of an InferenceServer.
+
+    :param endpoint: endpoint of the server, e.g. ipc:///tmp/celeste-policy or tcp://host:7790
+    :param observation_space: spaces.Dict the server's policy was built for
+    :param timeout: milliseconds to wait for actions before raising TimeoutError
+    """
+
+    def __init__(self, endpoint, observation_space, timeout=10_000):
+        self.connection = Connection(endpoint, timeout=timeout)
+        self.spaces = observation_space.spaces
+        self.version = None
+
+    def act(self, observations, first):
+        """
+        Actions for a batch of observations, requests are not retried since they advance the LSTM state.
+
+        :param observations: dict of (B, ...) arrays, or of single observations with first a bool
+        :param first: (B,) flags of the rows starting an episode
+        :return: (B,) actions, log probabilities and values
+        :raises InferenceError: if the server could not serve the request
+        """
+        single = np.ndim(first) == 0
+        first = np.atleast_1d(first).astype(bool)
+        frames = [json.dumps({'first': first.tolist()}).encode()]
+        for key, space in self.spaces.items():
+            value = np.ascontiguousarray(observations[key], dtype=space.dtype)
+            frames.append(value.reshape(len(first), *space.shape))
+
+        self.connection.connect().send_multipart(frames)
+        header, *arrays = self.connection.recv_multipart()
+        header = json.loads(header.bytes)
+        self.version = header['version']
+        if 'error' in header:
+            raise InferenceError(header['error'])
+        actions, logp, values = arrays
+        actions, logp, values = (np.frombuffer(actions.buffer, dtype=np.int64),
+                                 np.frombuffer(logp.buffer, dtype=np.float32),
+                                 np.frombuffer(values.buffer, dtype=np.float32))
+        if single:
+            return int(actions[0]), float(logp[0]), float(values[0])
+        return actions, logp, values
+
+    def close(self):
+        self.connection.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve a policy to the rollout workers of this host')
+    parser.add_argument('--endpoint', default='ipc:///tmp/celeste-policy')
+    parser.add_argument('--checkpoint', default=None, help='RLlib checkpoint to load and watch for updates')
+    parser.add_argument('--prefix', default='', help='prefix of the policy weights in the RLlib state dict')
+    parser.add_argument('--vision-size', type=int, default=42)
+    parser.add_argument('--n-actions', type=int, default=9)
+    parser.add_argument('--lstm-cell-size', type=int, default=64)
+    parser.add_argument('--max-batch-size', type=int, default=32)
+    parser.add_argument('--max-wait-ms', type=float, default=2.0)
+    parser.add_argument('--threads', type=int, default=None)
+    args = parser.parse_args()
+
+    policy = PolicyNetwork(LevelRenderer.observation_space(args.vision_size), args.n_actions, args.lstm_cell_size)
+    server = InferenceServer(policy, args.endpoint, max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms,
+                             checkpoint=args.checkpoint, prefix=args.prefix, num_threads=args.threads)
+    with server:
+        print(f'serving on {args.endpoint}')
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
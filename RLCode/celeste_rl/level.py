@@ -1,8 +1,8 @@
 import json
-import matplotlib.pyplot as plt
+from collections import OrderedDict
+
 import numpy as np
-import cv2
-import json
+from gymnasium import spaces
 
 class LevelRenderer:
     
@@ -22,92 +22,274 @@ class LevelRenderer:
              }
         
     max_idx = max(ID_MAP.values())
-    entity_values = range(max_idx+1)
 
-    norm = plt.Normalize(vmin=0, vmax=max_idx)
-    cm = plt.cm.nipy_spectral
+    # Structured entity representation, id 0 is used for entities not in ID_MAP
+    ENTITY_DTYPE = np.dtype([('id', 'u1'),
+                             ('Left', 'f8'),
+                             ('Right', 'f8'),
+                             ('Top', 'f8'),
+                             ('Bottom', 'f8')])
+    entity_values = range(max_idx+1)
         
-    def __init__(self, img, entities, bounds, scale=1, vision_size=32):
+    def __init__(self, img, entities, bounds, scale=1, vision_size=32, out=None):
         
-        self.img = np.zeros((img.shape[0], img.shape[1], LevelRenderer.max_idx+1))
-        self.img[:,:,0] = img
+        # out: preallocated (H, W, C) image already holding the solids layer, only entities are drawn on it
+        if out is None:
+            self.img = np.zeros((img.shape[0], img.shape[1], LevelRenderer.max_idx+1))
+            self.img[:,:,0] = img
+        else:
+            self.img = out
         self.bounds = bounds
         self.entities = entities
         self.scale = scale
         self.vision_size = vision_size
+        self.player_rects = []
         
-        for entity in self.entities:
-            if entity['Name'] in LevelRenderer.ID_MAP:
-                self.generic_handler(entity)
+        # entities either come as a structured ENTITY_DTYPE array or as a list of dicts
+        if isinstance(self.entities, np.ndarray):
+            self.rasterize(self.entities)
+        else:
+            for entity in self.entities:
+                if entity['Name'] in LevelRenderer.ID_MAP:
+                    self.generic_handler(entity)
                 
         
-    def render_around_player(self):
+    def player_position(self):
+        """First (row, col) covered by the Player channel in row-major order, None if there is no player"""
+        height, width = self.img.shape[:2]
+        rows, cols = [], []
+        for top, bottom, left, right in self.player_rects:
+            # same clipping / wrapping as the slice assignment in generic_handler
+            rows.append(range(*slice(top, bottom).indices(height)))
+            cols.append(range(*slice(left, right).indices(width)))
+
+        drawn = [(r, c) for r, c in zip(rows, cols) if len(r) > 0 and len(c) > 0]
+        if not drawn:
+            return None
+        y = min(r.start for r, _ in drawn)
+        x = min(c.start for r, c in drawn if y in r)
+        return y, x
+
+    def render_around_player(self, out=None):
+        """
+        Window of vision_size*scale pixels around the player, out of level pixels are
+        edge-replicated for the solids and zero for the entities.
+
+        Only the window is read, the level image is never padded.
+        :param out: optional preallocated (size, size, C) buffer to write into
+        """
         PADSIZE = (self.vision_size//2+1)*self.scale
         OFFSET = self.vision_size//2*self.scale
-        
-        pad0 =  np.pad(self.img[:, :, 0:1], ((PADSIZE,),(PADSIZE,), (0,)), mode="edge")
-        padrest =  np.pad(self.img[:,:,1:], ((PADSIZE,),(PADSIZE,), (0,)))
-
-        padded = np.dstack((pad0, padrest))
-        ys, xs = np.where(padded[:,:,LevelRenderer.ID_MAP['Player']])
+        SIZE = 2*OFFSET
+        height, width, channels = self.img.shape
 
-        if len(xs) > 0 and len(ys) > 0:
-            y = ys[0]
-            x = xs[0]
-            
+        position = self.player_position()
+        if position is not None:
+            y, x = position
+            y0, x0 = y - OFFSET, x - OFFSET
             
-        # player is spawning, set to bottom left corner
+        # player is spawning, set to bottom left corner (in padded coordinates)
         else:
-            y = self.img.shape[0]-1 + OFFSET
-            x = 0 + OFFSET
-            
-        return padded[y-OFFSET:y+OFFSET,
-                      x-OFFSET:x+OFFSET]
+            y0 = height - 1 - PADSIZE
+            x0 = -PADSIZE
+
+        if out is None:
+            out = np.empty((SIZE, SIZE, channels), dtype=self.img.dtype)
+
+        rows = np.clip(np.arange(y0, y0 + SIZE), 0, height - 1)
+        cols = np.clip(np.arange(x0, x0 + SIZE), 0, width - 1)
+        out[:, :, 0] = self.img[rows[:, None], cols[None, :], 0]
+
+        ys, ye = min(max(y0, 0), height), min(max(y0 + SIZE, 0), height)
+        xs, xe = min(max(x0, 0), width), min(max(x0 + SIZE, 0), width)
+        out[:, :, 1:] = 0
+        out[ys-y0:ye-y0, xs-x0:xe-x0, 1:] = self.img[ys:ye, xs:xe, 1:]
+        return out
     
-    @classmethod
-    def from_payload(cls, obs_dic, scale, vision_size):
-        entities = [dict(ent, Name=ent['Name'].split('Celeste.')[-1]) for ent in obs_dic['entities']]
-        bounds = json.loads(obs_dic['bounds']
+    @staticmethod
+    def parse_entities(obs_dic):
+        return [dict(ent, Name=ent['Name'].split('Celeste.')[-1]) for ent in obs_dic['entities']]
+
+    @staticmethod
+    def parse_entity_array(obs_dic):
+        entities = obs_dic['entities']
+        array = np.empty(len(entities), dtype=LevelRenderer.ENTITY_DTYPE)
+        array['id'] = [LevelRenderer.ID_MAP.get(ent['Name'].split('Celeste.')[-1], 0) for ent in entities]
+        for key in ('Left', 'Right', 'Top', 'Bottom'):
+            array[key] = [float(ent[key]) for ent in entities]
+        return array
+
+    @staticmethod
+    def parse_bounds(obs_dic):
+        return json.loads(obs_dic['bounds']
                   .replace(' ', ',')
                   .replace('X', '"X"')
                   .replace('Height', '"Height"')
                   .replace('Width', '"Width"')
                   .replace('Y', '"Y"')
                  )
+
+    @staticmethod
+    def parse_solids(obs_dic, bounds, scale):
         width = int(np.ceil(bounds['Width']/LevelRenderer.TILE_SIZE))
         height = int(np.ceil(bounds['Height']/LevelRenderer.TILE_SIZE))
 
-        solids = np.array([list(x + ('0'*(width - len(x)))) for x in obs_dic['solids'].split('\n')])
-        solids = np.where(solids == "0", 0, 1)
-        solids = cv2.resize(solids.astype(float), (solids.shape[1]*scale, solids.shape[0]*scale), interpolation = cv2.INTER_AREA)
+        # rows are right-padded with empty tiles and read as one byte buffer instead of lists of characters
+        rows = [row.ljust(width, '0') for row in obs_dic['solids'].split('\n')]
+        solids = np.frombuffer(''.join(rows).encode(), dtype=np.uint8).reshape(len(rows), width)
+        solids = np.where(solids == ord('0'), 0., 1.)
+        # integer upscaling, same pixels as cv2.resize with INTER_AREA
+        return solids.repeat(scale, axis=0).repeat(scale, axis=1)
+
+    @classmethod
+    def from_payload(cls, obs_dic, scale, vision_size):
+        entities = cls.parse_entity_array(obs_dic)
+        bounds = cls.parse_bounds(obs_dic)
+        solids = cls.parse_solids(obs_dic, bounds, scale)
 
         return cls(solids, entities, bounds, scale=scale, vision_size=vision_size)
 
     @staticmethod
-    def create_obs(obs_dic, scale, vision_size):
+    def create_obs(obs_dic, scale, vision_size, compact=False, packbits=False):
         original_obs = LevelRenderer.from_payload(obs_dic, scale, vision_size)
-        
-        full_obs = {
-            'image':original_obs.render_around_player().transpose(2,0,1).astype('float32'),
+        return LevelRenderer.obs_from_renderer(original_obs, obs_dic, compact=compact, packbits=packbits)
+
+    @staticmethod
+    def obs_from_renderer(original_obs, obs_dic, compact=False, packbits=False):
+        crop = original_obs.render_around_player()
+        full_obs = {}
+        if packbits:
+            full_obs['image'], full_obs['entities'] = LevelRenderer.compact_image(crop, packbits=True)
+        elif compact:
+            full_obs['image'] = LevelRenderer.compact_image(crop)
+        else:
+            full_obs['image'] = crop.transpose(2,0,1).astype('float32')
+
+        full_obs.update({
             'climbing': np.array([int(obs_dic['climbing'])]).astype('float32'),
             'canDash': np.array([int(obs_dic['canDash'])]).astype('float32'),
-            'speeds': np.array([float(x) for x in obs_dic['speed'].split(', ')]).astype('float32')}
+            'speeds': np.array([float(x) for x in obs_dic['speed'].split(', ')]).astype('float32')})
         return full_obs
+
+    @staticmethod
+    def batch_buffers(n, vision_size, scale=1, compact=False, packbits=False):
+        """Zeroed (N, ...) arrays for every key of observation_space, filled by create_obs_batch"""
+        obs_space = LevelRenderer.observation_space(vision_size, scale=scale, compact=compact, packbits=packbits)
+        return {key: np.zeros((n, *space.shape), dtype=space.dtype) for key, space in obs_space.items()}
+
+    @staticmethod
+    def parse_scalars(payloads, out):
+        """climbing, canDash and speeds of every payload, parsed at once into the first len(payloads) rows of out"""
+        n = len(payloads)
+        out['climbing'][:n, 0] = np.array([p['climbing'] for p in payloads], dtype=np.float64)
+        out['canDash'][:n, 0] = np.array([p['canDash'] for p in payloads], dtype=np.float64)
+        # "x, y" strings joined into one list, numpy parses all of them in a single call
+        speeds = ', '.join([p['speed'] for p in payloads]).split(', ')
+        out['speeds'][:n] = np.array(speeds, dtype=np.float64).reshape(n, -1)
+
+    @staticmethod
+    def write_obs(renderer, out, i, compact=False, packbits=False):
+        """Renders the crop around the player into row i of the image buffers of batch_buffers"""
+        if packbits:
+            out['image'][i], out['entities'][i] = LevelRenderer.compact_image(renderer.render_around_player(),
+                                                                              packbits=True)
+        elif compact:
+            out['image'][i] = LevelRenderer.compact_image(renderer.render_around_player())
+        else:
+            # the (C, H, W) row seen as (H, W, C), the crop is written in place without a transposed copy
+            renderer.render_around_player(out=out['image'][i].transpose(1, 2, 0))
+
+    @staticmethod
+    def create_obs_batch(payloads, scale, vision_size, compact=False, packbits=False, out=None, executor=None):
+        """
+        create_obs for N payloads at once, written into (N, ...) arrays instead of N dicts:
+        the image as one (N, C, H, W) array, climbing and canDash as (N, 1) and speeds as (N, 2).
+
+        :param out: buffers from batch_buffers with at least N rows, allocated if None
+        :param executor: optional concurrent.futures executor to render the payloads on,
+            rasterizing and cropping are numpy work that releases the GIL
+        :return: dict of (N, ...) arrays, views of out if given
+        """
+        n = len(payloads)
+        if out is None:
+            out = LevelRenderer.batch_buffers(n, vision_size, scale=scale, compact=compact, packbits=packbits)
+
+        def render(i):
+            renderer = LevelRenderer.from_payload(payloads[i], scale, vision_size)
+            LevelRenderer.write_obs(renderer, out, i, compact=compact, packbits=packbits)
+
+        if executor is None:
+            for i in range(n):
+                render(i)
+        else:
+            # list() re-raises the first exception of a worker
+            list(executor.map(render, range(n)))
+
+        LevelRenderer.parse_scalars(payloads, out)
+        return {key: value[:n] for key, value in out.items()}
+
+    @staticmethod
+    def compact_image(img, packbits=False):
+        """
+        uint8 (C, H, W) version of a (H, W, C) render: solids scaled to 0-255, entity channels 0/1.
+
+        With packbits, returns the (1, H, W) solids and the (C-1, ceil(H*W/8)) entity channels
+        packed with np.packbits, models.expand_image turns both back into the float image.
+        """
+        solids = np.rint(img[:, :, 0] * 255).astype(np.uint8)
+        entities = img[:, :, 1:].transpose(2, 0, 1) > 0
+
+        if packbits:
+            return solids[None], np.packbits(entities.reshape(len(entities), -1), axis=1)
+
+        image = np.empty((img.shape[2], img.shape[0], img.shape[1]), dtype=np.uint8)
+        image[0] = solids
+        image[1:] = entities
+        return image
+
+    @staticmethod
+    def observation_space(vision_size, scale=1, compact=False, packbits=False):
+        """Observation space of the dicts returned by create_obs"""
+        size = vision_size//2*2*scale
+        channels = LevelRenderer.max_idx+1
+
+        obs_spaces = {}
+        if packbits:
+            obs_spaces['image'] = spaces.Box(low=0, high=255, shape=(1, size, size), dtype=np.uint8)
+            obs_spaces['entities'] = spaces.Box(low=0, high=255, shape=(channels-1, int(np.ceil(size*size/8))), dtype=np.uint8)
+        elif compact:
+            obs_spaces['image'] = spaces.Box(low=0, high=255, shape=(channels, size, size), dtype=np.uint8)
+        else:
+            obs_spaces['image'] = spaces.Box(low=0, high=1, shape=(channels, size, size), dtype=np.float32)
+
+        obs_spaces['climbing'] = spaces.Box(low=0, high=1, shape=(1,), dtype=np.float32)
+        obs_spaces['canDash'] = spaces.Box(low=0, high=1, shape=(1,), dtype=np.float32)
+        obs_spaces['speeds'] = spaces.Box(low=-np.inf, high=np.inf, shape=(2,), dtype=np.float32)
+        return spaces.Dict(obs_spaces)
         
+    @staticmethod
+    def colorize(values):
+        """RGBA colors of entity ids, matplotlib is only imported for plotting"""
+        import matplotlib.pyplot as plt
+        return plt.cm.nipy_spectral(plt.Normalize(vmin=0, vmax=LevelRenderer.max_idx)(values))
+
     @staticmethod
     def plot_obs(obs, method='plt'):
-        img = LevelRenderer.cm(LevelRenderer.norm(obs[0] + obs.argmax(0)))
+        img = LevelRenderer.colorize(obs[0] + obs.argmax(0))
         
         if method == 'plt':
+            import matplotlib.pyplot as plt
             plt.imshow(img)
         else:
+            import cv2
             cv2.imshow('observation', img)
             cv2.waitKey(1)
         
     @staticmethod
     def color_to_idx(img):
+        import numpy.lib.recfunctions as nlr
     
-        color_dict = {i:tuple([int(255*x) for x in LevelRenderer.cm(LevelRenderer.norm(i))]) for i in LevelRenderer.entity_values}
+        color_dict = {i:tuple([int(255*x) for x in LevelRenderer.colorize(i)]) for i in LevelRenderer.entity_values}
         rev_dict = {b:a for a,b in color_dict.items()}
 
         restruc = nlr.unstructured_to_structured(img).astype('O')
@@ -117,7 +299,7 @@ class LevelRenderer:
     def render_finish(self, dim1, dim2):
         tmp = self.img.copy()
         tmp[dim1, dim2] = LevelRenderer.ID_MAP['finish']
-        return LevelRenderer.cm(LevelRenderer.norm(tmp))
+        return LevelRenderer.colorize(tmp)
     
     def generic_handler(self, entity, x_offset=0, y_offset=0, width_override=None, height_override=None):
 
@@ -129,3 +311,143 @@ class LevelRenderer:
         bottom = int(np.ceil((float(entity['Bottom']) - self.bounds['Y']) * SCALE))
 
         self.img[top:bottom, left:right, LevelRenderer.ID_MAP[entity['Name']]] = 1
+        if entity['Name'] == 'Player':
+            self.player_rects.append((top, bottom, left, right))
+
+    def entity_rects(self, entities):
+        """Vectorized generic_handler rectangles, (4, N) int array of top, bottom, left, right rows"""
+        SCALE = self.scale / LevelRenderer.TILE_SIZE
+
+        coords = np.empty((4, len(entities)))
+        coords[0], coords[1] = entities['Top'], entities['Bottom']
+        coords[2], coords[3] = entities['Left'], entities['Right']
+        coords[:2] -= self.bounds['Y']
+        coords[2:] -= self.bounds['X']
+        coords *= SCALE
+
+        np.floor(coords[0::2], out=coords[0::2])
+        np.ceil(coords[1::2], out=coords[1::2])
+        return coords.astype(np.int64)
+
+    def rasterize(self, entities):
+        """
+        Draws all entities of a structured array at once, same result as calling generic_handler on each.
+        """
+        entities = entities[entities['id'] > 0]
+        rects = self.entity_rects(entities)
+        ids = entities['id']
+
+        is_player = ids == LevelRenderer.ID_MAP['Player']
+        self.player_rects.extend(map(tuple, rects[:, is_player].T.tolist()))
+
+        # resolve negative / out of range bounds like python slicing does
+        height, width = self.img.shape[:2]
+        sizes = np.array([[height], [height], [width], [width]])
+        rects = np.where(rects < 0, rects + sizes, rects)
+        rects = np.minimum(np.maximum(rects, 0, out=rects), sizes, out=rects)
+
+        top, bottom, left, right = rects
+        drawn = (top < bottom) & (left < right)
+        if not drawn.all():
+            top, bottom, left, right = rects[:, drawn]
+            ids = ids[drawn]
+        if len(ids) == 0:
+            return
+
+        # rectangles are separable: the (H, W) coverage of a channel is the product of the
+        # entities' row masks with their column masks, done for all channels in one matmul
+        n_channels = self.img.shape[2]
+        rows = ((np.arange(height) >= top[:, None]) & (np.arange(height) < bottom[:, None])).astype(np.float32)
+        cols = np.zeros((len(ids), n_channels, width), dtype=np.float32)
+        cols[np.arange(len(ids)), ids] = (np.arange(width) >= left[:, None]) & (np.arange(width) < right[:, None])
+
+        counts = rows.T @ cols.reshape(len(ids), n_channels * width)
+        covered = counts.reshape(height, n_channels, width).transpose(0, 2, 1) > 0
+        self.img[covered] = 1
+
+
+class LevelCache:
+    """
+    Incremental rendering: the parsed and scaled solids layer and the static entity
+    channels of a room are cached, keyed by the room bounds and the solids content,
+    with LRU eviction. Each call only redraws the channels of DYNAMIC entities.
+
+    Static entities can still change inside a room (refills consumed, dash blocks broken),
+    they are compared with the cached ones and redrawn when they differ.
+
+    The renderer returned by `renderer` draws into a buffer owned by the cache,
+    its image is only valid until the next call for the same room.
+    """
+
+    DYNAMIC = ('Player', 'FallingBlock', 'ZipMover', 'CrumblePlatform')
+
+    def __init__(self, scale, vision_size, maxsize=32, compact=False, packbits=False):
+        self.scale = scale
+        self.vision_size = vision_size
+        self.maxsize = maxsize
+        self.compact = compact
+        self.packbits = packbits
+        self.entries = OrderedDict()
+
+        self.dynamic_channels = [LevelRenderer.ID_MAP[name] for name in LevelCache.DYNAMIC]
+        self.static_channels = [idx for idx in LevelRenderer.ID_MAP.values() if idx not in self.dynamic_channels]
+        self.hits = 0
+        self.misses = 0
+
+    def _entry(self, obs_dic):
+        key = (obs_dic['bounds'], obs_dic['solids'])
+        entry = self.entries.get(key)
+
+        if entry is None:
+            self.misses += 1
+            bounds = LevelRenderer.parse_bounds(obs_dic)
+            solids = LevelRenderer.parse_solids(obs_dic, bounds, self.scale)
+            entry = self.entries[key] = LevelRenderer(solids, [], bounds, scale=self.scale, vision_size=self.vision_size)
+            entry.static_entities = None
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return entry
+
+    def renderer(self, obs_dic):
+        entry = self._entry(obs_dic)
+
+        entities = LevelRenderer.parse_entity_array(obs_dic)
+        entities = entities[entities['id'] > 0]
+        is_dynamic = np.isin(entities['id'], self.dynamic_channels)
+        static, dynamic = entities[~is_dynamic], entities[is_dynamic]
+
+        if entry.static_entities is None or not np.array_equal(static, entry.static_entities):
+            entry.img[:, :, self.static_channels] = 0
+            entry.rasterize(static)
+            entry.static_entities = static
+
+        entry.img[:, :, self.dynamic_channels] = 0
+        entry.player_rects = []
+        entry.rasterize(dynamic)
+        entry.entities = entities
+
+        return entry
+
+    def create_obs(self, obs_dic):
+        return LevelRenderer.obs_from_renderer(self.renderer(obs_dic), obs_dic,
+                                               compact=self.compact, packbits=self.packbits)
+
+    def create_obs_batch(self, payloads, out=None):
+        """
+        LevelRenderer.create_obs_batch through the cache. Rendering stays sequential,
+        payloads of the same room share the cached image buffer.
+        """
+        n = len(payloads)
+        if out is None:
+            out = LevelRenderer.batch_buffers(n, self.vision_size, scale=self.scale,
+                                              compact=self.compact, packbits=self.packbits)
+        for i, obs_dic in enumerate(payloads):
+            LevelRenderer.write_obs(self.renderer(obs_dic), out, i, compact=self.compact, packbits=self.packbits)
+        LevelRenderer.parse_scalars(payloads, out)
+        return {key: value[:n] for key, value in out.items()}
+
+    def clear(self):
+        self.entries.clear()
@@ -0,0 +1,297 @@
+import json
+import sys
+import threading
+import time
+
+import numpy as np
+from gymnasium.vector import VectorWrapper
+
+from .timing import bin_edges, bin_quantile
+
+
+class Histogram:
+    """
+    Fixed bins between low and high, plus one underflow and one overflow bin, with the running
+    count, sum, min and max. Same bins and quantiles as StepTimer, see timing.bin_quantile.
+
+    :param log: log-spaced bins (low must be > 0), for durations and other heavy-tailed values
+    """
+
+    def __init__(self, low, high, n_bins=64, log=False):
+        self.edges = bin_edges(low, high, n_bins, log=log)
+        self.log = log
+        self.counts = np.zeros(n_bins + 2, dtype=np.int64)
+        self.reset()
+
+    def reset(self):
+        self.counts[:] = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def observe(self, values):
+        values = np.asarray(values, dtype=np.float64).ravel()
+        if len(values) == 0:
+            return
+        self.counts += np.bincount(np.searchsorted(self.edges, values, side='right'), minlength=len(self.counts))
+        self.count += len(values)
+        self.sum += float(values.sum())
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+
+    def quantile(self, q):
+        """Approximate quantile, the middle of its bin (geometric middle for log bins), clipped to [min, max]"""
+        if self.count == 0:
+            return float('nan')
+        middle = bin_quantile(self.counts, self.edges, q, self.log, lowest=self.min, highest=self.max)
+        return float(min(max(middle, self.min), self.max))
+
+    def summary(self, quantiles=(0.5, 0.9, 0.99)):
+        metrics = {'count': self.count}
+        if self.count:
+            metrics.update(mean=self.sum / self.count, min=self.min, max=self.max)
+            metrics.update({f'p{int(q * 100)}': self.quantile(q) for q in quantiles})
+        return metrics
+
+
+class MetricsAggregator:
+    """
+    Env side metrics with constant memory: counters, histograms and categorical counts are numpy arrays
+    declared up front, updated with one vectorized call per batch instead of per step python dicts.
+
+    A background thread flushes the metrics of the last window every `interval` seconds to `sink`
+    (a callable taking a flat {name: value} dict and a step), then starts a new window; counters also
+    report their total since the start.
+
+    :param sink: see JsonlSink and WandbSink, default_sink picks one
+    :param interval: seconds between flushes
+    """
+
+    def __init__(self, sink=None, interval=30.0):
+        self.sink = sink
+        self.interval = interval
+        self.counters = {}
+        self.totals = {}
+        self.histograms = {}
+        self.categoricals = {}
+        self.flushes = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self.thread = None
+
+    def counter(self, name):
+        self.counters[name] = 0
+        self.totals[name] = 0
+        return self
+
+    def histogram(self, name, low, high, n_bins=64, log=False):
+        self.histograms[name] = Histogram(low, high, n_bins=n_bins, log=log)
+        return self
+
+    def categorical(self, name, n):
+        """Counts of the integer values 0..n-1, e.g. actions"""
+        self.categoricals[name] = np.zeros(n, dtype=np.int64)
+        return self
+
+    def add(self, name, values=1):
+        """Adds the sum of values (a number, or a batch of them) to a counter"""
+        amount = int(np.sum(values))
+        with self._lock:
+            self.counters[name] += amount
+            self.totals[name] += amount
+
+    def observe(self, name, values):
+        with self._lock:
+            self.histograms[name].observe(values)
+
+    def count(self, name, values):
+        counts = self.categoricals[name]
+        with self._lock:
+            counts += np.bincount(np.asarray(values, dtype=np.int64).ravel(), minlength=len(counts))
+
+    def snapshot(self, reset=True):
+        """Flat {name: value} metrics of the running window, a new window is started if reset"""
+        with self._lock:
+            metrics = {}
+            for name, value in self.counters.items():
+                metrics[name] = value
+                metrics[f'{name}_total'] = self.totals[name]
+            for name, histogram in self.histograms.items():
+                metrics.update({f'{name}/{key}': value for key, value in histogram.summary().items()})
+            for name, counts in self.categoricals.items():
+                total = max(int(counts.sum()), 1)
+                metrics.update({f'{name}/{i}': int(c) / total for i, c in enumerate(counts)})
+
+            if reset:
+                self.counters = dict.fromkeys(self.counters, 0)
+                for histogram in self.histograms.values():
+                    histogram.reset()
+                for counts in self.categoricals.values():
+                    counts[:] = 0
+        return metrics
+
+    def flush(self):
+        metrics = self.snapshot()
+        if self.sink is not None:
+            self.sink(metrics, self.flushes)
+        self.flushes += 1
+        return metrics
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.flush()
+
+    def start(self):
+        self._stop.clear()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """Stops the flush thread and flushes the last window"""
+        self._stop.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.flush()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class JsonlSink:
+    """Appends one json line {"step", "time", **metrics} per flush to path"""
+
+    def __init__(self, path='metrics.jsonl'):
+        self.path = path
+
+    def __call__(self, metrics, step):
+        with open(self.path, 'a') as f:
+            f.write(json.dumps({'step': step, 'time': time.time(), **metrics}) + '\n')
+
+
+class WandbSink:
+    """Logs each flush to a W&B run, the active one by default"""
+
+    def __init__(self, run=None, prefix='env/'):
+        import wandb
+        self.run = run or wandb.run
+        self.prefix = prefix
+
+    def __call__(self, metrics, step):
+        self.run.log({self.prefix + name: value for name, value in metrics.items()})
+
+
+def default_sink(path='metrics.jsonl'):
+    """WandbSink if a W&B run is active, JsonlSink on path otherwise"""
+    # no run can be active if wandb was never imported, and importing it only to check takes a second
+    wandb = sys.modules.get('wandb')
+    if wandb is not None and wandb.run is not None:
+        return WandbSink()
+    return JsonlSink(path)
+
+
+class VecMetrics(VectorWrapper):
+    """
+    Feeds a MetricsAggregator from a CelesteVecEnv, one vectorized update per step:
+    rewards, actions, episode returns and lengths, deaths (terminations), truncations,
+    room transitions and unhealthy instances.
+
+    Follows the env's NEXT_STEP autoreset: the step after an episode ended is its reset, its action
+    is ignored and it is not counted. Room transitions are inferred from the reward, the mod gives
+    a bonus of `room_reward` the first time a room is entered.
+
+    Steps of unhealthy instances (info['unhealthy']) only count as unhealthy_steps: the episode cut
+    by the failure is dropped instead of counted, and the reply after the instance recovers is its reset.
+    """
+
+    def __init__(self, env, metrics=None, room_reward=10.0):
+        super().__init__(env)
+        self.room_reward = room_reward
+        n_actions = int(env.single_action_space.n)
+        self.metrics = metrics or MetricsAggregator(default_sink())
+        (self.metrics
+         .counter('steps').counter('episodes').counter('deaths').counter('truncations')
+         .counter('rooms').counter('unhealthy_steps')
+         .histogram('reward', -2, 12, n_bins=56)
+         .histogram('episode_return', -50, 200, n_bins=100)
+         .histogram('episode_length', 1, 1e5, n_bins=50, log=True)
+         .categorical('actions', n_actions))
+
+        self._returns = np.zeros(self.num_envs, dtype=np.float64)
+        self._lengths = np.zeros(self.num_envs, dtype=np.int64)
+        self._done = np.zeros(self.num_envs, dtype=bool)
+        # last action sent to each instance, recv answers for any subset of them
+        self._actions = np.zeros(self.num_envs, dtype=np.int64)
+        if self.metrics.thread is None:
+            self.metrics.start()
+
+    def _record(self, rewards, terminated, truncated, info, env_ids=None):
+        env_ids = np.arange(self.num_envs) if env_ids is None else np.asarray(env_ids)
+        # instances that were reset on this step did not play their action
+        played = ~self._done[env_ids]
+        failed = env_ids[:0]
+        if 'unhealthy' in info:
+            unhealthy = np.asarray(info['unhealthy'])
+            self.metrics.add('unhealthy_steps', unhealthy)
+            # silent instances did not play either, their running episode is dropped
+            failed = env_ids[unhealthy]
+            self._returns[failed] = 0
+            self._lengths[failed] = 0
+            played &= ~unhealthy
+        ids = env_ids[played]
+        rewards = np.asarray(rewards)[played]
+        terminated, truncated = np.asarray(terminated)[played], np.asarray(truncated)[played]
+
+        self._returns[ids] += rewards
+        self._lengths[ids] += 1
+        self.metrics.add('steps', len(ids))
+        self.metrics.observe('reward', rewards)
+        self.metrics.add('rooms', rewards >= self.room_reward / 2)
+        self.metrics.count('actions', self._actions[ids])
+
+        done = terminated | truncated
+        if done.any():
+            finished = ids[done]
+            self.metrics.add('episodes', len(finished))
+            self.metrics.add('deaths', terminated)
+            self.metrics.add('truncations', truncated)
+            self.metrics.observe('episode_return', self._returns[finished])
+            self.metrics.observe('episode_length', self._lengths[finished])
+            self._returns[finished] = 0
+            self._lengths[finished] = 0
+
+        self._done[env_ids] = False
+        self._done[ids[done]] = True
+        self._done[failed] = True
+
+    def reset(self, seed=None, options=None):
+        obs, info = self.env.reset(seed=seed, options=options)
+        self._returns[:] = 0
+        self._lengths[:] = 0
+        self._done[:] = False
+        return obs, info
+
+    def step(self, actions):
+        self._actions[:] = actions
+        obs, rewards, terminated, truncated, info = self.env.step(actions)
+        self._record(rewards, terminated, truncated, info)
+        return obs, rewards, terminated, truncated, info
+
+    def send(self, actions, env_ids=None):
+        self._actions[slice(None) if env_ids is None else np.asarray(env_ids)] = actions
+        self.env.send(actions, env_ids)
+
+    def recv(self, batch_size=None, timeout=None):
+        obs, rewards, terminated, truncated, info = self.env.recv(batch_size, timeout)
+        self._record(rewards, terminated, truncated, info, info['env_id'])
+        return obs, rewards, terminated, truncated, info
+
+    def close(self, **kwargs):
+        # flushes the last window
+        self.metrics.stop()
+        return super().close(**kwargs)
@@ -1,22 +1,50 @@
-from stable_baselines3.common.torch_layers import BaseFeaturesExtractor
+from typing import Any, Dict, Optional, Sequence, Tuple, Type, Union
 
 import gymnasium as gym
+import gymnasium.spaces as spaces
+import numpy as np
+import torch
 import torch as th
-from gymnasium import spaces
+from stable_baselines3.common.torch_layers import BaseFeaturesExtractor
 from torch import nn
-from stable_baselines3.common.torch_layers import NatureCNN
+
 from .level import LevelRenderer
 
-import gymnasium.spaces as spaces
 
-from typing import Any, Dict, Optional, Sequence, Tuple, Type, Union
+def compile_module(module, mode):
+    """torch.jit.script ('script') or torch.compile ('compile') a module"""
+    if mode == 'script':
+        return th.jit.script(module)
+    if mode == 'compile':
+        return th.compile(module)
+    raise ValueError(f'Unknown compile mode {mode}')
 
-import numpy as np
-import torch
-from torch import nn
 
-from tianshou.utils.net.common import MLP
-import gymnasium as gym
+def expand_image(image, entities=None):
+    """
+    Float (B, C, H, W) image from a batch of compact observations (see LevelRenderer.compact_image):
+    uint8 solids are scaled back to [0, 1] and bit-packed entity channels are unpacked.
+
+    Also takes the float tensors SB3's preprocess_obs makes of them: the image already divided
+    by 255 and the packed entity bytes cast to float.
+    """
+    image = th.as_tensor(image)
+    solids = image[:, :1].float() / 255 if image.dtype == th.uint8 else image[:, :1].float()
+    if entities is None:
+        return th.cat([solids, (image[:, 1:] > 0).float()], dim=1)
+
+    entities = th.as_tensor(entities, device=image.device)
+    if entities.dtype != th.uint8:
+        # float32 holds the byte values exactly
+        entities = entities.to(th.uint8)
+    batch, n_entities = entities.shape[:2]
+    height, width = image.shape[-2:]
+
+    # np.packbits is big endian: first pixel is the highest bit
+    shifts = th.arange(7, -1, -1, device=entities.device, dtype=th.uint8)
+    bits = (entities.unsqueeze(-1) >> shifts) & 1
+    bits = bits.reshape(batch, n_entities, -1)[..., :height*width].reshape(batch, n_entities, height, width)
+    return th.cat([solids, bits.float()], dim=1)
 
 
 class ImprovisedCNN(BaseFeaturesExtractor):
@@ -28,13 +56,16 @@ class ImprovisedCNN(BaseFeaturesExtractor):
         or not (this disables dtype and bounds checks): when True, it only checks that
         the space is a Box and has 3 dimensions.
         Otherwise, it checks that it has expected dtype (uint8) and bounds (values in [0, 255]).
+    :param compile_mode: 'script' or 'compile' to run the cnn and its linear head through torch.jit.script /
+        torch.compile, the channel gather before them stays eager
     """
 
     def __init__(
         self,
         observation_space: gym.Space,
         features_dim: int = 64,
-        device = 'cpu'
+        device = 'cpu',
+        compile_mode: Optional[str] = None,
     ) -> None:
         assert isinstance(observation_space, spaces.Box), (
             "NatureCNN must be used with a gym.spaces.Box ",
@@ -55,21 +86,157 @@ class ImprovisedCNN(BaseFeaturesExtractor):
         ).to(self.device)
 
         self.linear = nn.Sequential(nn.LazyLinear(features_dim), nn.ReLU()).to(self.device)
+
+        # channel i interleaved with the player channel: [0, P, 1, P, ..., 8, P]
+        gather_idx = [idx for i in range(len(LevelRenderer.ID_MAP)) for idx in (i, LevelRenderer.ID_MAP['Player'])]
+        self.register_buffer('gather_idx', th.tensor(gather_idx, dtype=th.long, device=self.device), persistent=False)
         
-        self.forward(th.ones((1, self.n_space*4, observation_space.shape[1], observation_space.shape[2])))
+        self.forward(th.ones((1, self.n_space*4, observation_space.shape[1], observation_space.shape[2]), device=self.device))
+
+        if compile_mode is not None:
+            self.cnn = compile_module(self.cnn, compile_mode)
+            self.linear = compile_module(self.linear, compile_mode)
 
     def forward(self, observations: th.Tensor) -> th.Tensor:
-        fullobs = th.empty((observations.shape[0],self.n_space*2,observations.shape[-2],observations.shape[-1]), device=self.device)
+        fullobs = observations.to(device=self.gather_idx.device, dtype=th.float32).index_select(1, self.gather_idx)
+        return self.linear(self.cnn(fullobs))
 
-        for i in range(len(LevelRenderer.ID_MAP)):
-            fullobs[:, i*2] = observations[:, i]
-            fullobs[:, (i*2)+1] = observations[:, LevelRenderer.ID_MAP['Player']]
+class ObservationCollator:
+    """
+    Packs batches of dict observations into one preallocated, contiguous buffer per dtype,
+    with per-key column offsets computed once from the spaces.Dict. Each key is then a view
+    of that buffer, no per-key tensor is allocated.
+
+    The flat vector keys and the optional action are laid out side by side, in the order of
+    the observation space, so that the vector extractor input is a single slice instead of a th.cat.
+
+    Numpy inputs (tianshou) are written to a host buffer, pinned when the device is a gpu, and
+    moved with a single copy per dtype. On cpu, non-vector numpy inputs that already have the right
+    dtype (the image) are wrapped without a copy.
+
+    Tensor inputs (SB3) are already on the device: vector keys are copied into the device buffer, the
+    other keys are passed through unchanged. SB3's preprocess_obs turns uint8 images into floats
+    divided by 255, casting them back into the uint8 buffer would truncate them.
+
+    The buffer is reused between calls when gradients are disabled (rollouts), with gradients
+    enabled a new one is allocated per call since autograd keeps references to its inputs.
+    """
+
+    def __init__(self, observation_space: spaces.Dict, vector_keys, action_size=None, device='cpu', batch_size=64):
+        self.device = th.device(device if device is not None else 'cpu')
+        self.cpu = self.device.type == 'cpu'
+        self.pin_memory = self.device.type == 'cuda'
+        self.vector_keys = list(vector_keys)
+
+        # dtype -> total width, key -> (dtype, start, end, shape)
+        self.widths = {}
+        self.layout = {}
+        keys = [key for key in observation_space.spaces if key not in self.vector_keys] + self.vector_keys
+        for key in keys:
+            subspace = observation_space.spaces[key]
+            dtype = th.uint8 if subspace.dtype == np.uint8 else th.float32
+            self._add(key, dtype, subspace.shape)
+        if action_size is not None:
+            self._add('act', th.float32, (action_size,))
+
+        self.vector_columns = self.vector_keys + (['act'] if action_size is not None else [])
+        columns = [self.layout[key][1:3] for key in self.vector_columns]
+        self.vector_slice = slice(columns[0][0], columns[-1][1]) if columns else slice(0, 0)
+
+        self.capacity = 0
+        self._allocate(batch_size)
+
+    def _add(self, key, dtype, shape):
+        start = self.widths.get(dtype, 0)
+        self.widths[dtype] = start + int(np.prod(shape))
+        self.layout[key] = (dtype, start, self.widths[dtype], tuple(shape))
+
+    def _buffers(self, batch_size):
+        host = {dtype: th.empty((batch_size, width), dtype=dtype, pin_memory=self.pin_memory)
+                for dtype, width in self.widths.items()}
+        if self.device.type == 'cpu':
+            return host, host
+        return host, {dtype: th.empty((batch_size, width), dtype=dtype, device=self.device)
+                      for dtype, width in self.widths.items()}
+
+    def _allocate(self, batch_size):
+        self.host, self.buffers = self._buffers(batch_size)
+        self.capacity = batch_size
+        self.views = {}
+
+    def _views(self, buffers, batch_size):
+        views = {key: buffers[dtype][:batch_size, start:end].view(batch_size, *shape)
+                 for key, (dtype, start, end, shape) in self.layout.items()}
+        views['vectors'] = buffers[th.float32][:batch_size, self.vector_slice] if th.float32 in buffers else None
+        return views
+
+    def collate(self, observations, act=None):
+        """Returns a dict of (B, *shape) views, plus 'vectors', the (B, n) input of the vector extractor"""
+        values = {key: observations[key] for key in self.layout if key != 'act'}
+        if act is not None:
+            values['act'] = act
+        batch_size = len(next(iter(values.values())))
+
+        if th.is_grad_enabled():
+            host, buffers = self._buffers(batch_size)
+            batch = self._views(buffers, batch_size)
+        else:
+            if batch_size > self.capacity:
+                self._allocate(max(batch_size, 2 * self.capacity))
+            host, buffers = self.host, self.buffers
+            # views of the reused buffer only depend on the batch size
+            if batch_size not in self.views:
+                self.views[batch_size] = self._views(buffers, batch_size)
+            batch = dict(self.views[batch_size])
+
+        moved = set()
+        for key, value in values.items():
+            if isinstance(value, th.Tensor):
+                continue
+            dtype, start, end, shape = self.layout[key]
+
+            value = np.asarray(value)
+            if self.cpu and key not in self.vector_columns and value.dtype == _NUMPY_DTYPES[dtype]:
+                # already usable as is, a view of the numpy array beats a copy into the buffer
+                batch[key] = th.from_numpy(value).view(batch_size, *shape)
+                continue
+
+            # numpy inputs are packed with numpy (much cheaper than torch ops on small arrays)
+            # into the host buffer, then moved with one transfer per dtype
+            host[dtype].numpy()[:batch_size, start:end] = value.reshape(batch_size, -1)
+            moved.add(dtype)
+
+        if buffers is not host:
+            for dtype in moved:
+                buffers[dtype][:batch_size].copy_(host[dtype][:batch_size], non_blocking=True)
+
+        # tensors (already on the device with SB3): vectors are written in place after the host
+        # transfer, the rest keeps its dtype, see the class docstring
+        for key, value in values.items():
+            if isinstance(value, th.Tensor):
+                dtype, start, end, shape = self.layout[key]
+                if key in self.vector_columns:
+                    buffers[dtype][:batch_size, start:end].copy_(value.reshape(batch_size, -1))
+                else:
+                    batch[key] = value.to(self.device).reshape(batch_size, *shape)
+        return batch
+
+
+_NUMPY_DTYPES = {th.uint8: np.uint8, th.float32: np.float32}
 
-        # fullinp = th.cat([observations[:, [i,LevelRenderer.ID_MAP['Player']]] for i in range(LevelRenderer.max_idx+1) if i != LevelRenderer.ID_MAP['Player']], dim=1)
-        return self.linear(self.cnn(fullobs))
 
 class CustomCombinedExtractor(BaseFeaturesExtractor):
-    def __init__(self, observation_space: spaces.Dict, device='cpu', inter_size = 64, out_size=64, action_size=None):
+    """
+    Image features from ImprovisedCNN concatenated with an MLP over the flat vector observations
+    (and the previous action), inputs are gathered by an ObservationCollator.
+
+    :param compile_mode: 'script' or 'compile' to compile the tensor submodules: the cnn, its linear head and
+        the vector MLP. The collation, the expansion of compact images, the channel gather and the
+        concatenation stay eager
+    """
+
+    def __init__(self, observation_space: spaces.Dict, device='cpu', inter_size = 64, out_size=64, action_size=None,
+                 compile_mode=None):
         # We do not know features-dim here before going over all the items,
         # so put something dummy for now. PyTorch requires calling
         # nn.Module.__init__ before adding modules
@@ -82,6 +249,7 @@ class CustomCombinedExtractor(BaseFeaturesExtractor):
         self.spaces = observation_space.spaces
         
         vector_spaces = []
+        vector_keys = []
         
         total_concat_size = 0
         
@@ -93,13 +261,21 @@ class CustomCombinedExtractor(BaseFeaturesExtractor):
                 # We will just downsample one channel of the image by 4x4 and flatten.
                 # Assume the image is single-channel (subspace.shape[0] == 0)
                 
-                extractor = ImprovisedCNN(subspace, device=self.device)
+                # compact (uint8 / bit-packed) images are expanded to floats in forward
+                channels = subspace.shape[0] + (actual_observes['entities'].shape[0] if 'entities' in actual_observes else 0)
+                image_space = spaces.Box(low=0, high=1, shape=(channels, *subspace.shape[1:]), dtype=np.float32)
+                extractor = ImprovisedCNN(image_space, device=self.device, compile_mode=compile_mode)
                 extractors[key] = extractor
-                total_concat_size += extractor.linear[0].out_features
+                total_concat_size += extractor.features_dim
                 
+            # bit-packed entity channels, unpacked together with the image
+            elif key == "entities":
+                continue
+
             # assume flat vectors
             else:
                 vector_spaces.append(subspace)
+                vector_keys.append(key)
 
         # create vector extractor
         input_shape = sum(x.shape[0] for x in vector_spaces) + (action_size if action_size is not None else 0)
@@ -107,41 +283,33 @@ class CustomCombinedExtractor(BaseFeaturesExtractor):
             nn.Linear(input_shape, inter_size),
             nn.ReLU(),
             nn.Linear(inter_size, out_size)).to(self.device)
+        if compile_mode is not None:
+            vector_extractor = compile_module(vector_extractor, compile_mode)
         total_concat_size += out_size
         extractors['vectors'] = vector_extractor
         
         self.extractors = nn.ModuleDict(extractors)
+        # compact images arrive as uint8 (numpy) or as floats (SB3 tensors) and are expanded either way
+        self.compact = 'image' in actual_observes and actual_observes['image'].dtype == np.uint8
 
         # Update the features dim manually
         self._features_dim = total_concat_size
 
+        self.collator = ObservationCollator(observation_space, vector_keys, action_size=action_size, device=self.device)
+
     def forward(self, observations, state=None, act=None) -> th.Tensor:
         encoded_tensor_list = []
 
-        obs_dic = observations
-        vector_obs = []
-        
-        # self.extractors contain nn.Modules that do all the processing.
-        for key in self.spaces:
-            
-            obs = observations[key]
-                    
-            if self.device is not None:
-                obs = th.as_tensor(obs, device=self.device, dtype=th.float32)
-                
-            # binary are treated as single dim for some reason
-            if obs.dim() == 1:
-                obs = obs[...,None]
-            
-            if key in self.extractors:
-                encoded_tensor_list.append(self.extractors[key](obs))
-            else:
-                
-                vector_obs.append(obs)
-            
-        encoded_tensor_list.append(self.extractors['vectors'](th.cat(vector_obs +
-                                                                     ([th.as_tensor(act, device=self.device, dtype=th.float32)]
-                                                                      if act is not None else []), dim=1)))
+        # every key is a view of the collator's buffer
+        batch = self.collator.collate(observations, act)
+
+        if "image" in self.extractors:
+            image = batch["image"]
+            if self.compact:
+                image = expand_image(image, batch.get("entities"))
+            encoded_tensor_list.append(self.extractors["image"](image))
+
+        encoded_tensor_list.append(self.extractors['vectors'](batch['vectors']))
         
         # Return a (B, self._features_dim) PyTorch tensor, where B is batch dimension.
         return th.cat(encoded_tensor_list, dim=1), state
@@ -179,6 +347,9 @@ class CustomCritic(nn.Module):
         linear_layer: Type[nn.Linear] = nn.Linear,
         flatten_input: bool = True,
     ) -> None:
+        # tianshou is only imported by tianshou users, it doubles the import time of this module
+        from tianshou.utils.net.common import MLP
+
         super().__init__()
         self.device = device
         self.preprocess = preprocess_net
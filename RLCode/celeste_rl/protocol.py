@@ -0,0 +1,152 @@
+import base64
+import io
+import json
+
+import numpy as np
+
+# Wire protocol versions, negotiated on the reset handshake.
+#   JSON_PROTOCOL:   single frame, json [base64 png, reward, terminated]
+#   BINARY_PROTOCOL: two frames, [header, raw uint8 rgb pixels]
+#   SHM_PROTOCOL:    pixels are written to a shared memory ring (see SharedFrameRing), replies are
+#                    [header, u4 slot index], plus a json frame describing the ring on resets
+# Json replies may append the header flags to the list, binary and shm ones carry them in the header.
+# Only games that set MULTI_FRAME on their reset reply understand multi-frame action requests (the stand-in
+# server does, the mod does not: it only parses the plain 7 element list).
+JSON_PROTOCOL = 1
+BINARY_PROTOCOL = 2
+SHM_PROTOCOL = 3
+
+RESET = 1
+
+# Header flags
+#   EARLY_TERMINATION: the episode ended before every frame of a multi-frame request was played
+#   MULTI_FRAME: set on reset replies, the game plays multi-frame action requests
+EARLY_TERMINATION = 1
+MULTI_FRAME = 2
+
+# Fixed layout header sent as first frame of a binary reply, read with np.frombuffer
+HEADER_DTYPE = np.dtype([('reward', '<f8'),
+                         ('step', '<u4'),
+                         ('height', '<u2'),
+                         ('width', '<u2'),
+                         ('version', 'u1'),
+                         ('channels', 'u1'),
+                         ('terminated', 'u1'),
+                         ('flags', 'u1')])
+
+
+def reset_message(protocol=JSON_PROTOCOL):
+    """Handshake sent on reset, older mods only understand [1]"""
+    if protocol == JSON_PROTOCOL:
+        return json.dumps([RESET])
+    return json.dumps([RESET, protocol])
+
+
+def requested_protocol(msg):
+    """Protocol requested by a decoded client message, None if it is not a reset"""
+    if not isinstance(msg, list):
+        return None
+    if len(msg) == 1 and msg[0] == RESET:
+        return JSON_PROTOCOL
+    if len(msg) == 2 and msg[0] == RESET:
+        return int(msg[1])
+    return None
+
+
+def action_message(actions, repeat=1):
+    """
+    Action request. A single action played for one frame is the plain 7 element list every mod
+    understands. Otherwise the request is {"actions": [...], "repeat": r}: each action is held
+    for r frames and the reply, sent after the last frame, carries the summed reward. Only games
+    that set MULTI_FRAME on their reset reply understand it.
+
+    :param actions: one 7 element action or a list of them
+    """
+    if not isinstance(actions[0], (list, tuple)):
+        actions = [actions]
+    if len(actions) == 1 and repeat == 1:
+        return json.dumps(actions[0])
+    return json.dumps({'actions': actions, 'repeat': repeat})
+
+
+def frame_actions(msg):
+    """Decoded action request as the list of 7 element actions to play, one per frame"""
+    if isinstance(msg, dict):
+        return [action for action in msg['actions'] for _ in range(msg.get('repeat', 1))]
+    return [msg]
+
+
+def encode_header(reward, terminated, step, height, width, channels=3, flags=0, version=BINARY_PROTOCOL):
+    header = np.zeros((), dtype=HEADER_DTYPE)
+    header['reward'] = reward
+    header['step'] = step
+    header['height'] = height
+    header['width'] = width
+    header['version'] = version
+    header['channels'] = channels
+    header['terminated'] = terminated
+    header['flags'] = flags
+    return header.tobytes()
+
+
+def decode_header(buffer):
+    """Returns a 0-d structured view over the header frame (no copy)"""
+    header = np.frombuffer(buffer, dtype=HEADER_DTYPE, count=1)[0]
+    if header['version'] not in (BINARY_PROTOCOL, SHM_PROTOCOL):
+        raise ValueError(f"Unsupported protocol version {header['version']}")
+    return header
+
+
+def reply_version(frames):
+    """Protocol of a received multipart reply"""
+    if len(frames) == 1:
+        return JSON_PROTOCOL
+    return int(decode_header(_buffer(frames[0]))['version'])
+
+
+def decode_pixels(buffer, header):
+    """Read-only (H, W, C) uint8 view over the pixel frame (no copy)"""
+    return np.frombuffer(buffer, dtype=np.uint8).reshape(int(header['height']),
+                                                         int(header['width']),
+                                                         int(header['channels']))
+
+
+def decode_binary(frames):
+    """Decode a [header, pixels] multipart reply into (pixels, reward, terminated, step, flags)"""
+    header_frame, pixel_frame = frames
+    header = decode_header(_buffer(header_frame))
+    pixels = decode_pixels(_buffer(pixel_frame), header)
+    return pixels, float(header['reward']), bool(header['terminated']), int(header['step']), int(header['flags'])
+
+
+def encode_slot(slot):
+    return np.uint32(slot).tobytes()
+
+
+def decode_shm(frames):
+    """
+    Decode a [header, slot(, ring)] shared memory reply into
+    (slot, reward, terminated, step, flags, ring), ring is None unless the reply describes the ring
+    """
+    header = decode_header(_buffer(frames[0]))
+    slot = int(np.frombuffer(_buffer(frames[1]), dtype='<u4', count=1)[0])
+    ring = json.loads(bytes(_buffer(frames[2]))) if len(frames) > 2 else None
+    return slot, float(header['reward']), bool(header['terminated']), int(header['step']), int(header['flags']), ring
+
+
+def decode_png(obs):
+    # imported here, only the json fallback needs PIL
+    import PIL.Image as Image
+    return np.array(Image.open(io.BytesIO(base64.b64decode(obs))))[..., :3]
+
+
+def encode_png(pixels):
+    import PIL.Image as Image
+    buffer = io.BytesIO()
+    Image.fromarray(np.ascontiguousarray(pixels)).save(buffer, format='png')
+    return base64.b64encode(buffer.getvalue()).decode('ascii')
+
+
+def _buffer(frame):
+    # zmq.Frame when received with copy=False, bytes otherwise
+    return getattr(frame, 'buffer', frame)
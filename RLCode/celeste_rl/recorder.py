@@ -0,0 +1,346 @@
+import json
+import os
+import queue
+import threading
+
+import gymnasium as gym
+import numpy as np
+
+# On disk, a dataset is a directory holding:
+#   meta.json         dtype / shape of every field
+#   <field>.bin       raw, append-only column of fixed-shape rows
+#   <field>.offsets   for variable length (bytes) fields, int64 end offset of each row in <field>.bin
+#   episodes.bin      int64 row index at which each episode starts
+# Every file is only ever appended to, readers memory-map them and only see complete rows. A writer reopening
+# a dataset first cuts every file back to the rows all columns hold, what a writer that stopped midway left.
+
+META = 'meta.json'
+EPISODES = 'episodes.bin'
+BYTES = 'bytes'
+FLUSH = object()
+
+
+class _Column:
+    """Fixed-shape column, rows are gathered in a preallocated chunk written in one go"""
+
+    def __init__(self, path, dtype, shape, chunk_size, n_rows=0):
+        self.file = open(path, 'ab')
+        # rows past n_rows have no counterpart in the other columns
+        self.file.truncate(min(self.file.tell(), n_rows * np.dtype(dtype).itemsize * int(np.prod(shape))))
+        self.chunk = np.empty((chunk_size, *shape), dtype=dtype)
+        self.count = 0
+
+    def append(self, value):
+        self.chunk[self.count] = value
+        self.count += 1
+        if self.count == len(self.chunk):
+            self.flush()
+
+    def flush(self):
+        self.file.write(self.chunk[:self.count].tobytes())
+        self.file.flush()
+        self.count = 0
+
+    def close(self, flush=True):
+        if flush:
+            self.flush()
+        self.file.close()
+
+
+class _BytesColumn:
+    """Variable length column: raw bytes plus a fixed int64 column of end offsets"""
+
+    def __init__(self, path, chunk_size, n_rows=0):
+        offsets_path = path[:-len('.bin')] + '.offsets'
+        self.offsets = _Column(offsets_path, np.int64, (), chunk_size, n_rows)
+        # the data is cut at the end of the last kept row
+        self.end = int(np.fromfile(offsets_path, np.int64, count=1, offset=8 * (n_rows - 1))[0]) if n_rows else 0
+        self.file = open(path, 'ab')
+        self.file.truncate(self.end)
+
+    def append(self, value):
+        self.file.write(value)
+        self.end += len(value)
+        if self.offsets.count == len(self.offsets.chunk) - 1:
+            # the offsets chunk is about to be written, the bytes it points to go first
+            self.file.flush()
+        self.offsets.append(self.end)
+
+    def flush(self):
+        # data has to reach the disk before the offsets pointing to it
+        self.file.flush()
+        self.offsets.flush()
+
+    def close(self, flush=True):
+        if flush:
+            self.flush()
+        self.file.close()
+        self.offsets.close(flush)
+
+
+class TrajectoryWriter:
+    """
+    Streams rows of named fields (observations, actions, rewards, raw payloads...) to a
+    columnar dataset directory, see TrajectoryDataset for reading it back.
+
+    `append` only copies the row and puts it on a queue, chunks are filled and written by a
+    background thread so the step loop never waits on the disk. Fields are set by the first row:
+    arrays and scalars become fixed-shape columns, bytes variable length ones.
+
+    The writer stops at the first error: later rows are dropped and the next append, flush or close
+    raises it. Rows are checked against the fields before any column is written, if writing a column
+    still fails midway the rows not yet on disk are dropped rather than leave columns of different lengths.
+
+    :param path: dataset directory, appended to if it already exists
+    :param chunk_size: number of rows written per write call
+    """
+
+    def __init__(self, path, chunk_size=1024):
+        self.path = path
+        self.chunk_size = chunk_size
+        os.makedirs(path, exist_ok=True)
+
+        self.columns = None
+        self.rows = self._existing_rows()
+        self.queue = queue.Queue()
+        self.error = None
+        # an error happened between the first and the last column of a row
+        self.torn = False
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _existing_rows(self):
+        meta_path = os.path.join(self.path, META)
+        if not os.path.exists(meta_path):
+            return 0
+        return len(TrajectoryDataset(self.path))
+
+    def append(self, row, new_episode=False):
+        """Queue one row, a dict of field -> array / scalar / bytes"""
+        if self.error is not None:
+            raise self.error
+        # env buffers are reused between steps, take a copy now
+        row = {key: value if isinstance(value, bytes) else np.array(value) for key, value in row.items()}
+        self.queue.put((row, new_episode))
+
+    def flush(self):
+        """Block until every queued row is on disk"""
+        self.queue.put((FLUSH, None))
+        self.queue.join()
+        if self.error is not None:
+            raise self.error
+
+    def close(self):
+        self.queue.put((None, None))
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def _open(self, row):
+        meta_path = os.path.join(self.path, META)
+        fields = {key: {'dtype': BYTES, 'shape': None} if isinstance(value, bytes)
+                  else {'dtype': value.dtype.str, 'shape': list(value.shape)}
+                  for key, value in row.items()}
+
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                existing = json.load(f)['fields']
+            if existing != fields:
+                raise ValueError(f'Fields {fields} do not match the existing dataset {existing}')
+        else:
+            with open(meta_path, 'w') as f:
+                json.dump({'fields': fields}, f, indent=1)
+
+        # a previous writer may have stopped between columns, every file is cut back to self.rows
+        self.columns = {}
+        for key, field in fields.items():
+            column_path = os.path.join(self.path, f'{key}.bin')
+            if field['dtype'] == BYTES:
+                self.columns[key] = _BytesColumn(column_path, self.chunk_size, self.rows)
+            else:
+                self.columns[key] = _Column(column_path, np.dtype(field['dtype']), field['shape'], self.chunk_size,
+                                            self.rows)
+        episodes_path = os.path.join(self.path, EPISODES)
+        starts = np.fromfile(episodes_path, np.int64) if os.path.exists(episodes_path) else np.empty(0, np.int64)
+        # starts are increasing, the kept ones are a prefix
+        self.episodes = _Column(episodes_path, np.int64, (), self.chunk_size, np.count_nonzero(starts < self.rows))
+
+    def _check(self, row):
+        """Raises before any column is written if the row does not fit them"""
+        if row.keys() != self.columns.keys():
+            raise ValueError(f'Row fields {sorted(row)} do not match the dataset fields {sorted(self.columns)}')
+        for key, column in self.columns.items():
+            if isinstance(column, _BytesColumn):
+                if not isinstance(row[key], bytes):
+                    raise TypeError(f'Field {key} holds bytes, got {type(row[key]).__name__}')
+            elif row[key].shape != column.chunk.shape[1:]:
+                raise ValueError(f'Field {key} has shape {column.chunk.shape[1:]}, got {row[key].shape}')
+
+    def _flush(self):
+        if self.columns is None:
+            return
+        for column in self.columns.values():
+            column.flush()
+        # episodes last, readers never see an episode starting past the written rows
+        self.episodes.flush()
+
+    def _run(self):
+        while True:
+            row, new_episode = self.queue.get()
+            try:
+                if row is None:
+                    if self.columns is not None:
+                        if not self.torn:
+                            self._flush()
+                        for column in self.columns.values():
+                            column.close(flush=False)
+                        self.episodes.close(flush=False)
+                    return
+                if self.error is not None:
+                    # stopped at the first error
+                    continue
+                if row is FLUSH:
+                    self._flush()
+                    continue
+
+                if self.columns is None:
+                    self._open(row)
+                self._check(row)
+                self.torn = True
+                for key, column in self.columns.items():
+                    column.append(row[key])
+                # episodes last, like _flush
+                if new_episode:
+                    self.episodes.append(self.rows)
+                self.torn = False
+                self.rows += 1
+            except Exception as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+
+class TrajectoryDataset:
+    """
+    Memory-mapped reader of a TrajectoryWriter dataset, nothing is loaded in RAM until sliced.
+
+    Rows are the output of TrajectoryRecorder: the first row of an episode holds the reset
+    observation (action -1), following rows the observation reached by taking `action`.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, META)) as f:
+            self.fields = json.load(f)['fields']
+
+        self.columns = {}
+        self.offsets = {}
+        for key, field in self.fields.items():
+            column_path = os.path.join(path, f'{key}.bin')
+            if field['dtype'] == BYTES:
+                self.offsets[key] = self._memmap(os.path.join(path, f'{key}.offsets'), np.int64, [])
+                self.columns[key] = self._memmap(column_path, np.uint8, [])
+            else:
+                self.columns[key] = self._memmap(column_path, np.dtype(field['dtype']), field['shape'])
+
+        # a row only counts once every column holds it
+        self.n_rows = min([len(column) for key, column in self.columns.items() if key not in self.offsets] +
+                          [len(offsets) for offsets in self.offsets.values()])
+        starts = self._memmap(os.path.join(path, EPISODES), np.int64, [])
+        self.episode_starts = np.asarray(starts[starts < self.n_rows])
+
+    @staticmethod
+    def _memmap(path, dtype, shape):
+        dtype = np.dtype(dtype)
+        row_bytes = dtype.itemsize * int(np.prod(shape))
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        n_rows = size // row_bytes
+        if n_rows == 0:
+            return np.empty((0, *shape), dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode='r', shape=(n_rows, *shape))
+
+    def __len__(self):
+        return self.n_rows
+
+    @property
+    def n_episodes(self):
+        return len(self.episode_starts)
+
+    def episode_bounds(self, idx):
+        start = self.episode_starts[idx]
+        end = self.episode_starts[idx + 1] if idx + 1 < len(self.episode_starts) else self.n_rows
+        return int(start), int(end)
+
+    def episode(self, idx):
+        """Dict of memory-mapped views over one episode's rows"""
+        start, end = self.episode_bounds(idx)
+        return {key: self.columns[key][start:end] for key in self.columns if key not in self.offsets}
+
+    def bytes(self, key, idx):
+        """Raw value of a variable length field"""
+        offsets = self.offsets[key]
+        start = offsets[idx - 1] if idx > 0 else 0
+        return self.columns[key][start:offsets[idx]].tobytes()
+
+    def payload(self, idx, key='payload'):
+        return json.loads(self.bytes(key, idx))
+
+    def sample(self, batch_size, rng=None, keys=None):
+        """Random rows, only those are read from disk"""
+        if self.n_rows == 0:
+            raise ValueError(f'Cannot sample from {self.path}, it holds no rows')
+        rng = rng or np.random.default_rng()
+        idx = np.sort(rng.integers(0, self.n_rows, size=batch_size))
+        keys = keys or [key for key in self.columns if key not in self.offsets]
+        return {key: self.columns[key][idx] for key in keys}
+
+    def sample_transitions(self, batch_size, rng=None, obs_keys=None):
+        """Random (obs, action, reward, next_obs, terminated, truncated) transitions"""
+        rng = rng or np.random.default_rng()
+        # a row starting an episode has no previous observation
+        valid = np.ones(self.n_rows, dtype=bool)
+        valid[self.episode_starts] = False
+        valid[:1] = False
+        if not valid.any():
+            raise ValueError(f'Cannot sample transitions from {self.path}, it holds no step after a reset')
+        idx = np.sort(rng.choice(np.flatnonzero(valid), size=batch_size))
+
+        obs_keys = obs_keys or [key for key in self.columns if key.startswith('obs.')]
+        batch = {key[len('obs.'):]: self.columns[key][idx - 1] for key in obs_keys}
+        batch = {'obs': batch, 'next_obs': {key[len('obs.'):]: self.columns[key][idx] for key in obs_keys}}
+        for key in ('action', 'reward', 'terminated', 'truncated'):
+            batch[key] = self.columns[key][idx]
+        return batch
+
+
+class TrajectoryRecorder(gym.Wrapper):
+    """
+    Records everything a CelesteImgGym (or any dict observation env) sees to a TrajectoryWriter dataset.
+
+    Observation keys are stored as `obs.<key>` fields next to action, reward, terminated and truncated.
+    The reset observation of each episode is stored with action -1 and reward 0.
+    """
+
+    def __init__(self, env, path, chunk_size=1024):
+        super().__init__(env)
+        self.writer = TrajectoryWriter(path, chunk_size=chunk_size)
+
+    def _row(self, obs, action, reward, terminated, truncated):
+        row = {f'obs.{key}': value for key, value in obs.items()}
+        row.update(action=np.int64(action), reward=np.float32(reward),
+                   terminated=bool(terminated), truncated=bool(truncated))
+        return row
+
+    def reset(self, seed=None, options=None):
+        obs, info = self.env.reset(seed=seed, options=options)
+        self.writer.append(self._row(obs, -1, 0, False, False), new_episode=True)
+        return obs, info
+
+    def step(self, action):
+        obs, reward, terminated, truncated, info = self.env.step(action)
+        self.writer.append(self._row(obs, action, reward, terminated, truncated))
+        return obs, reward, terminated, truncated, info
+
+    def close(self):
+        self.writer.close()
+        return self.env.close()
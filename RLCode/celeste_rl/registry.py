@@ -0,0 +1,281 @@
+import argparse
+import contextlib
+import fcntl
+import json
+import os
+import socket
+import time
+
+import gymnasium as gym
+import zmq
+
+from .connection import InstanceUnhealthy
+
+# methods a RegistryClient can call on the registry behind a RegistryServer
+METHODS = ('register', 'unregister', 'set_health', 'instances', 'lease', 'release', 'leases')
+
+
+class InstanceRegistry:
+    """
+    File-based registry of game instances and of the envs leasing them.
+
+    Game instances are registered as host:port with their level and health, rollout workers lease one
+    per (worker_index, vector_index): a given index always gets the same instance back, two indices
+    never share one. The state is a json file rewritten atomically under an exclusive flock, so every
+    process of a host (or of several hosts, on a shared filesystem) can use it concurrently;
+    across hosts without one, serve it with RegistryServer.
+
+    :param path: json file holding the registry, created if missing
+    """
+
+    def __init__(self, path='instances.json'):
+        self.path = path
+
+    @contextlib.contextmanager
+    def _state(self, write=True):
+        with open(self.path + '.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                state = {'instances': {}, 'leases': {}}
+                if os.path.exists(self.path):
+                    with open(self.path) as f:
+                        state = json.load(f)
+                yield state
+                if write:
+                    tmp = f'{self.path}.{os.getpid()}.tmp'
+                    with open(tmp, 'w') as f:
+                        json.dump(state, f, indent=1)
+                    os.replace(tmp, self.path)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _key(host, port):
+        return f'{host}:{port}'
+
+    def register(self, host, port, level=None, healthy=True):
+        with self._state() as state:
+            state['instances'][self._key(host, port)] = {'host': host, 'port': int(port), 'level': level,
+                                                         'healthy': healthy, 'updated': time.time()}
+
+    def unregister(self, host, port):
+        key = self._key(host, port)
+        with self._state() as state:
+            state['instances'].pop(key, None)
+            state['leases'] = {k: lease for k, lease in state['leases'].items() if lease['instance'] != key}
+
+    def set_health(self, host, port, healthy):
+        with self._state() as state:
+            instance = state['instances'].get(self._key(host, port))
+            if instance is not None:
+                instance.update(healthy=healthy, updated=time.time())
+
+    def instances(self, level=None, healthy_only=False):
+        with self._state(write=False) as state:
+            return [instance for instance in state['instances'].values()
+                    if (level is None or instance['level'] == level) and (instance['healthy'] or not healthy_only)]
+
+    def leases(self):
+        with self._state(write=False) as state:
+            return state['leases']
+
+    @staticmethod
+    def _reap(state):
+        # leases of processes of this host that died without releasing them
+        hostname = socket.gethostname()
+        for key, lease in list(state['leases'].items()):
+            if lease['owner'] == hostname and not _alive(lease['pid']):
+                del state['leases'][key]
+
+    def lease(self, worker_index, vector_index, level=None, prefer_host=None, owner=None, pid=None):
+        """
+        Instance leased to (worker_index, vector_index), the same one as before if it still holds a lease.
+
+        Free healthy instances of `level` are picked on `prefer_host` first, then by host and port.
+        :param owner: hostname of the process holding the lease, this one by default
+        :param pid: pid of the process holding the lease, reaped once it is dead
+        :raises LookupError: if every matching instance is leased or unhealthy
+        """
+        key = f'{worker_index}/{vector_index}'
+        owner = owner or socket.gethostname()
+        pid = pid or os.getpid()
+        with self._state() as state:
+            self._reap(state)
+            lease = state['leases'].get(key)
+            if lease is not None and lease['instance'] in state['instances']:
+                lease.update(pid=pid, owner=owner, time=time.time())
+                return state['instances'][lease['instance']]
+
+            leased = {lease['instance'] for lease in state['leases'].values()}
+            free = [(name, instance) for name, instance in state['instances'].items()
+                    if name not in leased and instance['healthy'] and (level is None or instance['level'] == level)]
+            if not free:
+                raise LookupError(f'No free healthy instance for {key} (level {level})')
+
+            name, instance = min(free, key=lambda item: (item[1]['host'] != prefer_host,
+                                                         item[1]['host'], item[1]['port']))
+            state['leases'][key] = {'instance': name, 'owner': owner, 'pid': pid, 'time': time.time()}
+            return instance
+
+    def release(self, worker_index, vector_index):
+        with self._state() as state:
+            state['leases'].pop(f'{worker_index}/{vector_index}', None)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class RegistryServer:
+    """
+    Serves an InstanceRegistry to other hosts over zmq, requests are json [method, kwargs].
+
+    :param path: json file of the served registry
+    :param port: port to bind on (tcp://*:port)
+    """
+
+    def __init__(self, path='instances.json', port=7700, context=None):
+        self.registry = InstanceRegistry(path)
+        self.context = context or zmq.Context.instance()
+        self.socket = self.context.socket(zmq.REP)
+        self.socket.bind(f'tcp://*:{port}')
+
+    def serve_forever(self):
+        while True:
+            method, kwargs = json.loads(self.socket.recv())
+            try:
+                if method not in METHODS:
+                    raise AttributeError(f'Unknown registry method {method}')
+                reply = {'result': getattr(self.registry, method)(**kwargs)}
+            except Exception as e:
+                reply = {'error': type(e).__name__, 'message': str(e)}
+            self.socket.send_string(json.dumps(reply))
+
+
+class RegistryClient:
+    """Same methods as InstanceRegistry, called on a RegistryServer"""
+
+    ERRORS = {'LookupError': LookupError, 'AttributeError': AttributeError}
+
+    def __init__(self, endpoint, timeout=10_000, context=None):
+        self.endpoint = endpoint
+        self.timeout = timeout
+        self.context = context or zmq.Context.instance()
+
+    def _call(self, method, **kwargs):
+        # one short-lived socket per call, a lost reply never leaves a REQ socket stuck
+        with self.context.socket(zmq.REQ) as sock:
+            sock.setsockopt(zmq.LINGER, 0)
+            sock.connect(self.endpoint)
+            sock.send_string(json.dumps([method, kwargs]))
+            if not sock.poll(self.timeout):
+                raise TimeoutError(f'Registry {self.endpoint} did not answer within {self.timeout} ms')
+            reply = json.loads(sock.recv())
+        if 'error' in reply:
+            raise self.ERRORS.get(reply['error'], RuntimeError)(reply['message'])
+        return reply['result']
+
+    def lease(self, **kwargs):
+        # the lease belongs to this process, not to the server's, for _reap to check the right pid
+        return self._call('lease', owner=socket.gethostname(), pid=os.getpid(), **kwargs)
+
+    def __getattr__(self, method):
+        if method not in METHODS:
+            raise AttributeError(method)
+        return lambda **kwargs: self._call(method, **kwargs)
+
+
+def open_registry(address):
+    """RegistryClient for tcp:// endpoints, file-based InstanceRegistry otherwise"""
+    if address.startswith('tcp://'):
+        return RegistryClient(address)
+    return InstanceRegistry(address)
+
+
+class LeasedEnv(gym.Wrapper):
+    """
+    Env on an instance leased from a registry, the lease is released on close and
+    the instance is reported unhealthy if it stops answering, healthy again on its next successful reset or step.
+
+    :param make_env: callable (host, port) -> env
+    """
+
+    def __init__(self, make_env, registry, worker_index, vector_index, level=None):
+        self.registry = registry
+        self.worker_index = worker_index
+        self.vector_index = vector_index
+        self.instance = registry.lease(worker_index=worker_index, vector_index=vector_index,
+                                       level=level, prefer_host=socket.gethostname())
+        super().__init__(make_env(self.instance['host'], self.instance['port']))
+        # only changes of health are written to the registry
+        self.healthy = True
+
+    def _set_health(self, healthy):
+        if healthy != self.healthy:
+            self.registry.set_health(host=self.instance['host'], port=self.instance['port'], healthy=healthy)
+            self.healthy = healthy
+
+    def _report(self, fn, *args, **kwargs):
+        try:
+            result = fn(*args, **kwargs)
+        except (InstanceUnhealthy, TimeoutError):
+            self._set_health(False)
+            raise
+        self._set_health(True)
+        return result
+
+    def reset(self, seed=None, options=None):
+        return self._report(self.env.reset, seed=seed, options=options)
+
+    def step(self, action):
+        return self._report(self.env.step, action)
+
+    def close(self):
+        try:
+            return self.env.close()
+        finally:
+            self.registry.release(worker_index=self.worker_index, vector_index=self.vector_index)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Game instance registry')
+    parser.add_argument('--registry', default='instances.json', help='json file or tcp:// endpoint of a server')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    serve = commands.add_parser('serve', help='serve the json file registry over zmq')
+    serve.add_argument('--port', type=int, default=7700)
+
+    register = commands.add_parser('register', help='register instances of a host')
+    register.add_argument('--host', default=socket.gethostname())
+    register.add_argument('--ports', type=int, nargs='+', required=True)
+    register.add_argument('--level', default=None)
+
+    unregister = commands.add_parser('unregister')
+    unregister.add_argument('--host', default=socket.gethostname())
+    unregister.add_argument('--ports', type=int, nargs='+', required=True)
+
+    commands.add_parser('list')
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        RegistryServer(args.registry, args.port).serve_forever()
+
+    registry = open_registry(args.registry)
+    if args.command == 'register':
+        for port in args.ports:
+            registry.register(host=args.host, port=port, level=args.level)
+    elif args.command == 'unregister':
+        for port in args.ports:
+            registry.unregister(host=args.host, port=port)
+    elif args.command == 'list':
+        leased = {lease['instance']: key for key, lease in registry.leases().items()}
+        for instance in registry.instances():
+            name = f"{instance['host']}:{instance['port']}"
+            print(f"{name:30s} level {instance['level']}  healthy {instance['healthy']}  "
+                  f"leased by {leased.get(name, '-')}")
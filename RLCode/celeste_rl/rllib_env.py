@@ -0,0 +1,69 @@
+from ray.rllib.algorithms.callbacks import DefaultCallbacks
+from ray.rllib.env.vector_env import VectorEnv
+
+from .vec_env import CelesteVecEnv
+
+
+class CelesteRLlibVecEnv(VectorEnv):
+    """
+    RLlib VectorEnv over CelesteVecEnv, steps all game instances of a rollout worker
+    concurrently instead of one blocking recv per sub-env.
+
+    RLlib resets finished sub-envs itself through `reset_at`, so CelesteVecEnv's autoreset
+    never triggers here. An instance that stopped answering is truncated once, then returns its
+    last observation until its reconnect backoff is over, without blocking the others. Use it with num_envs_per_worker = 1, the vector env already
+    holds every instance of the worker.
+    """
+
+    def __init__(self, ports, **kwargs):
+        self.vec_env = CelesteVecEnv(ports, **kwargs)
+        super().__init__(self.vec_env.single_observation_space,
+                         self.vec_env.single_action_space,
+                         self.vec_env.num_envs)
+
+    def _obs_at(self, i):
+        # buffers are overwritten on the next step, RLlib keeps references around
+        return {'image': self.vec_env._images[i].copy()}
+
+    def vector_reset(self, *, seeds=None, options=None):
+        self.vec_env.reset()
+        return [self._obs_at(i) for i in range(self.num_envs)], [{} for _ in range(self.num_envs)]
+
+    def reset_at(self, index=None, *, seed=None, options=None):
+        index = 0 if index is None else index
+        # an unhealthy instance is not waited on during its backoff, its last observation is returned
+        healthy = self.vec_env._reset_at(index)
+        return self._obs_at(index), ({} if healthy else {'unhealthy': True})
+
+    def vector_step(self, actions):
+        _, rewards, terminated, truncated, _ = self.vec_env.step(actions)
+        return ([self._obs_at(i) for i in range(self.num_envs)],
+                rewards.tolist(),
+                terminated.tolist(),
+                truncated.tolist(),
+                [{} for _ in range(self.num_envs)])
+
+    def get_sub_environments(self):
+        return self.vec_env.envs
+
+    def close(self):
+        self.vec_env.close()
+
+
+class TimingCallbacks(DefaultCallbacks):
+    """
+    Reports the step spans of CelesteImgGym(timing=True) sub-envs as custom metrics,
+    `timing/<span>_<stat>`, averaged and min / maxed by RLlib over the episodes of an iteration.
+
+    config.callbacks(TimingCallbacks)
+    """
+
+    def on_episode_end(self, *, worker, base_env, policies, episode, env_index=None, **kwargs):
+        env = base_env.get_sub_environments()[env_index or 0]
+        timer = getattr(getattr(env, 'unwrapped', env), 'timer', None)
+        if timer is None:
+            return
+        # terminated episodes were already closed by the env, truncated ones are still running
+        summary = timer.end_episode() if timer.episode_steps else timer.last
+        for key, value in summary.items():
+            episode.custom_metrics[f'timing/{key}'] = value
@@ -0,0 +1,323 @@
+import argparse
+import json
+import os
+import threading
+import time
+
+import numpy as np
+import zmq
+
+from .level import LevelRenderer
+from .protocol import (BINARY_PROTOCOL, EARLY_TERMINATION, JSON_PROTOCOL, MULTI_FRAME, SHM_PROTOCOL, encode_header,
+                       encode_png, encode_slot, frame_actions, requested_protocol)
+from .shm import SharedFrameRing, default_ring_dir
+from .recorder import TrajectoryDataset
+
+
+def synthetic_payload(rng, room_size=(40, 23), n_entities=30, origin=(0, 0)):
+    """
+    Random payload in the format LevelRenderer.from_payload expects: solids tiles,
+    entity rectangles in world coordinates, room bounds and player state.
+
+    :param room_size: (width, height) of the room in tiles
+    :param origin: world (X, Y) of the room's top left corner
+    """
+    width, height = room_size
+    x, y = origin
+    tile = LevelRenderer.TILE_SIZE
+
+    tiles = rng.random((height, width)) < 0.15
+    tiles[-1] = True
+    tiles[:, 0] = True
+    # the mod trims trailing empty tiles of each row
+    solids = '\n'.join(''.join('1' if t else '0' for t in row).rstrip('0') for row in tiles)
+
+    names = [name for name in LevelRenderer.ID_MAP if name != 'Player']
+    entities = []
+    for i in range(n_entities):
+        name = 'Player' if i == 0 else names[rng.integers(len(names))]
+        w, h = (8, 11) if name == 'Player' else rng.integers(1, 4, size=2) * tile
+        left = x + rng.uniform(0, width * tile - w)
+        top = y + rng.uniform(0, height * tile - h)
+        entities.append({'Name': f'Celeste.{name}',
+                         'Left': str(left), 'Right': str(left + w),
+                         'Top': str(top), 'Bottom': str(top + h)})
+
+    return {'entities': entities,
+            'bounds': f'{{X:{x} Y:{y} Width:{width * tile} Height:{height * tile}}}',
+            'solids': solids,
+            'climbing': bool(rng.integers(2)),
+            'canDash': bool(rng.integers(2)),
+            'speed': f'{rng.normal(0, 90):.2f}, {rng.normal(0, 90):.2f}'}
+
+
+def payload_frame(payload, vision_size=42):
+    """
+    (H, W, 3) uint8 frame of a payload's crop around the player: solids in red,
+    the player in green and every other entity in blue.
+    """
+    crop = LevelRenderer.from_payload(payload, 1, vision_size).render_around_player()
+    player = LevelRenderer.ID_MAP['Player']
+    others = np.delete(crop[..., 1:], player - 1, axis=-1).max(axis=-1)
+    return (np.stack([crop[..., 0], crop[..., player], others], axis=-1) * 255).astype(np.uint8)
+
+
+class StandInServer:
+    """
+    Pure python stand-in for the mod's ResponseSocket, answers CelesteImgGym requests
+    with synthetic or recorded frames so the env can be tested and benchmarked without the game.
+
+    :param port: port to bind on, same as the mod (tcp://*:port)
+    :param frame_shape: shape of the (H, W, C) uint8 frames sent back
+    :param episode_length: number of steps before sending terminated
+    :param max_protocol: highest protocol this server understands, use JSON_PROTOCOL
+        to mimic older mods that always answer in json
+    :param n_frames: number of distinct frames to cycle through
+    :param rate: maximum number of game frames per second, None for as fast as possible
+    :param latency: seconds to wait per frame before replying, stands in for the game's frame time
+    :param replay: optional recording to play back instead of synthetic frames, see from_dataset
+    :param endpoint: endpoint to bind instead of tcp://*:port, e.g. ipc:///tmp/celeste-7777
+    :param shm_slots: number of frames of the shared memory ring, when SHM_PROTOCOL is negotiated
+    :param multi_frame: advertise multi-frame action requests on reset, False stands in for the mod
+    """
+
+    def __init__(self, port, frame_shape=(42, 42, 3), episode_length=200, max_protocol=SHM_PROTOCOL,
+                 n_frames=16, seed=0, context=None, rate=None, latency=0.0, replay=None, endpoint=None,
+                 shm_slots=4, multi_frame=True):
+        self.port = port
+        self.endpoint = endpoint or f"tcp://*:{port}"
+        self.shm_slots = shm_slots
+        self.multi_frame = multi_frame
+        self.ring = None
+        self.slot = 0
+        self.frame_shape = frame_shape
+        self.episode_length = episode_length
+        self.max_protocol = max_protocol
+        self.context = context or zmq.Context.instance()
+        self.period = 1 / rate if rate else 0.0
+        self.latency = latency
+
+        self.replay = replay
+        if replay is None:
+            rng = np.random.default_rng(seed)
+            self.frames = [rng.integers(0, 256, size=frame_shape, dtype=np.uint8) for _ in range(n_frames)]
+        else:
+            self.frames = replay['frames']
+            self.frame_shape = self.frames.shape[1:]
+        self.pngs = {}
+
+        self.protocol = JSON_PROTOCOL
+        self.step = 0
+        self.total_steps = 0
+        self.episode = -1
+        self.cursor = 0
+        self.deadline = 0.0
+        self.running = False
+        self.thread = None
+
+    @classmethod
+    def from_dataset(cls, port, path, vision_size=42, **kwargs):
+        """
+        Stand-in replaying the episodes of a TrajectoryRecorder dataset in a loop: each reset
+        starts the next recorded episode, each step sends its next frame and reward,
+        the last frame of the episode is sent as terminated whatever the client does, and
+        sent again (terminated, zero reward) on every step until the next reset.
+
+        Datasets of raw payloads (a 'payload' bytes field) are rendered to frames with payload_frame.
+        """
+        dataset = TrajectoryDataset(path)
+        if 'obs.image' in dataset.columns:
+            frames = dataset.columns['obs.image']
+        else:
+            frames = np.stack([payload_frame(dataset.payload(i), vision_size) for i in range(len(dataset))])
+        rewards = dataset.columns['reward'] if 'reward' in dataset.columns else np.zeros(len(dataset))
+
+        episodes = [dataset.episode_bounds(i) for i in range(dataset.n_episodes)]
+        return cls(port, replay={'frames': frames, 'rewards': rewards, 'episodes': episodes}, **kwargs)
+
+    def start(self):
+        self.running = True
+        self.socket = self.context.socket(zmq.REP)
+        self.socket.setsockopt(zmq.LINGER, 0)
+        self.socket.bind(self.endpoint)
+        self.thread = threading.Thread(target=self._serve, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _serve(self):
+        poller = zmq.Poller()
+        poller.register(self.socket, zmq.POLLIN)
+        try:
+            while self.running:
+                if not poller.poll(50):
+                    continue
+                msg = json.loads(self.socket.recv())
+                self._handle(msg)
+        finally:
+            self.socket.close()
+            if self.ring is not None:
+                self.ring.close(unlink=True)
+                self.ring = None
+
+    def _handle(self, msg):
+        protocol = requested_protocol(msg)
+        reset = protocol is not None
+        if reset:
+            self.protocol = min(protocol, self.max_protocol)
+            self.step = 0
+            actions = [None]
+        else:
+            actions = frame_actions(msg)
+
+        # multi-frame requests play every frame, stop early on termination, then answer once
+        reward = 0.0
+        for played, action in enumerate(actions, 1):
+            step = self.step
+            idx, frame_reward, terminated = self._frame(action, reset)
+            reward += frame_reward
+            self.step = 0 if terminated else self.step + 1
+            if terminated:
+                break
+        early = terminated and played < len(actions)
+
+        self._wait(played)
+        self._send(idx, reward, terminated, step, early, len(actions) > 1, reset)
+        self.total_steps += played
+
+    def _frame(self, action, reset):
+        if self.replay is not None:
+            return self._replay(reset)
+        reward = 0.0 if reset else self.reward(action)
+        return self.step % len(self.frames), reward, self.step >= self.episode_length
+
+    def _replay(self, reset):
+        episodes = self.replay['episodes']
+        if reset or self.episode < 0:
+            self.episode = (self.episode + 1) % len(episodes)
+            self.cursor = episodes[self.episode][0]
+            return self.cursor, 0.0, self.cursor >= episodes[self.episode][1] - 1
+
+        last = episodes[self.episode][1] - 1
+        if self.cursor >= last:
+            # stepped past the end of the recording, its last frame stays terminated until the next reset
+            return last, 0.0, True
+        self.cursor += 1
+        return self.cursor, float(self.replay['rewards'][self.cursor]), self.cursor >= last
+
+    def _wait(self, frames=1):
+        now = time.perf_counter()
+        wake = max(now + self.latency * frames, self.deadline)
+        if wake > now:
+            time.sleep(wake - now)
+        if self.period:
+            self.deadline = max(wake, self.deadline) + self.period * frames
+
+    def reward(self, action):
+        # same shape as the mod's (dx - dy) / 10, moving right is rewarded
+        return (action[1] - action[0]) / 10 if len(action) == 7 else 0.0
+
+    def _png(self, idx):
+        if idx not in self.pngs:
+            self.pngs[idx] = encode_png(np.asarray(self.frames[idx]))
+        return self.pngs[idx]
+
+    def _send(self, idx, reward, terminated, step, early=False, multi_frame=False, reset=False):
+        flags = EARLY_TERMINATION if early else 0
+        if reset and self.multi_frame:
+            # multi-frame requests are played, see _handle
+            flags |= MULTI_FRAME
+        if self.protocol == SHM_PROTOCOL:
+            if self.ring is None:
+                path = f'{default_ring_dir()}/celeste-{self.port}-{os.getpid()}.ring'
+                self.ring = SharedFrameRing(path, self.shm_slots, self.frame_shape, create=True)
+            # the one copy of the frame, where the game would write its framebuffer
+            self.ring.write(self.slot, self.frames[idx])
+            frames = [encode_header(reward, terminated, step, *self.frame_shape, flags=flags, version=SHM_PROTOCOL),
+                      encode_slot(self.slot)]
+            if reset:
+                frames.append(json.dumps(self.ring.describe()).encode())
+            self.socket.send_multipart(frames)
+            self.slot = (self.slot + 1) % self.shm_slots
+        elif self.protocol == BINARY_PROTOCOL:
+            frame = np.ascontiguousarray(self.frames[idx])
+            header = encode_header(reward, terminated, step, *frame.shape, flags=flags)
+            self.socket.send(header, zmq.SNDMORE)
+            self.socket.send(frame, copy=False)
+        else:
+            reply = [self._png(idx), reward, terminated]
+            if multi_frame or reset:
+                reply.append(flags)
+            self.socket.send_string(json.dumps(reply))
+
+
+class StandInPool:
+    """
+    Many StandInServer on consecutive ports, each served by its own thread of this process,
+    like the game instances startCeleste.bash launches.
+
+    :param base_port: port of the first instance
+    :param n_instances: number of instances
+    :param dataset: optional TrajectoryRecorder dataset every instance replays
+    :param kwargs: StandInServer arguments, each instance gets seed + its index
+    """
+
+    def __init__(self, base_port, n_instances, seed=0, dataset=None, **kwargs):
+        self.ports = list(range(base_port, base_port + n_instances))
+        if dataset is None:
+            self.servers = [StandInServer(port, seed=seed + i, **kwargs) for i, port in enumerate(self.ports)]
+        else:
+            self.servers = [StandInServer.from_dataset(port, dataset, **kwargs) for port in self.ports]
+
+    def start(self):
+        for server in self.servers:
+            server.start()
+        return self
+
+    def stop(self):
+        for server in self.servers:
+            server.running = False
+        for server in self.servers:
+            server.stop()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    @property
+    def total_steps(self):
+        return sum(server.total_steps for server in self.servers)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve stand-in Celeste instances until interrupted')
+    parser.add_argument('--port', type=int, default=7777)
+    parser.add_argument('--instances', type=int, default=1)
+    parser.add_argument('--rate', type=float, default=None, help='max game frames/s per instance')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds per frame before each reply')
+    parser.add_argument('--episode-length', type=int, default=200)
+    parser.add_argument('--dataset', default=None, help='TrajectoryRecorder dataset to replay')
+    args = parser.parse_args()
+
+    pool = StandInPool(args.port, args.instances, dataset=args.dataset, rate=args.rate,
+                       latency=args.latency, episode_length=args.episode_length)
+    with pool:
+        print(f'serving on ports {pool.ports[0]}-{pool.ports[-1]}')
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
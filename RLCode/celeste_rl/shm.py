@@ -0,0 +1,48 @@
+import os
+import tempfile
+
+import numpy as np
+
+
+def default_ring_dir():
+    # tmpfs on linux, pages never hit the disk
+    return '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+
+
+class SharedFrameRing:
+    """
+    Ring of `slots` (H, W, C) uint8 frames in a memory-mapped file shared by the game and the env.
+
+    The producer writes a frame into a slot then sends its index over zmq, the consumer's observation
+    is a read-only view of that slot: no copy through sockets nor into the env. With REQ/REP lockstep
+    the producer only writes the next slot after the next request, so a view stays valid for the
+    `slots - 1` following steps.
+
+    :param path: file backing the ring
+    :param create: producer side, creates (or truncates) the file
+    """
+
+    def __init__(self, path, slots, frame_shape, create=False):
+        self.path = path
+        self.slots = slots
+        self.frame_shape = tuple(frame_shape)
+        mode = 'w+' if create else 'r'
+        # plain ndarray view, slicing a memmap subclass is slower and the mapping lives on as its base
+        self.frames = np.memmap(path, dtype=np.uint8, mode=mode, shape=(slots, *self.frame_shape)).view(np.ndarray)
+
+    def describe(self):
+        """What the consumer needs to attach, sent on reset replies"""
+        return {'path': self.path, 'slots': self.slots, 'shape': list(self.frame_shape)}
+
+    @classmethod
+    def attach(cls, description):
+        return cls(description['path'], description['slots'], description['shape'])
+
+    def write(self, slot, frame):
+        self.frames[slot] = frame
+
+    def close(self, unlink=False):
+        # the mapping itself goes away with the last view of it, observations handed out stay readable
+        self.frames = None
+        if unlink and os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,107 @@
+import bisect
+import json
+
+import numpy as np
+
+# spans of a CelesteImgGym step, in order: sending the action, waiting for the reply,
+# parsing its header (json or binary), decoding the frame (png in json mode, a view otherwise)
+SPANS = ('send', 'recv_wait', 'parse', 'decode')
+
+
+def bin_edges(low, high, n_bins, log=False):
+    """n_bins + 1 edges between low and high, log-spaced (low must be > 0) or linear"""
+    return np.geomspace(low, high, n_bins + 1) if log else np.linspace(low, high, n_bins + 1)
+
+
+def bin_quantile(counts, edges, q, log=False, lowest=None, highest=None):
+    """
+    Approximate quantile of a histogram with len(edges) + 1 bins, the middle of the bin it falls in
+    (geometric middle for log bins).
+
+    :param counts: counts of the underflow bin, the bins between the edges, then the overflow bin
+    :param lowest: value of the underflow bin, edges[0] by default
+    :param highest: value of the overflow bin, edges[-1] by default
+    """
+    cumulative = np.cumsum(counts)
+    if cumulative[-1] == 0:
+        return float('nan')
+    idx = int(np.searchsorted(cumulative, q * cumulative[-1]))
+    if idx == 0:
+        return float(edges[0] if lowest is None else lowest)
+    if idx > len(edges) - 1:
+        return float(edges[-1] if highest is None else highest)
+    low, high = edges[idx - 1], edges[idx]
+    return float(np.sqrt(low * high) if log else (low + high) / 2)
+
+
+class StepTimer:
+    """
+    Histograms of the time spent in each span of an env step, one for the running episode
+    and one over every finished episode.
+
+    Bins are log-spaced between min_us and max_us, plus one underflow and one overflow bin,
+    so memory stays constant however long training runs.
+
+    :param spans: names of the consecutive spans of a step
+    :param n_bins: number of log-spaced bins
+    """
+
+    def __init__(self, spans=SPANS, n_bins=48, min_us=1, max_us=1e6):
+        self.spans = spans
+        self.edges = bin_edges(min_us * 1e3, max_us * 1e3, n_bins, log=True)
+        self._edges = self.edges.tolist()
+        self.episode = np.zeros((len(spans), n_bins + 2), dtype=np.int64)
+        self.total = np.zeros_like(self.episode)
+        self.episode_ns = np.zeros(len(spans), dtype=np.int64)
+        self.episode_steps = 0
+        self.episodes = 0
+        self.last = {}
+
+    def record_step(self, *stamps):
+        """
+        :param stamps: len(spans) + 1 monotonic time.perf_counter_ns() stamps,
+            span i lasted from stamps[i] to stamps[i+1]
+        """
+        for i in range(len(self.spans)):
+            elapsed = stamps[i + 1] - stamps[i]
+            self.episode[i, bisect.bisect(self._edges, elapsed)] += 1
+            self.episode_ns[i] += elapsed
+        self.episode_steps += 1
+
+    def end_episode(self):
+        """Adds the running episode to the totals, returns its summary"""
+        self.last = self.summary()
+        self.total += self.episode
+        self.episode[:] = 0
+        self.episode_ns[:] = 0
+        self.episode_steps = 0
+        self.episodes += 1
+        return self.last
+
+    def quantile(self, counts, q):
+        """Approximate quantile in ns of one span's histogram, the geometric middle of its bin"""
+        return bin_quantile(counts, self.edges, q, log=True)
+
+    def summary(self):
+        """Running episode as flat {span_stat: value} metrics, durations in microseconds"""
+        metrics = {'steps': self.episode_steps}
+        for i, span in enumerate(self.spans):
+            steps = max(self.episode_steps, 1)
+            metrics[f'{span}_mean_us'] = self.episode_ns[i] / steps / 1e3
+            for q in (0.5, 0.99):
+                metrics[f'{span}_p{int(q * 100)}_us'] = self.quantile(self.episode[i], q) / 1e3
+        return metrics
+
+    def dump(self, path=None):
+        """
+        Every histogram as a json-able dict, written to path if given.
+        """
+        histograms = {'spans': list(self.spans),
+                      'edges_us': (self.edges / 1e3).tolist(),
+                      'episodes': self.episodes,
+                      'episode': self.episode.tolist(),
+                      'total': (self.total + self.episode).tolist()}
+        if path is not None:
+            with open(path, 'w') as f:
+                json.dump(histograms, f)
+        return histograms
@@ -0,0 +1,265 @@
+import time
+
+import numpy as np
+import zmq
+from gymnasium.vector import AutoresetMode, VectorEnv
+from gymnasium.vector.utils import batch_space
+
+from .env import CelesteImgGym
+from .protocol import BINARY_PROTOCOL
+
+
+class CelesteVecEnv(VectorEnv):
+    """
+    Drives many game instances from one process: actions are sent to every instance
+    at once and replies are gathered with a single zmq.Poller, so step latency is
+    the one of the slowest instance instead of the sum of all of them.
+
+    Observations, rewards and done flags are written into preallocated (N, ...) buffers,
+    which are returned as is (copy them if they need to outlive the next step). Images are the
+    game's uint8 pixels, declared as a uint8 Box(0, 255) (CelesteImgGym's compact space).
+
+    Besides the synchronous gymnasium API, an envpool-style async API is available:
+    `send` actions for some instances, then `recv` returns whichever instances are ready.
+
+    Episodes are reset on the step following a termination or truncation
+    (gymnasium's NEXT_STEP autoreset mode): the action for that instance is ignored and
+    the reset observation is returned with a zero reward.
+
+    :param ports: port of each game instance
+    :param protocol: observation protocol requested on reset
+    :param max_episode_steps: truncate episodes after this many steps, same as the TimeLimit used in rllib.py
+    :param batch_size: default minimum number of instances returned by `recv`
+    :param action_repeat: frames each action is held for, one round trip per step either way. Needs games that
+        play multi-frame requests, reset raises ValueError otherwise (see CelesteImgGym)
+    :param timeout: milliseconds an instance has to answer before it is marked unhealthy, None to wait forever
+    :param timing: time the spans of every step in each instance's CelesteImgGym.timer. recv_wait runs from
+        the end of the send to the pick up of the reply, so it includes the handling of the replies before it
+
+    An unhealthy instance is skipped instead of stalling the others: its episode is truncated with a zero
+    reward on the step it times out (once per failure, the following steps are neither terminated nor
+    truncated), info['unhealthy'] flags it until it answers again, its last observation is returned
+    meanwhile, and a reset is sent to it whenever its reconnect backoff is over (see Connection).
+    """
+
+    metadata = {"autoreset_mode": AutoresetMode.NEXT_STEP}
+
+    def __init__(self, ports, protocol=BINARY_PROTOCOL, max_episode_steps=2000, batch_size=None,
+                 action_repeat=1, timeout=10_000, timing=False):
+        # the image buffers are uint8, so is the declared space
+        self.envs = [CelesteImgGym(port, protocol=protocol, compact=True, action_repeat=action_repeat,
+                                   timeout=timeout, timing=timing)
+                     for port in ports]
+        self.timing = timing
+        self.timeout = timeout
+        self.num_envs = len(self.envs)
+        self.max_episode_steps = max_episode_steps
+        self.batch_size = batch_size or self.num_envs
+
+        self.single_observation_space = self.envs[0].observation_space
+        self.single_action_space = self.envs[0].action_space
+        self.observation_space = batch_space(self.single_observation_space, self.num_envs)
+        self.action_space = batch_space(self.single_action_space, self.num_envs)
+
+        image_space = self.single_observation_space['image']
+        self._images = np.zeros((self.num_envs, *image_space.shape), dtype=image_space.dtype)
+        self._rewards = np.zeros(self.num_envs, dtype=np.float32)
+        self._terminated = np.zeros(self.num_envs, dtype=bool)
+        self._truncated = np.zeros(self.num_envs, dtype=bool)
+
+        self._elapsed = np.zeros(self.num_envs, dtype=np.int64)
+        self._pending = np.zeros(self.num_envs, dtype=bool)
+        self._resetting = np.zeros(self.num_envs, dtype=bool)
+        self._needs_reset = np.zeros(self.num_envs, dtype=bool)
+        self._sent_at = np.zeros(self.num_envs, dtype=np.float64)
+        # perf_counter_ns before and after the last action was sent, with timing
+        self._send_ns = np.zeros((self.num_envs, 2), dtype=np.int64)
+        self.healthy = np.ones(self.num_envs, dtype=bool)
+
+        self.poller = None
+        self._socket_ids = {}
+
+    def _register(self):
+        self.poller = zmq.Poller()
+        self._socket_ids = {}
+        for i, env in enumerate(self.envs):
+            self.poller.register(env.socket, zmq.POLLIN)
+            self._socket_ids[env.socket] = i
+
+    def _reconnect(self, i):
+        """Fresh socket for instance i, whatever the old one had queued is dropped"""
+        connection = self.envs[i].connection
+        del self._socket_ids[connection.socket]
+        self.poller.unregister(connection.socket)
+        connection.reset()
+        self.poller.register(connection.socket, zmq.POLLIN)
+        self._socket_ids[connection.socket] = i
+
+    def _send_reset(self, i):
+        self.envs[i]._send_reset()
+        self._resetting[i] = True
+        self._pending[i] = True
+        self._sent_at[i] = time.monotonic()
+
+    def _fail(self, i):
+        """Instance i did not answer in time: skip it and end its episode"""
+        self.envs[i].connection.failed()
+        self.healthy[i] = False
+        self._pending[i] = False
+        self._resetting[i] = False
+        self._rewards[i] = 0
+        self._terminated[i] = False
+        self._truncated[i] = True
+        self._needs_reset[i] = True
+
+    def _receive(self, i):
+        env = self.envs[i]
+        # the poller already saw the reply, no need for the connection's own poll
+        t_parse = time.perf_counter_ns()
+        obs, reward, terminated = env._parse(env.socket.recv_multipart(copy=False))
+        env.connection.succeeded()
+        t_decode = time.perf_counter_ns()
+        self._images[i] = env._get_obs(obs)['image']
+        self._pending[i] = False
+        self.healthy[i] = True
+
+        if self._resetting[i]:
+            env._check_reset()
+            if self.timing and env.timer.episode_steps:
+                env.timer.end_episode()
+            self._resetting[i] = False
+            self._needs_reset[i] = False
+            self._elapsed[i] = 0
+            self._rewards[i] = 0
+            self._terminated[i] = False
+            self._truncated[i] = False
+            return
+
+        if self.timing:
+            env.timer.record_step(*self._send_ns[i], t_parse, t_decode, time.perf_counter_ns())
+        self._elapsed[i] += 1
+        self._rewards[i] = reward
+        self._terminated[i] = terminated
+        self._truncated[i] = not terminated and self._elapsed[i] >= self.max_episode_steps
+        self._needs_reset[i] = self._terminated[i] or self._truncated[i]
+
+    def _expire_at(self):
+        """Time at which the first pending instance times out"""
+        if self.timeout is None or not self._pending.any():
+            return np.inf
+        return self._sent_at[self._pending].min() + self.timeout / 1000
+
+    def _gather(self, count, timeout=None):
+        """
+        Receive replies until `count` pending instances answered or timed out,
+        returns their ids in arrival order
+        """
+        ready = []
+        deadline = np.inf if timeout is None else time.monotonic() + timeout / 1000
+        # only recomputed after a silent poll, replies can only push it back
+        expire_at = self._expire_at()
+        count = min(count, int(self._pending.sum()))
+        while len(ready) < count:
+            wake = min(deadline, expire_at)
+            wait = None if wake == np.inf else max(wake - time.monotonic(), 0) * 1000
+            events = self.poller.poll(wait)
+            for socket, _ in events:
+                i = self._socket_ids[socket]
+                if not self._pending[i]:
+                    # late reply of an instance that already timed out
+                    socket.recv_multipart()
+                    continue
+                self._receive(i)
+                ready.append(i)
+            if events:
+                continue
+
+            now = time.monotonic()
+            if self.timeout is not None:
+                for i in np.flatnonzero(self._pending & (now - self._sent_at >= self.timeout / 1000)):
+                    self._fail(i)
+                    ready.append(i)
+                expire_at = self._expire_at()
+            if now >= deadline and len(ready) < count:
+                raise TimeoutError(f'No game instance answered within {timeout} ms')
+        return np.array(ready, dtype=np.int64)
+
+    def _info(self, env_ids=None):
+        if self.healthy.all():
+            return {}
+        return {'unhealthy': ~self.healthy if env_ids is None else ~self.healthy[env_ids]}
+
+    def _obs(self, env_ids=None):
+        if env_ids is None:
+            return {'image': self._images}
+        return {'image': self._images[env_ids]}
+
+    def reset(self, seed=None, options=None):
+        for env in self.envs:
+            env._connect()
+        self._register()
+        self._pending[:] = False
+
+        for i in range(self.num_envs):
+            self._send_reset(i)
+        self._gather(self.num_envs)
+        return self._obs(), self._info()
+
+    def send(self, actions, env_ids=None):
+        """Send one action per instance in `env_ids` (all instances if None) without waiting"""
+        env_ids = range(self.num_envs) if env_ids is None else env_ids
+        for action, i in zip(actions, env_ids):
+            if self._pending[i]:
+                raise RuntimeError(f'Instance {i} has not answered its previous request yet')
+            if not self.healthy[i]:
+                # its failure was reported on the step it timed out
+                self._truncated[i] = False
+                # skipped until its backoff is over, then reset on a fresh socket
+                if self.envs[i].connection.ready:
+                    self._reconnect(i)
+                    self._send_reset(i)
+            elif self._needs_reset[i]:
+                self._send_reset(i)
+            else:
+                t_send = time.perf_counter_ns()
+                self.envs[i]._send_control(int(action))
+                if self.timing:
+                    self._send_ns[i] = t_send, time.perf_counter_ns()
+                self._pending[i] = True
+                self._sent_at[i] = time.monotonic()
+
+    def _reset_at(self, i):
+        """
+        Resets instance i alone (RLlib's reset_at). An unhealthy instance is only tried again on a fresh
+        socket once its backoff is over, until then nothing is sent and its last observation is kept.
+
+        :return: whether the instance answered
+        """
+        if not self.healthy[i]:
+            if not self.envs[i].connection.ready:
+                return False
+            self._reconnect(i)
+        self._send_reset(i)
+        self._gather(1)
+        # a failure while resetting has nothing left to truncate
+        self._truncated[i] = False
+        return bool(self.healthy[i])
+
+    def recv(self, batch_size=None, timeout=None):
+        """
+        Wait until at least `batch_size` instances answered and return their
+        (obs, rewards, terminated, truncated, info), info['env_id'] holds the instance ids
+        """
+        env_ids = self._gather(batch_size or self.batch_size, timeout)
+        return (self._obs(env_ids), self._rewards[env_ids], self._terminated[env_ids],
+                self._truncated[env_ids], {'env_id': env_ids, **self._info(env_ids)})
+
+    def step(self, actions):
+        self.send(actions)
+        self._gather(self.num_envs)
+        return self._obs(), self._rewards, self._terminated, self._truncated, self._info()
+
+    def close_extras(self, **kwargs):
+        for env in self.envs:
+            if env.initialized:
+                env.close()
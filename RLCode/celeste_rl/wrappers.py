@@ -0,0 +1,142 @@
+import gymnasium as gym
+import numpy as np
+from gymnasium import spaces
+from gymnasium.vector import VectorWrapper
+from gymnasium.vector.utils import batch_space
+
+
+class FrameRing:
+    """
+    Last K frames of N streams, kept in a preallocated (N, 2K, ...) circular buffer.
+
+    Every frame is written twice, at slot s and s+K, so the K latest frames of a stream are
+    always the contiguous slots [s+1, s+K+1): stacking them is a view, not a copy of K frames.
+    When all streams are at the same position (synchronous stepping), the (N, K, ...) stack is
+    a single view of the buffer, otherwise it is gathered.
+    """
+
+    def __init__(self, num_stack, frame_shape, dtype, num_envs=1):
+        self.num_stack = num_stack
+        self.buffer = np.zeros((num_envs, 2 * num_stack, *frame_shape), dtype=dtype)
+        self.pos = np.zeros(num_envs, dtype=np.int64)
+
+    def reset(self, frames, env_ids=None):
+        """Fill the whole history of the given streams with their first frame"""
+        env_ids = slice(None) if env_ids is None else env_ids
+        self.buffer[env_ids] = np.expand_dims(frames, 1)
+
+    def push(self, frames, env_ids=None):
+        env_ids = np.arange(len(self.pos)) if env_ids is None else np.asarray(env_ids)
+        slots = self.pos[env_ids]
+        self.buffer[env_ids, slots] = frames
+        self.buffer[env_ids, slots + self.num_stack] = frames
+        self.pos[env_ids] = (slots + 1) % self.num_stack
+
+    def stacked(self, env_ids=None):
+        """(N, K, ...) frames, oldest first"""
+        if env_ids is None and (self.pos == self.pos[0]).all():
+            # the latest write was at pos-1, its window starts right after it
+            start = self.pos[0]
+            return self.buffer[:, start:start + self.num_stack]
+
+        env_ids = np.arange(len(self.pos)) if env_ids is None else np.asarray(env_ids)
+        slots = self.pos[env_ids, None] + np.arange(self.num_stack)
+        return self.buffer[env_ids[:, None], slots]
+
+
+def _stacked_space(space, num_stack):
+    return spaces.Box(low=np.repeat(space.low[None], num_stack, axis=0),
+                      high=np.repeat(space.high[None], num_stack, axis=0),
+                      dtype=space.dtype)
+
+
+class FrameStack(gym.Wrapper):
+    """
+    Stacks the last `num_stack` frames of the `key` observation (CelesteImgGym pixels or
+    LevelRenderer images) along a new leading axis, other keys are left as is.
+
+    The stacked frames are a view of the ring buffer, valid until the next step:
+    copy them if they need to be kept around.
+    """
+
+    def __init__(self, env, num_stack=4, key='image'):
+        super().__init__(env)
+        self.num_stack = num_stack
+        self.key = key
+
+        frame_space = env.observation_space[key]
+        self.observation_space = spaces.Dict({**env.observation_space.spaces,
+                                              key: _stacked_space(frame_space, num_stack)})
+        self.ring = FrameRing(num_stack, frame_space.shape, frame_space.dtype)
+
+    def _observation(self, obs):
+        return {**obs, self.key: self.ring.stacked()[0]}
+
+    def reset(self, seed=None, options=None):
+        obs, info = self.env.reset(seed=seed, options=options)
+        self.ring.reset(obs[self.key][None])
+        return self._observation(obs), info
+
+    def step(self, action):
+        obs, reward, terminated, truncated, info = self.env.step(action)
+        self.ring.push(obs[self.key][None])
+        return self._observation(obs), reward, terminated, truncated, info
+
+
+class VecFrameStack(VectorWrapper):
+    """
+    FrameStack for CelesteVecEnv, frames are stacked along axis 1 of the batched observation.
+
+    Follows the env's NEXT_STEP autoreset: the observation following a termination or truncation
+    is the first frame of a new episode, that instance's history is then refilled with it.
+    Unhealthy instances (info['unhealthy']) keep their history while they return their last frame again,
+    the reply after they recover is the reset of a new episode and refills it, like VecMetrics.
+    The async send / recv API of CelesteVecEnv is forwarded.
+    """
+
+    def __init__(self, env, num_stack=4, key='image'):
+        super().__init__(env)
+        self.num_stack = num_stack
+        self.key = key
+
+        frame_space = env.single_observation_space[key]
+        self.single_observation_space = spaces.Dict({**env.single_observation_space.spaces,
+                                                     key: _stacked_space(frame_space, num_stack)})
+        self.observation_space = batch_space(self.single_observation_space, self.num_envs)
+        self.ring = FrameRing(num_stack, frame_space.shape, frame_space.dtype, num_envs=self.num_envs)
+        self._done = np.zeros(self.num_envs, dtype=bool)
+
+    def _update(self, obs, terminated, truncated, info, env_ids=None):
+        env_ids = np.arange(self.num_envs) if env_ids is None else np.asarray(env_ids)
+        frames = obs[self.key]
+        # silent instances sent no new frame
+        live = ~np.asarray(info['unhealthy']) if 'unhealthy' in info else np.ones(len(env_ids), dtype=bool)
+        if live.all():
+            self.ring.push(frames, env_ids)
+        else:
+            self.ring.push(frames[live], env_ids[live])
+
+        restarted = self._done[env_ids] & live
+        if restarted.any():
+            self.ring.reset(frames[restarted], env_ids[restarted])
+        self._done[env_ids] = np.logical_or(terminated, truncated) | ~live
+
+    def reset(self, seed=None, options=None):
+        obs, info = self.env.reset(seed=seed, options=options)
+        self.ring.reset(obs[self.key])
+        self._done[:] = False
+        return {**obs, self.key: self.ring.stacked()}, info
+
+    def step(self, actions):
+        obs, reward, terminated, truncated, info = self.env.step(actions)
+        self._update(obs, terminated, truncated, info)
+        return {**obs, self.key: self.ring.stacked()}, reward, terminated, truncated, info
+
+    def send(self, actions, env_ids=None):
+        self.env.send(actions, env_ids)
+
+    def recv(self, batch_size=None, timeout=None):
+        obs, reward, terminated, truncated, info = self.env.recv(batch_size, timeout)
+        env_ids = info['env_id']
+        self._update(obs, terminated, truncated, info, env_ids)
+        return {**obs, self.key: self.ring.stacked(env_ids)}, reward, terminated, truncated, info
@@ -1,5 +1,7 @@
 
 
+import os
+
 import matplotlib.pyplot as plt
 import numpy as np
 import cv2
@@ -20,6 +22,7 @@ import gymnasium as gym
 import ray
 
 from celeste_rl.env import CelesteImgGym
+from celeste_rl.registry import LeasedEnv, open_registry
 from celeste_rl.level import *
 from celeste_rl.env import *
 from rtgym import DEFAULT_CONFIG_DICT
@@ -34,14 +37,21 @@ from ray.tune.registry import register_env
 
 
 class EnvCreator:
-    
-    def __init__(self, port=7777):
-        self.port = port
-    
+    """
+    Leases a game instance per (worker_index, vector_index) from the registry, instances are
+    registered by startCeleste.bash (python -m celeste_rl.registry register --ports ...)
+
+    :param registry: registry json file, on a shared filesystem or served with
+        python -m celeste_rl.registry serve, in which case pass its tcp:// endpoint
+    """
+
+    def __init__(self, registry=os.environ.get('CELESTE_REGISTRY', 'instances.json')):
+        # resolved on the driver, ray workers do not share its working directory
+        self.registry = registry if registry.startswith('tcp://') else os.path.abspath(registry)
+
     def get_env(self, config):
-        env = TimeLimit(CelesteImgGym(self.port), max_episode_steps=2000)
-        self.port += 1
-        return env
+        make_env = lambda host, port: TimeLimit(CelesteImgGym(port, host=host), max_episode_steps=2000)
+        return LeasedEnv(make_env, open_registry(self.registry), config.worker_index, config.vector_index)
     
     
 
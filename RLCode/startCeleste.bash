@@ -5,3 +5,5 @@ do
     ../../../Celeste &
 done
 
+# the mod binds the first free port from 7777 on, make them available to rllib.py's EnvCreator
+python -m celeste_rl.registry --registry ${CELESTE_REGISTRY:-instances.json} register --ports $(seq 7777 7784)
@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+import torch as th
+from stable_baselines3.common.preprocessing import preprocess_obs
+
+from celeste_rl.level import LevelRenderer
+from celeste_rl.models import CustomCombinedExtractor, ObservationCollator
+from celeste_rl.server import synthetic_payload
+
+VISION_SIZE = 42
+
+
+@pytest.fixture(scope='module')
+def payloads():
+    rng = np.random.default_rng(0)
+    return [synthetic_payload(rng) for _ in range(8)]
+
+
+def extractor(obs_space):
+    th.manual_seed(0)
+    return CustomCombinedExtractor(obs_space)
+
+
+@pytest.fixture(scope='module')
+def expected(payloads):
+    obs_space = LevelRenderer.observation_space(VISION_SIZE)
+    with th.no_grad():
+        return extractor(obs_space)(LevelRenderer.create_obs_batch(payloads, 1, VISION_SIZE))[0]
+
+
+@pytest.mark.parametrize('compact, packbits', [(True, False), (True, True)])
+@pytest.mark.parametrize('sb3', [False, True])
+def test_compact_observations_match_float(payloads, expected, compact, packbits, sb3):
+    obs_space = LevelRenderer.observation_space(VISION_SIZE, compact=compact, packbits=packbits)
+    obs = LevelRenderer.create_obs_batch(payloads, 1, VISION_SIZE, compact=compact, packbits=packbits)
+    if sb3:
+        # what an SB3 policy hands to its features extractor: uint8 images as floats / 255
+        obs = preprocess_obs({key: th.as_tensor(value) for key, value in obs.items()}, obs_space)
+        assert obs['image'].dtype == th.float32
+
+    with th.no_grad():
+        features, _ = extractor(obs_space)(obs)
+    assert th.allclose(features, expected, atol=1e-5)
+
+
+def test_float_tensors_are_not_cast_to_the_buffer_dtype():
+    obs_space = LevelRenderer.observation_space(VISION_SIZE, compact=True)
+    collator = ObservationCollator(obs_space, ['climbing', 'canDash', 'speeds'])
+    image = th.rand((4, *obs_space['image'].shape))
+    with th.no_grad():
+        batch = collator.collate({'image': image, 'climbing': th.ones((4, 1)),
+                                  'canDash': th.zeros((4, 1)), 'speeds': th.full((4, 2), 0.5)})
+    assert batch['image'].dtype == th.float32
+    assert th.equal(batch['image'], image)
+    assert th.equal(batch['vectors'], th.tensor([[1., 0., 0.5, 0.5]] * 4))
+
+
+def test_numpy_vectors_are_packed_side_by_side():
+    obs_space = LevelRenderer.observation_space(VISION_SIZE)
+    collator = ObservationCollator(obs_space, ['climbing', 'canDash', 'speeds'], action_size=2)
+    obs = {key: np.zeros((3, *space.shape), dtype=space.dtype) for key, space in obs_space.spaces.items()}
+    obs['speeds'][:] = [1, 2]
+    with th.no_grad():
+        batch = collator.collate(obs, act=np.full((3, 2), 3, dtype=np.float32))
+    assert th.equal(batch['vectors'], th.tensor([[0., 0., 1., 2., 3., 3.]] * 3))
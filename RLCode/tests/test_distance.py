@@ -0,0 +1,74 @@
+import json
+from collections import deque
+
+import numpy as np
+import pytest
+
+from celeste_rl.distance import DistanceIndex, distance_field, exit_mask
+from celeste_rl.level import LevelRenderer
+from celeste_rl.server import synthetic_payload
+
+
+def queue_distance_field(solids, exits):
+    """Plain queue based BFS"""
+    distances = np.full(solids.shape, np.inf, dtype=np.float32)
+    queue = deque()
+    for r, c in zip(*np.nonzero(exits & (solids == 0))):
+        distances[r, c] = 0
+        queue.append((r, c))
+    while queue:
+        r, c = queue.popleft()
+        for nr, nc in ((r - 1, c), (r + 1, c), (r, c - 1), (r, c + 1)):
+            if (0 <= nr < solids.shape[0] and 0 <= nc < solids.shape[1] and solids[nr, nc] == 0
+                    and distances[nr, nc] == np.inf):
+                distances[nr, nc] = distances[r, c] + 1
+                queue.append((nr, nc))
+    return distances
+
+
+@pytest.fixture(scope='module')
+def rooms():
+    rng = np.random.default_rng(0)
+    return [synthetic_payload(rng, origin=(i * 320, 0)) for i in range(6)]
+
+
+@pytest.mark.parametrize('sides', [('top', 'right'), ('bottom',), ('top', 'right', 'bottom', 'left')])
+def test_frontier_bfs_matches_queue_bfs(rooms, sides):
+    for payload in rooms:
+        solids = LevelRenderer.parse_solids(payload, LevelRenderer.parse_bounds(payload), 1)
+        exits = exit_mask(solids.shape, sides)
+        assert np.array_equal(distance_field(solids, exits), queue_distance_field(solids, exits))
+
+
+def test_unknown_side():
+    with pytest.raises(ValueError):
+        exit_mask((4, 4), ('up',))
+
+
+def test_disk_cache_round_trip(rooms, tmp_path):
+    built = DistanceIndex(tmp_path)
+    fields = [built.room(payload).field for payload in rooms]
+    assert built.misses == len(rooms)
+
+    loaded = DistanceIndex(tmp_path)
+    for payload, field in zip(rooms, fields):
+        assert np.array_equal(loaded.room(payload).field, field)
+        assert np.array_equal(field, DistanceIndex(None).room(payload).field)
+    assert len(list(tmp_path.iterdir())) == len(rooms)
+
+
+def test_batched_distances(rooms):
+    index = DistanceIndex(None, maxsize=2)
+    out = np.empty(len(rooms) + 2, dtype=np.float32)
+    distances = index.distances(rooms, out=out)
+    assert len(distances) == len(rooms)
+    assert np.array_equal(distances, [index.distance(payload) for payload in rooms], equal_nan=True)
+
+
+def test_room_changes(rooms):
+    index = DistanceIndex(None)
+    first, second = [index.room(payload) for payload in rooms[:2]]
+    # payloads are parsed anew every step: equal, not identical solids
+    for payload, room in [(rooms[0], first), (rooms[0], first), (rooms[1], second), (rooms[0], first)]:
+        assert index.room(json.loads(json.dumps(payload))) is room
+    assert index.misses == 2 and index.hits == 4
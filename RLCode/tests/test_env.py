@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+from celeste_rl.env import CelesteImgGym
+from celeste_rl.protocol import BINARY_PROTOCOL, JSON_PROTOCOL, SHM_PROTOCOL
+from celeste_rl.server import StandInServer
+from celeste_rl.vec_env import CelesteVecEnv
+
+
+@pytest.mark.parametrize('protocol', [JSON_PROTOCOL, BINARY_PROTOCOL, SHM_PROTOCOL])
+def test_protocols_hand_the_same_pixels(protocol):
+    with StandInServer(7880 + protocol, episode_length=10) as server:
+        env = CelesteImgGym(7880 + protocol, protocol=protocol)
+        obs, _ = env.reset()
+        assert env.protocol == protocol
+        assert np.array_equal(obs['image'], server.frames[0])
+        for step in range(1, 4):
+            obs, *_ = env.step(0)
+            assert np.array_equal(obs['image'], server.frames[step])
+        if protocol == SHM_PROTOCOL:
+            # the observation is a view of the ring, no copy
+            assert np.shares_memory(obs['image'], env.ring.frames)
+        env.close()
+
+
+def test_old_mods_answer_in_json():
+    with StandInServer(7884, max_protocol=JSON_PROTOCOL) as server:
+        env = CelesteImgGym(7884, protocol=BINARY_PROTOCOL)
+        obs, _ = env.reset()
+        assert env.protocol == JSON_PROTOCOL
+        assert np.array_equal(obs['image'], server.frames[0])
+        env.close()
+
+
+def test_action_repeat_sums_the_rewards_of_single_steps():
+    actions = [3, 5, 8, 1]
+    with StandInServer(7885, episode_length=10):
+        single = CelesteImgGym(7885)
+        single.reset()
+        rewards = [single.step(a)[1] for a in actions for _ in range(2)]
+        single.close()
+
+    with StandInServer(7886, episode_length=10):
+        env = CelesteImgGym(7886, action_repeat=2)
+        env.reset()
+        _, reward, terminated, _, info = env.step_sequence(actions)
+        assert reward == pytest.approx(sum(rewards)) and not terminated and not info
+        # the episode ends during this request
+        _, _, terminated, _, info = env.step_sequence(actions)
+        assert terminated and info['early_termination']
+        env.close()
+
+
+@pytest.mark.parametrize('protocol', [JSON_PROTOCOL, BINARY_PROTOCOL])
+def test_action_repeat_needs_a_multi_frame_game(protocol):
+    with StandInServer(7886 + protocol, multi_frame=False):
+        env = CelesteImgGym(7886 + protocol, protocol=protocol, action_repeat=2)
+        with pytest.raises(ValueError, match='one frame per request'):
+            env.reset()
+        env.close()
+
+        # single frame requests still work, sequences are refused before anything is sent
+        env = CelesteImgGym(7886 + protocol, protocol=protocol)
+        env.reset()
+        assert not env.multi_frame
+        with pytest.raises(ValueError, match='one frame per request'):
+            env.step_sequence([0, 1])
+        env.step(0)
+        env.close()
+
+        vec_env = CelesteVecEnv([7886 + protocol], protocol=protocol, action_repeat=2)
+        with pytest.raises(ValueError, match='one frame per request'):
+            vec_env.reset()
+        vec_env.close()
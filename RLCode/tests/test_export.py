@@ -0,0 +1,57 @@
+import warnings
+
+import numpy as np
+import pytest
+import torch as th
+
+from celeste_rl.export import ExportedPolicy, export_policy
+from celeste_rl.inference import PolicyNetwork
+from celeste_rl.level import LevelRenderer
+from celeste_rl.server import synthetic_payload
+
+VISION_SIZE = 42
+
+
+@pytest.fixture(scope='module')
+def policy():
+    th.manual_seed(0)
+    return PolicyNetwork(LevelRenderer.observation_space(VISION_SIZE), n_actions=9).eval()
+
+
+@pytest.fixture(scope='module')
+def observations():
+    rng = np.random.default_rng(0)
+    return LevelRenderer.create_obs_batch([synthetic_payload(rng) for _ in range(64)], 1, VISION_SIZE)
+
+
+def test_torchscript_export_matches_policy(policy, observations, tmp_path):
+    meta = export_policy(policy, observations, tmp_path)
+    assert meta['parity']['max_logit_error'] < 1e-4
+    assert meta['parity']['action_agreement'] == 1.0
+
+    exported = ExportedPolicy(tmp_path)
+    with th.no_grad():
+        expected, values, _ = policy(observations)
+        logits, exported_values, _ = exported(observations)
+    assert th.allclose(logits, expected, atol=1e-4)
+    assert th.allclose(exported_values, values, atol=1e-4)
+
+
+def test_int8_export_keeps_most_greedy_actions(policy, observations, tmp_path):
+    with warnings.catch_warnings():
+        # torch.ao.quantization deprecation warnings
+        warnings.simplefilter('ignore', DeprecationWarning)
+        meta = export_policy(policy, observations, tmp_path, int8=True)
+    assert meta['int8']
+    assert meta['parity']['action_agreement'] >= 0.8
+
+
+def test_onnx_parity_is_measured_with_onnxruntime(policy, observations, tmp_path):
+    pytest.importorskip('onnx')
+    meta = export_policy(policy, observations, tmp_path, fmt='onnx')
+    try:
+        import onnxruntime  # noqa: F401
+    except ImportError:
+        assert 'parity' not in meta
+    else:
+        assert meta['parity']['max_logit_error'] < 1e-4
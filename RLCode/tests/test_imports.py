@@ -0,0 +1,33 @@
+import os
+import subprocess
+import sys
+
+# generous for a loaded CI machine, the core imports in ~250 ms
+BUDGET_MS = 500
+# only imported by the extras: plotting, models, training
+EXTRAS = ['wandb', 'rtgym', 'matplotlib', 'PIL', 'cv2', 'tianshou']
+
+
+def import_times(module):
+    """(names of every module imported, total ms) for a fresh interpreter importing module"""
+    stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], capture_output=True,
+                            text=True, check=True, cwd=os.path.dirname(os.path.dirname(__file__))).stderr
+    names = set()
+    total = 0
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        names.add(name.strip())
+        # nested imports are indented, top level ones add up to the whole import
+        if not name[1:].startswith(' '):
+            total += int(cumulative)
+    return names, total / 1e3
+
+
+def test_env_import_budget():
+    # best of three, the first run pays for cold caches
+    runs = [import_times('celeste_rl.env') for _ in range(3)]
+    names, total = min(runs, key=lambda run: run[1])
+    assert not {name.split('.')[0] for name in names} & set(EXTRAS)
+    assert total < BUDGET_MS
@@ -0,0 +1,84 @@
+import pickle
+import time
+
+import numpy as np
+import pytest
+import torch as th
+
+from celeste_rl.inference import InferenceClient, InferenceError, InferenceServer, PolicyNetwork, load_weights
+from celeste_rl.level import LevelRenderer
+
+VISION_SIZE = 42
+
+
+@pytest.fixture
+def obs_space():
+    return LevelRenderer.observation_space(VISION_SIZE)
+
+
+@pytest.fixture
+def server(obs_space):
+    th.manual_seed(0)
+    policy = PolicyNetwork(obs_space, n_actions=9)
+    with InferenceServer(policy, 'inproc://test-inference', max_wait_ms=0.0, explore=False) as server:
+        yield server
+
+
+def observations(obs_space, batch_size):
+    return {key: np.zeros((batch_size, *space.shape), dtype=space.dtype) for key, space in obs_space.spaces.items()}
+
+
+def test_actions_and_states(obs_space, server):
+    client = InferenceClient(server.endpoint, obs_space)
+    actions, logp, values = client.act(observations(obs_space, 3), np.ones(3, dtype=bool))
+    assert actions.shape == logp.shape == values.shape == (3,)
+    assert len(server.states[next(iter(server.states))]) == 3
+    client.close()
+
+
+def test_bad_request_gets_an_error_reply(obs_space, server):
+    client = InferenceClient(server.endpoint, obs_space)
+    # missing its observation frames
+    client.connection.connect().send_multipart([b'{"first": [true]}'])
+    header, = client.connection.recv_multipart()
+    assert 'error' in header.bytes.decode()
+
+    # the server survived it
+    actions, _, _ = client.act(observations(obs_space, 2), np.ones(2, dtype=bool))
+    assert len(actions) == 2 and server.errors == 1
+    client.close()
+
+
+def test_failed_batch_raises_in_the_client(obs_space, server, monkeypatch):
+    def fail(requests):
+        raise RuntimeError('forward failed')
+    monkeypatch.setattr(server, '_run', fail)
+    client = InferenceClient(server.endpoint, obs_space)
+    with pytest.raises(InferenceError, match='forward failed'):
+        client.act(observations(obs_space, 2), np.ones(2, dtype=bool))
+    client.close()
+
+
+def test_states_of_silent_clients_are_evicted(obs_space, server):
+    client = InferenceClient(server.endpoint, obs_space)
+    client.act(observations(obs_space, 2), np.ones(2, dtype=bool))
+    assert len(server.states) == 1
+
+    server.state_timeout = 0.1
+    server.next_eviction = 0.0
+    time.sleep(0.3)
+    assert server.states == {} and server.last_seen == {}
+    client.close()
+
+
+def test_mismatched_weights_raise_a_clear_error(obs_space, tmp_path):
+    policy = PolicyNetwork(obs_space, n_actions=9)
+    # shaped like the weights of RLlib's default tf2 model
+    weights = {'default_policy/fc_1/kernel': np.zeros((3, 256), dtype=np.float32)}
+    with pytest.raises(ValueError, match='framework="torch"'):
+        load_weights(policy, {key: th.as_tensor(value) for key, value in weights.items()})
+
+    with open(tmp_path / 'policy_state.pkl', 'wb') as f:
+        pickle.dump({'weights': weights}, f)
+    with pytest.raises(ValueError, match='PolicyNetwork'):
+        InferenceServer(policy, 'inproc://test-weights', checkpoint=str(tmp_path))
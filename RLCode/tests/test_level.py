@@ -0,0 +1,88 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+import torch as th
+
+from celeste_rl.level import LevelCache, LevelRenderer
+from celeste_rl.models import expand_image
+from celeste_rl.server import synthetic_payload
+
+VISION_SIZE = 32
+
+
+def padded_render_around_player(renderer):
+    """render_around_player before it was cropped to the vision window, pads the whole level"""
+    pad_size = (renderer.vision_size // 2 + 1) * renderer.scale
+    offset = renderer.vision_size // 2 * renderer.scale
+
+    pad0 = np.pad(renderer.img[:, :, 0:1], ((pad_size,), (pad_size,), (0,)), mode="edge")
+    padrest = np.pad(renderer.img[:, :, 1:], ((pad_size,), (pad_size,), (0,)))
+    padded = np.dstack((pad0, padrest))
+    ys, xs = np.where(padded[:, :, LevelRenderer.ID_MAP['Player']])
+    if len(xs) > 0 and len(ys) > 0:
+        y, x = ys[0], xs[0]
+    else:
+        y, x = renderer.img.shape[0] - 1 + offset, offset
+    return padded[y - offset:y + offset, x - offset:x + offset]
+
+
+@pytest.fixture(scope='module')
+def payloads():
+    """A few rooms in which only the player moves around, like consecutive steps"""
+    rng = np.random.default_rng(0)
+    payloads = []
+    for room in range(3):
+        base = synthetic_payload(rng, n_entities=30, origin=(room * 320, 0))
+        for _ in range(5):
+            step = synthetic_payload(rng, n_entities=1, origin=(room * 320, 0))
+            payloads.append(dict(base, entities=step['entities'] + base['entities'][1:]))
+    return payloads
+
+
+@pytest.mark.parametrize('room_size', [(40, 23), (80, 46)])
+@pytest.mark.parametrize('scale', [1, 2])
+def test_windowed_crop_matches_padded(room_size, scale):
+    rng = np.random.default_rng(0)
+    for _ in range(5):
+        renderer = LevelRenderer.from_payload(synthetic_payload(rng, room_size=room_size), scale, VISION_SIZE)
+        assert np.array_equal(renderer.render_around_player(), padded_render_around_player(renderer))
+
+
+def test_level_cache_matches_create_obs(payloads):
+    cache = LevelCache(1, VISION_SIZE)
+    for payload in payloads:
+        expected = LevelRenderer.create_obs(payload, 1, VISION_SIZE)
+        obs = cache.create_obs(payload)
+        for key in expected:
+            assert np.array_equal(obs[key], expected[key]), key
+    assert cache.misses == 3 and cache.hits == len(payloads) - 3
+
+
+@pytest.mark.parametrize('compact, packbits', [(False, False), (True, False), (True, True)])
+def test_batch_matches_create_obs(payloads, compact, packbits):
+    obs = [LevelRenderer.create_obs(p, 1, VISION_SIZE, compact=compact, packbits=packbits) for p in payloads]
+    expected = {key: np.stack([o[key] for o in obs]) for key in obs[0]}
+
+    out = LevelRenderer.batch_buffers(len(payloads) + 4, VISION_SIZE, compact=compact, packbits=packbits)
+    cache = LevelCache(1, VISION_SIZE, compact=compact, packbits=packbits)
+    with ThreadPoolExecutor(2) as executor:
+        batches = [LevelRenderer.create_obs_batch(payloads, 1, VISION_SIZE, compact, packbits),
+                   LevelRenderer.create_obs_batch(payloads, 1, VISION_SIZE, compact, packbits, out=out),
+                   LevelRenderer.create_obs_batch(payloads, 1, VISION_SIZE, compact, packbits, executor=executor),
+                   cache.create_obs_batch(payloads)]
+    space = LevelRenderer.observation_space(VISION_SIZE, compact=compact, packbits=packbits)
+    for batch in batches:
+        for key in expected:
+            assert np.array_equal(batch[key], expected[key]), key
+            assert batch[key].dtype == space[key].dtype
+
+
+@pytest.mark.parametrize('packbits', [False, True])
+def test_compact_image_expands_back(payloads, packbits):
+    expected = LevelRenderer.create_obs_batch(payloads, 1, VISION_SIZE)['image']
+    compact = LevelRenderer.create_obs_batch(payloads, 1, VISION_SIZE, compact=True, packbits=packbits)
+    image = expand_image(compact['image'], compact.get('entities'))
+    # solids go through uint8, entity channels are exact
+    assert th.allclose(image, th.as_tensor(expected), atol=1 / 255)
+    assert th.equal(image[:, 1:], th.as_tensor(expected[:, 1:]))
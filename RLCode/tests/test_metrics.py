@@ -0,0 +1,56 @@
+import time
+
+import numpy as np
+import pytest
+
+from celeste_rl.metrics import Histogram, MetricsAggregator, VecMetrics
+from celeste_rl.server import StandInPool
+from celeste_rl.timing import StepTimer
+from celeste_rl.vec_env import CelesteVecEnv
+
+
+@pytest.mark.parametrize('log', [False, True])
+def test_histogram_quantiles_are_within_a_bin(log):
+    values = np.random.default_rng(0).lognormal(3, 1, 10_000)
+    histogram = Histogram(1, 1e3, n_bins=200, log=log)
+    histogram.observe(values)
+    for q in (0.1, 0.5, 0.9):
+        idx = np.searchsorted(histogram.edges, np.quantile(values, q))
+        # the bin of the exact quantile, or the one next to it
+        assert histogram.edges[max(idx - 2, 0)] <= histogram.quantile(q) <= histogram.edges[idx + 1]
+    assert histogram.summary()['count'] == len(values)
+
+
+def test_step_timer_quantiles_match_histogram():
+    timer = StepTimer(spans=('span',))
+    histogram = Histogram(1e3, 1e9, n_bins=48, log=True)
+    durations = np.random.default_rng(0).integers(1_000, 10 ** 7, 1000)
+    for duration in durations:
+        timer.record_step(0, int(duration))
+    histogram.observe(durations)
+    assert timer.quantile(timer.episode[0], 0.5) == pytest.approx(histogram.quantile(0.5))
+
+
+def test_unhealthy_instance_is_not_counted_as_episodes():
+    metrics = MetricsAggregator()
+    with StandInPool(7870, 2, episode_length=10 ** 6) as pool:
+        env = VecMetrics(CelesteVecEnv(pool.ports, timeout=100), metrics=metrics)
+        env.reset()
+        actions = np.zeros(2, dtype=np.int64)
+        env.step(actions)
+
+        pool.servers[1].latency = 0.5
+        for _ in range(10):
+            env.step(actions)
+        pool.servers[1].latency = 0.0
+        time.sleep(1.0)
+        for _ in range(3):
+            env.step(actions)
+        env.env.close()
+        metrics.stop()
+
+    summary = metrics.snapshot()
+    assert summary['episodes_total'] == 0 and summary['truncations_total'] == 0
+    assert summary['unhealthy_steps_total'] == 10
+    # instance 0 played every step, instance 1 the one before its failure and the ones after its reset
+    assert summary['steps_total'] == 14 + 1 + 2
@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+import torch as th
+from gymnasium import spaces
+
+from celeste_rl.level import LevelRenderer
+from celeste_rl.models import CustomCombinedExtractor, ImprovisedCNN
+
+VISION_SIZE = 42
+
+
+def image_space():
+    size = VISION_SIZE // 2 * 2
+    return spaces.Box(low=0, high=1, shape=(LevelRenderer.max_idx + 1, size, size), dtype=np.float32)
+
+
+def observations(batch_size, seed=0):
+    rng = np.random.default_rng(seed)
+    obs_space = LevelRenderer.observation_space(VISION_SIZE)
+    return {key: (rng.random((batch_size, *space.shape)) > 0.8).astype(space.dtype) if key == 'image'
+            else rng.normal(size=(batch_size, *space.shape)).astype(space.dtype)
+            for key, space in obs_space.spaces.items()}
+
+
+def loop_forward(model, image):
+    """Per-channel loop ImprovisedCNN.forward used before the gather"""
+    fullobs = th.empty((image.shape[0], model.n_space * 2, *image.shape[-2:]))
+    for i in range(len(LevelRenderer.ID_MAP)):
+        fullobs[:, i * 2] = image[:, i]
+        fullobs[:, i * 2 + 1] = image[:, LevelRenderer.ID_MAP['Player']]
+    return model.linear(model.cnn(fullobs))
+
+
+def test_improvised_cnn_matches_loop():
+    th.manual_seed(0)
+    model = ImprovisedCNN(image_space())
+    image = th.as_tensor(observations(8)['image'])
+    with th.no_grad():
+        assert th.allclose(model(image), loop_forward(model, image), atol=1e-6)
+
+
+@pytest.mark.parametrize('compile_mode', ['script', 'compile'])
+def test_improvised_cnn_compile_matches_eager(compile_mode):
+    th.manual_seed(0)
+    eager = ImprovisedCNN(image_space())
+    th.manual_seed(0)
+    # same seed, same weights: compiled modules wrap theirs, so their state dict keys differ
+    compiled = ImprovisedCNN(image_space(), compile_mode=compile_mode)
+
+    image = th.as_tensor(observations(8)['image'])
+    with th.no_grad():
+        assert th.allclose(compiled(image), eager(image), atol=1e-5)
+
+
+@pytest.mark.parametrize('compile_mode', ['script', 'compile'])
+def test_combined_extractor_compile_matches_eager(compile_mode):
+    obs_space = LevelRenderer.observation_space(VISION_SIZE)
+    th.manual_seed(0)
+    eager = CustomCombinedExtractor(obs_space)
+    th.manual_seed(0)
+    compiled = CustomCombinedExtractor(obs_space, compile_mode=compile_mode)
+    assert compiled.features_dim == eager.features_dim
+
+    obs = observations(8)
+    with th.no_grad():
+        expected, _ = eager(obs)
+        features, _ = compiled(obs)
+    assert features.shape == (8, eager.features_dim)
+    assert th.allclose(features, expected, atol=1e-5)
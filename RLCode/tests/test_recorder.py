@@ -0,0 +1,131 @@
+import numpy as np
+import pytest
+
+from celeste_rl.env import CelesteImgGym
+from celeste_rl.recorder import TrajectoryDataset, TrajectoryRecorder, TrajectoryWriter
+from celeste_rl.server import StandInServer
+
+EPISODE_LENGTH = 6
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    """Two episodes of a stand-in, recorded, rewards vary with the actions"""
+    path = tmp_path / 'dataset'
+    with StandInServer(7860, episode_length=EPISODE_LENGTH):
+        env = TrajectoryRecorder(CelesteImgGym(7860), str(path), chunk_size=4)
+        for _ in range(2):
+            env.reset()
+            terminated = False
+            while not terminated:
+                _, _, terminated, _, _ = env.step(env.action_space.sample())
+        env.close()
+    return str(path)
+
+
+def test_recorded_episodes(dataset):
+    data = TrajectoryDataset(dataset)
+    assert data.n_episodes == 2
+    # reset row, then one row per step until terminated
+    assert len(data) == 2 * (EPISODE_LENGTH + 1)
+    start, end = data.episode_bounds(1)
+    assert data.columns['action'][start] == -1
+    assert data.columns['terminated'][end - 1] and not data.columns['terminated'][start:end - 1].any()
+
+    batch = data.sample_transitions(16, rng=np.random.default_rng(0))
+    assert batch['obs']['image'].shape == batch['next_obs']['image'].shape == (16, 42, 42, 3)
+
+
+def test_replay_round_trip(dataset):
+    data = TrajectoryDataset(dataset)
+    with StandInServer.from_dataset(7861, dataset):
+        env = CelesteImgGym(7861)
+        for episode in range(2):
+            start, end = data.episode_bounds(episode)
+            obs, _ = env.reset()
+            assert np.array_equal(obs['image'], data.columns['obs.image'][start])
+            for row in range(start + 1, end):
+                obs, reward, terminated, _, _ = env.step(0)
+                assert np.array_equal(obs['image'], data.columns['obs.image'][row])
+                assert reward == pytest.approx(data.columns['reward'][row])
+                assert terminated == (row == end - 1)
+
+        # past the end of the last recorded episode: its last frame, terminated, until the next reset
+        for _ in range(3):
+            obs, reward, terminated, _, _ = env.step(0)
+            assert terminated and reward == 0
+            assert np.array_equal(obs['image'], data.columns['obs.image'][end - 1])
+        obs, _ = env.reset()
+        assert np.array_equal(obs['image'], data.columns['obs.image'][0])
+        env.close()
+
+
+def test_writer_stops_at_the_first_error(tmp_path):
+    writer = TrajectoryWriter(str(tmp_path), chunk_size=4)
+    for i in range(3):
+        writer.append({'x': np.float32(i), 'image': np.zeros((2, 2), dtype=np.uint8)}, new_episode=i == 0)
+    # wrong shape, nothing of it is written
+    writer.append({'x': np.float32(3), 'image': np.zeros((3, 3), dtype=np.uint8)})
+    with pytest.raises(ValueError):
+        writer.flush()
+    with pytest.raises(ValueError):
+        writer.append({'x': np.float32(4), 'image': np.zeros((2, 2), dtype=np.uint8)})
+    with pytest.raises(ValueError):
+        writer.close()
+
+    data = TrajectoryDataset(str(tmp_path))
+    assert len(data) == 3
+    assert len(data.columns['x']) == len(data.columns['image']) == 3
+    assert list(data.columns['x']) == [0, 1, 2]
+
+
+def test_recorder_raises_on_the_next_step(tmp_path):
+    with StandInServer(7862, episode_length=10):
+        env = TrajectoryRecorder(CelesteImgGym(7862), str(tmp_path))
+        env.reset()
+        env.writer.append({'unknown': np.float32(0)})
+        env.writer.queue.join()
+        with pytest.raises(ValueError, match='do not match'):
+            env.step(0)
+        env.env.close()
+
+
+def test_sampling_an_empty_dataset(tmp_path):
+    writer = TrajectoryWriter(str(tmp_path))
+    writer.append({'obs.image': np.zeros((2, 2), dtype=np.uint8), 'action': np.int64(-1), 'reward': np.float32(0),
+                   'terminated': False, 'truncated': False}, new_episode=True)
+    writer.close()
+
+    data = TrajectoryDataset(str(tmp_path))
+    # a single reset row: no transition yet
+    with pytest.raises(ValueError, match='no step after a reset'):
+        data.sample_transitions(4)
+    assert len(data.sample(4)['action']) == 4
+
+
+def test_reopening_a_torn_dataset(tmp_path):
+    path = str(tmp_path)
+    writer = TrajectoryWriter(path)
+    for i in range(3):
+        writer.append({'x': np.float32(i), 'payload': b'%d' % i}, new_episode=i == 0)
+    writer.close()
+
+    # a writer that stopped midway: x and the payload bytes hold a fourth row, its offset and episode start too
+    with open(tmp_path / 'x.bin', 'ab') as f:
+        f.write(np.float32(3).tobytes())
+    with open(tmp_path / 'payload.bin', 'ab') as f:
+        f.write(b'3')
+    with open(tmp_path / 'episodes.bin', 'ab') as f:
+        f.write(np.int64(3).tobytes())
+    assert len(TrajectoryDataset(path)) == 3
+
+    writer = TrajectoryWriter(path)
+    for i in range(4, 6):
+        writer.append({'x': np.float32(i), 'payload': b'%d' % i}, new_episode=i == 4)
+    writer.close()
+
+    data = TrajectoryDataset(path)
+    assert len(data) == len(data.columns['x']) == len(data.offsets['payload']) == 5
+    assert list(data.columns['x']) == [0, 1, 2, 4, 5]
+    assert [data.bytes('payload', i) for i in range(5)] == [b'0', b'1', b'2', b'4', b'5']
+    assert list(data.episode_starts) == [0, 3]
@@ -0,0 +1,89 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from celeste_rl.connection import InstanceUnhealthy
+from celeste_rl.env import CelesteImgGym
+from celeste_rl.registry import InstanceRegistry, LeasedEnv, RegistryClient, RegistryServer
+from celeste_rl.server import StandInServer
+
+HOST = 'localhost'
+PORTS = [7890, 7891, 7892]
+
+
+@pytest.fixture
+def registry(tmp_path):
+    registry = InstanceRegistry(str(tmp_path / 'instances.json'))
+    for port in PORTS:
+        registry.register(host=HOST, port=port)
+    return registry
+
+
+def make_env(host, port):
+    return CelesteImgGym(port, host=host, timeout=100, retries=1)
+
+
+def dead_pid():
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return process.pid
+
+
+def test_leases_are_distinct_and_sticky(registry):
+    leased = {(worker, vector): registry.lease(worker_index=worker, vector_index=vector)['port']
+              for worker in (1, 2) for vector in (0,)}
+    leased[1, 1] = registry.lease(worker_index=1, vector_index=1)['port']
+    assert sorted(leased.values()) == PORTS
+
+    # every instance is taken, an index that holds a lease gets its instance back
+    with pytest.raises(LookupError):
+        registry.lease(worker_index=3, vector_index=0)
+    assert registry.lease(worker_index=2, vector_index=0)['port'] == leased[2, 0]
+
+
+def test_lease_released_on_close(registry):
+    env = LeasedEnv(make_env, registry, worker_index=1, vector_index=0)
+    assert set(registry.leases()) == {'1/0'}
+    env.close()
+    assert registry.leases() == {}
+
+
+def test_leases_of_dead_processes_are_reaped(registry):
+    registry.lease(worker_index=1, vector_index=0, pid=dead_pid())
+    registry.lease(worker_index=2, vector_index=0)
+    assert set(registry.leases()) == {'2/0'}
+
+
+def test_leases_through_a_server_belong_to_the_client(tmp_path):
+    server = RegistryServer(str(tmp_path / 'instances.json'), port=7895)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = RegistryClient('tcp://localhost:7895')
+    client.register(host=HOST, port=PORTS[0])
+
+    # a client process that exits without releasing its lease
+    code = ("from celeste_rl.registry import RegistryClient; "
+            "RegistryClient('tcp://localhost:7895').lease(worker_index=1, vector_index=0)")
+    subprocess.run([sys.executable, '-c', code], check=True, cwd=os.path.dirname(os.path.dirname(__file__)))
+    assert set(client.leases()) == {'1/0'}
+
+    assert client.lease(worker_index=2, vector_index=0)['port'] == PORTS[0]
+    assert client.leases()['2/0']['pid'] == os.getpid()
+
+
+def test_instance_healthy_again_once_it_answers(registry):
+    with StandInServer(PORTS[0], latency=0.3) as server:
+        env = LeasedEnv(make_env, registry, worker_index=1, vector_index=0)
+        with pytest.raises(InstanceUnhealthy):
+            env.reset()
+        assert registry.instances(healthy_only=True) == registry.instances()[1:]
+
+        # done with the late request
+        time.sleep(0.3)
+        server.latency = 0.0
+        env.reset()
+        assert len(registry.instances(healthy_only=True)) == len(PORTS)
+        env.close()
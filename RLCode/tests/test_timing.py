@@ -0,0 +1,47 @@
+import numpy as np
+
+from celeste_rl.env import CelesteImgGym
+from celeste_rl.protocol import JSON_PROTOCOL
+from celeste_rl.server import StandInServer
+from celeste_rl.timing import SPANS
+from celeste_rl.vec_env import CelesteVecEnv
+
+
+def test_decode_span_covers_the_png_decode():
+    with StandInServer(7850, episode_length=10):
+        env = CelesteImgGym(7850, protocol=JSON_PROTOCOL, timing=True)
+        env.reset()
+        for _ in range(10):
+            *_, terminated, _, info = env.step(0)
+        env.close()
+    assert terminated
+    summary = info['timing']
+    assert summary['steps'] == 10
+    # the png of each frame is decoded in the decode span, the reply header is only parsed
+    assert summary['decode_mean_us'] > summary['parse_mean_us']
+
+
+def test_vec_env_records_every_step():
+    with StandInServer(7851, episode_length=10 ** 6), StandInServer(7852, episode_length=10 ** 6):
+        env = CelesteVecEnv([7851, 7852], timing=True, max_episode_steps=5)
+        env.reset()
+        for _ in range(8):
+            env.step(np.zeros(2, dtype=np.int64))
+        env.close()
+    for instance in env.envs:
+        # 5 steps, the reset, then 2 steps of the next episode
+        assert instance.timer.episodes == 1
+        assert instance.timer.last['steps'] == 5 and instance.timer.episode_steps == 2
+        assert set(SPANS) <= {key.split('_mean_us')[0] for key in instance.timer.last}
+
+
+def test_step_sequence_is_timed():
+    with StandInServer(7853, episode_length=10):
+        env = CelesteImgGym(7853, timing=True, action_repeat=2)
+        env.reset()
+        env.step(0)
+        *_, terminated, _, info = env.step_sequence([0, 1, 2, 3])
+        env.close()
+    # the episode ends during the sequence, one request per step
+    assert terminated
+    assert info['timing']['steps'] == 2
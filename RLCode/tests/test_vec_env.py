@@ -0,0 +1,70 @@
+import time
+
+import numpy as np
+import pytest
+
+from celeste_rl.server import StandInPool
+from celeste_rl.vec_env import CelesteVecEnv
+
+TIMEOUT_MS = 100
+
+
+@pytest.fixture
+def pool():
+    with StandInPool(7840, 2, episode_length=10 ** 6) as pool:
+        yield pool
+
+
+@pytest.fixture
+def env(pool):
+    env = CelesteVecEnv(pool.ports, timeout=TIMEOUT_MS)
+    env.reset()
+    yield env
+    env.close()
+
+
+def test_observation_space_matches_buffers(env):
+    obs, *_ = env.step(np.zeros(env.num_envs, dtype=np.int64))
+    assert obs['image'].dtype == env.single_observation_space['image'].dtype
+    assert env.observation_space.contains(obs)
+
+
+def test_silent_instance_is_truncated_once(pool, env):
+    actions = np.zeros(env.num_envs, dtype=np.int64)
+    pool.servers[1].latency = 0.5
+    _, rewards, terminated, truncated, info = env.step(actions)
+    assert list(truncated) == [False, True]
+    assert rewards[1] == 0
+    assert list(info['unhealthy']) == [False, True]
+
+    # skipped during its backoff: no new truncation, and the others are not blocked
+    start = time.monotonic()
+    for _ in range(5):
+        _, _, terminated, truncated, info = env.step(actions)
+        assert not truncated.any() and not terminated.any()
+        assert list(info['unhealthy']) == [False, True]
+    assert time.monotonic() - start < TIMEOUT_MS / 1000
+
+    pool.servers[1].latency = 0.0
+    # the stalled reply, then the backoff of the first failure
+    time.sleep(1.0)
+    _, _, _, truncated, info = env.step(actions)
+    assert not truncated.any()
+    assert env.healthy.all() and info == {}
+
+
+def test_reset_at_does_not_wait_on_an_unhealthy_instance(pool, env):
+    pool.servers[0].latency = 0.5
+    env.step(np.zeros(env.num_envs, dtype=np.int64))
+    assert not env.healthy[0]
+
+    image = env._images[0].copy()
+    start = time.monotonic()
+    assert not env._reset_at(0)
+    assert time.monotonic() - start < TIMEOUT_MS / 1000
+    assert np.array_equal(env._images[0], image)
+
+    pool.servers[0].latency = 0.0
+    time.sleep(1.0)
+    assert env._reset_at(0)
+    assert env.healthy[0] and not env._truncated[0]
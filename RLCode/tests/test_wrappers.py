@@ -0,0 +1,112 @@
+import time
+from collections import deque
+
+import numpy as np
+import pytest
+
+from celeste_rl.env import CelesteImgGym
+from celeste_rl.server import StandInPool, StandInServer
+from celeste_rl.vec_env import CelesteVecEnv
+from celeste_rl.wrappers import FrameRing, FrameStack, VecFrameStack
+
+K = 3
+EPISODE_LENGTH = 5
+
+
+def reference(frames, steps):
+    """Deque stack of a stand-in's frames, `steps` steps into an episode"""
+    history = deque([frames[0]] * K, maxlen=K)
+    for step in range(1, steps + 1):
+        history.append(frames[step % len(frames)])
+    return np.stack(history)
+
+
+@pytest.fixture
+def pool():
+    with StandInPool(7900, 2, episode_length=EPISODE_LENGTH) as pool:
+        yield pool
+
+
+def test_ring_matches_a_deque():
+    rng = np.random.default_rng(0)
+    ring = FrameRing(K, (2,), np.int64, num_envs=3)
+    first = rng.integers(0, 100, size=(3, 2))
+    ring.reset(first)
+    histories = [deque([frame] * K, maxlen=K) for frame in first]
+
+    for step in range(4 * K):
+        # every stream, then a subset of them
+        env_ids = np.arange(3) if step % 2 else np.array([0, 2])
+        frames = rng.integers(0, 100, size=(len(env_ids), 2))
+        ring.push(frames, env_ids)
+        for i, frame in zip(env_ids, frames):
+            histories[i].append(frame)
+        assert np.array_equal(ring.stacked(), np.stack([np.stack(history) for history in histories]))
+        assert np.array_equal(ring.stacked([1]), np.stack(histories[1])[None])
+
+
+def test_frame_stack_order_and_refill():
+    with StandInServer(7902, episode_length=EPISODE_LENGTH) as server:
+        env = FrameStack(CelesteImgGym(7902), num_stack=K)
+        obs, _ = env.reset()
+        assert np.array_equal(obs['image'], reference(server.frames, 0))
+        for step in range(1, EPISODE_LENGTH + 1):
+            obs, _, terminated, _, _ = env.step(0)
+            assert np.array_equal(obs['image'], reference(server.frames, step))
+        assert terminated
+
+        obs, _ = env.reset()
+        assert np.array_equal(obs['image'], reference(server.frames, 0))
+        env.close()
+
+
+def test_vec_frame_stack_refills_after_termination(pool):
+    env = VecFrameStack(CelesteVecEnv(pool.ports), num_stack=K)
+    obs, _ = env.reset()
+    actions = np.zeros(env.num_envs, dtype=np.int64)
+    for step in range(1, 2 * (EPISODE_LENGTH + 1)):
+        obs, *_ = env.step(actions)
+        # the step after the termination is the reset
+        for i, server in enumerate(pool.servers):
+            assert np.array_equal(obs['image'][i], reference(server.frames, step % (EPISODE_LENGTH + 1)))
+    env.close()
+
+
+def test_vec_frame_stack_recv_subset(pool):
+    env = VecFrameStack(CelesteVecEnv(pool.ports), num_stack=K)
+    env.reset()
+    frames = [server.frames for server in pool.servers]
+    for step in range(1, K + 2):
+        env.send([0], env_ids=[0])
+        obs, *_, info = env.recv(batch_size=1)
+        assert list(info['env_id']) == [0]
+        assert np.array_equal(obs['image'][0], reference(frames[0], step))
+
+    # instance 1 only takes its first step now
+    env.send([0, 0])
+    obs, *_, info = env.recv(batch_size=2)
+    steps = {0: K + 2, 1: 1}
+    for row, i in enumerate(info['env_id']):
+        assert np.array_equal(obs['image'][row], reference(frames[i], steps[i]))
+    env.close()
+
+
+def test_vec_frame_stack_refills_after_recovery(pool):
+    env = VecFrameStack(CelesteVecEnv(pool.ports, timeout=100), num_stack=K)
+    env.reset()
+    actions = np.zeros(env.num_envs, dtype=np.int64)
+    env.step(actions)
+
+    pool.servers[1].latency = 0.5
+    for _ in range(3):
+        _, _, _, _, info = env.step(actions)
+        assert info['unhealthy'][1]
+
+    pool.servers[1].latency = 0.0
+    # the stalled reply, then the backoff of the first failure
+    time.sleep(1.0)
+    obs, _, _, _, info = env.step(actions)
+    assert 'unhealthy' not in info
+    # the recovery reply is the reset of a new episode, nothing of the one before the failure is kept
+    assert np.array_equal(obs['image'][1], reference(pool.servers[1].frames, 0))
+    env.close()